@@ -0,0 +1,179 @@
+import threading
+
+import numpy as np
+
+import database
+
+# Sort value of cells without stock in the low stock orderings, above any threshold
+_NO_STOCK = np.iinfo(np.int64).max
+
+# Most changed cells applied to the matrix from the change log; beyond this
+# reading the whole stok table again is as quick
+INCREMENTAL_MAX_CHANGES = 50000
+
+
+class StockMatrix:
+    """
+    The whole stok table as a dense items x gudangs NumPy matrix, read at one
+    data version. Rows are ordered by category and name, so every category
+    is a contiguous block of rows; columns follow get_all_gudangs().
+
+    Orderings behind the top-N and low stock queries are sorted once per
+    value vector and category on first use and cached, so a repeated query
+    is a slice plus a binary search.
+    """
+
+    def __init__(self, version, gudangs, ids, names, categories, quantities, item_order):
+        self.version = version
+        self.gudangs = gudangs
+        self.gudang_index = {gname: column for column, (_, gname) in enumerate(gudangs)}
+        self.gudang_ids = np.array([gid for gid, _ in gudangs], dtype=np.int64)
+        self.ids = ids
+        self.item_order = item_order
+        self.names = names
+        self.categories = categories
+        self.quantities = quantities
+        self.totals = quantities.sum(axis=1)
+
+        starts = np.flatnonzero(np.r_[True, categories[1:] != categories[:-1]]) if len(ids) else np.empty(0, dtype=np.intp)
+        stops = np.r_[starts[1:], len(ids)].astype(np.intp)
+        self.category_names = [categories[start] for start in starts]
+        self.category_slices = {name: (start, stop) for name, start, stop in zip(self.category_names, starts, stops)}
+        self.category_items = stops - starts
+        self.category_sums = (
+            np.add.reduceat(quantities, starts, axis=0) if len(ids)
+            else np.zeros((0, len(gudangs)), dtype=np.int64)
+        )
+        self._orders = {}
+
+    def locate(self, ceramic_ids, gudang_ids):
+        """
+        Maps arrays of keramik and gudang ids to (rows, columns), by binary
+        search; None if any id is not in the matrix.
+        """
+        positions = np.searchsorted(self.ids, ceramic_ids, sorter=self.item_order)
+        columns = np.searchsorted(self.gudang_ids, gudang_ids)
+        if len(ceramic_ids) and (positions.max() >= len(self.ids) or columns.max() >= len(self.gudang_ids)):
+            return None
+        rows = self.item_order[positions]
+        if not (np.array_equal(self.ids[rows], ceramic_ids) and np.array_equal(self.gudang_ids[columns], gudang_ids)):
+            return None
+        return rows, columns
+
+    def _slice(self, category):
+        if category is None:
+            return 0, len(self.ids)
+        return self.category_slices.get(category, (0, 0))
+
+    def _values(self, key, column):
+        if key == "quantity":
+            return self.totals if column is None else self.quantities[:, column]
+        # "low": the smallest quantity above 0, only cells in stock can be low
+        cells = self.quantities if column is None else self.quantities[:, column:column + 1]
+        return np.where(cells > 0, cells, _NO_STOCK).min(axis=1, initial=_NO_STOCK)
+
+    def _sorted(self, key, column, category, descending=False):
+        # (rows, values) of the category ordered by value, ties in row order
+        cache_key = (key, column, category, descending)
+        cached = self._orders.get(cache_key)
+        if cached is None:
+            start, stop = self._slice(category)
+            values = self._values(key, column)[start:stop]
+            order = np.argsort(-values if descending else values, kind="stable")
+            cached = (order + start, values[order])
+            self._orders[cache_key] = cached
+        return cached
+
+    def top_items(self, n, column=None, category=None, ascending=False):
+        """
+        Rows of the n items with the most stock in total, or in the gudang
+        at column, optionally within one category; the least with ascending.
+        """
+        rows, _ = self._sorted("quantity", column, category, descending=not ascending)
+        return rows[:n]
+
+    def low_stock(self, threshold, column=None, category=None):
+        """
+        Rows of the items with a quantity from 1 up to threshold in any
+        gudang, or in the gudang at column, lowest first; the same rule as
+        the low_stock counts of the summary.
+        """
+        rows, values = self._sorted("low", column, category)
+        return rows[:np.searchsorted(values, threshold, side="right")]
+
+    def item(self, row):
+        """Returns (id, nama, category, total, quantities) of a row, quantities aligned with gudangs."""
+        return int(self.ids[row]), self.names[row], self.categories[row], int(self.totals[row]), self.quantities[row].tolist()
+
+
+def load_stock_matrix(conn=None):
+    """Reads keramik, gudang and every non-zero stok cell into a StockMatrix."""
+    with database.transaction(conn, immediate=False) as conn:
+        version = database.get_data_version(conn)
+        gudangs = conn.execute("SELECT id, nama FROM gudang ORDER BY id").fetchall()
+        items = conn.execute("SELECT id, nama, category FROM keramik ORDER BY category, nama").fetchall()
+        cells = np.array(
+            conn.execute("SELECT ceramic_id, gudang_id, quantity FROM stok WHERE quantity <> 0").fetchall(),
+            dtype=np.int64,
+        ).reshape(-1, 3)
+
+    ids = np.array([row[0] for row in items], dtype=np.int64)
+    names = np.array([row[1] for row in items], dtype=object)
+    categories = np.array([row[2] for row in items], dtype=object)
+    gudang_ids = np.array([gid for gid, _ in gudangs], dtype=np.int64)
+
+    # Foreign keys guarantee every cell a row and a column
+    item_order = np.argsort(ids)
+    rows = item_order[np.searchsorted(ids, cells[:, 0], sorter=item_order)]
+    columns = np.searchsorted(gudang_ids, cells[:, 1])
+    quantities = np.zeros((len(ids), len(gudangs)), dtype=np.int64)
+    quantities[rows, columns] = cells[:, 2]
+    return StockMatrix(version, gudangs, ids, names, categories, quantities, item_order)
+
+
+def refresh_stock_matrix(matrix, conn=None):
+    """
+    Returns a StockMatrix of the current data version made from matrix and
+    the stock cells changed since its version, read from the change log.
+    Returns None when items or gudangs changed, the log no longer reaches
+    back that far or more than INCREMENTAL_MAX_CHANGES cells changed; the
+    caller then loads the matrix anew.
+    """
+    result = database.get_changes_since(matrix.version, conn=conn)
+    if result is None:
+        return None
+    version, changes = result
+    if len(changes) > INCREMENTAL_MAX_CHANGES or any(entity != "stok" for entity, *_ in changes):
+        return None
+    cells = np.array(
+        [(ceramic_id, gudang_id, quantity or 0) for _, _, ceramic_id, gudang_id, quantity, _, _ in changes],
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    located = matrix.locate(cells[:, 0], cells[:, 1])
+    if located is None:
+        return None
+    quantities = matrix.quantities.copy()
+    quantities[located] = cells[:, 2]
+    return StockMatrix(version, matrix.gudangs, matrix.ids, matrix.names, matrix.categories, quantities, matrix.item_order)
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+
+def get_matrix():
+    """
+    Returns the StockMatrix of the current data version. It is brought up
+    to date lazily: the first call after a write applies the changed stock
+    cells (see refresh_stock_matrix()) or reads the tables again, every
+    other call only compares the data version.
+    """
+    global _matrix
+    version = database.get_data_version()
+    matrix = _matrix
+    if matrix is not None and matrix.version == version:
+        return matrix
+    with _matrix_lock:
+        if _matrix is None or _matrix.version != version:
+            _matrix = (_matrix is not None and refresh_stock_matrix(_matrix)) or load_stock_matrix()
+        return _matrix
@@ -1,16 +1,41 @@
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, HTTPException, status
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-import sqlite3
-import re
-import io
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import asyncio
+import base64
+import datetime
+import gzip
+import json
+import os
+import threading
+import time
+from typing import List, Literal, Optional, Union
+
+import orjson
+from pydantic import BaseModel, Field
 
 from database import (
     init_db, add_ceramic, get_all_ceramics, add_gudang, get_all_gudangs, 
     update_stock, get_stock_details, delete_ceramic, delete_gudang, 
-    get_stock_by_ceramic_and_gudang, get_or_create_gudang, get_or_create_ceramic
+    get_stock_by_ceramic_and_gudang, get_or_create_gudang, get_or_create_ceramic,
+    query_stock, import_stock_batch, STOCK_SORT_KEYS,
+    get_data_version, transaction, get_changes_since, get_stock_summary, LOW_STOCK_THRESHOLD,
+    get_stock_snapshots, get_stock_as_of, get_stock_movement, open_stock_export, observe_commits,
+    adjust_stock, AdjustmentError, AdjustmentConflict
+)
+from classifier import CATEGORIES
+from importer import (
+    ImportFormatError, normalize_ceramic_name, open_workbook, write_workbook, diff_workbook, read_workbooks,
+    import_summary
 )
+from exporter import export_header, export_rows, stream_csv, stream_xlsx
+from analytics import get_matrix
+from writer import run_write, run_bulk_write
+from jobs import submit_import, get_job, list_jobs, cancel_job, save_upload
+from metrics import record_request, render_metrics
 
 # Initialize the database here since the backend is now managing it
 init_db()
@@ -31,69 +56,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Data-Version", "X-Next-Cursor", "Content-Disposition"],
 )
 
-def normalize_ceramic_name(name):
-    name = str(name).strip().upper()
-    # Hapus suffix varian
-    name = re.sub(r'\s*(KW1-B|KW2-B|KW1-N|KW1-G|KW-1|KW-2|KW1|KW2|I|II)$', '', name)
-    # Ganti 'GR' atau 'GRIS' menjadi 'GRISS' jika di akhir nama
-    name = re.sub(r'\s*(GR|GRIS)$', 'GRISS', name)
-    # Hapus spasi berlebih
-    name = re.sub(r'\s+', ' ', name).strip()
-    return name
-
-def get_category_by_name(name):
-    name_upper = str(name).strip().upper()
-    if "PINGUL" in name_upper or "PINGULAN" in name_upper or "GRAMETINDO" in name_upper:
-        return "PINGUL"
-    if "LIST" in name_upper:
-        return "LIST"
-    if name_upper.startswith("AM ") or " AM " in name_upper or "LEMKRA" in name_upper:
-        return "NAT"
-    if any(k in name_upper for k in ["STEP", "STP", "STEPNOSING"]):
-        return "STEPNOSING"
-    if any(k in name_upper for k in [
-        "KRAN", "STOP KRAN", "AUGUSTO", "BRACHIO", "GRAVINO", "VILANOVA",
-        "EXCEL", "SOBAR", "DEVEN", "HALMAR", "EINER", "CLASSIC", "FLEX",
-        "ISCO", "SAVITAR", "APOLLO", "WALLSHOWER", "SHOWER", "HANDSHOWER",
-        "ALPHARD", "HAWAI", "GENTONG", "COUPLING", "UNION", "SELANG", "BCP",
-        "PEMBERSIH", "SARGOT", "AVOR", "SARINGAN", "HANDLE", "BOSSINI",
-        "SAPHIRA", "ENGSEL", "KUNCI", "BOLZANO", "GRENDEL", "LAMPU", "RH",
-        "KAPSTOCK", "TISSUE", "KORDEN", "BAUT", "KAPSTK", "FIONI", "BATHUB",
-        "KAPS", "RAK", "KACA", "PISAU", "GERGAJI", "PENGUIN", "PROFIL", "PELAMPUNG",
-        "WATERHEAT", "WTRHEAT", "WATER HEATER", "WATER HEAT", "PELOR", "GIGI",
-        "TOILET", "COOKER", "KOMPOR", "KITCHEN", "ANGZDOOR", "PKM",
-        "BELLEZA", "COSTO", "DUPON", "FIDEM", "HAND SHOW", "BATH+SHOW", "K DIND",
-        "K DOUBLE", "K SHOW", "K TAMAN", "K WAST", "PLANGSET", "PLST+T", "RING H",
-        "SHOW BIDET", "SHW TNG", "STOP K", "SABUN", "TS CAIR", "WAST +KAB+KC",
-        "HANSA", "MOVE", "OULUSOLID", "SPC", "TASIN", "TOTO", "TRILLIUN", "TRISENSA",
-        "VAPELY", "MAGNET", "SPRINGKNEE", "WASSER", "CABINET",
-        "GERMANY", "IGM", "MASPION", "MERIDIAN", "OULU", "SOLID", "TUTUP", "HAK ANGIN"
-    ]):
-        return "Sanitari"
-    if any(k in name_upper for k in [
-        "ARNA 60/60", "RMN", "CERANOSA", "RUDY", "GRD", "PASADENA", "SANDIMAS",
-        "ALTHEA", "HELA", "IMPERIAL", "MAXNUM", "MELIUZ", "PAVIA", "REXTON",
-        "A&F", "CERA TILES", "CYAN", "GOLFGRES", "SMART TILES", "AMADEO", "COVE",
-        "GRANIT88", "GROSETO", "QIAOHUI", "ZED", "GRANITO", "NIRO", "DECOGRESS",
-        "INDECOR", "INDOGRES", "GRANIT", "CAVALLO", "CIMETRIC", "PEGASUS",
-        "WHTHORSE", "D-EURO", "TOPFRES", "IKAD", "SUNPWR", "CAVALI", "CITIGRES",
-        "ROTA", "SCAFATI", "PLATINUM", "CENTRO",
-        "A&Y", "DECOGRES 60X60", "GOLGRES", "PORTINO", "SPEEDO", "TOPGRES", "TOSCANA",
-        "DECOGRES 60/60", "WHTHRSE"
-    ]):
-        return "Granit"
-    if any(k in name_upper for k in [
-        "ARWANA", "UNO", "ALLEGRA", "ATENA", "BATIRUS", "CAKRA", "COLOSSAL",
-        "CONCORD", "DIVA", "ENIGMA", "GRAND", "HABITAT", "HECTOR", "IKAD",
-        "INDOTILE", "KIA", "LAGUNA", "LUNA", "MULIA", "MARINO", "MUSTIKA",
-        "PASCAL", "PASOLA", "PICASSO", "RAMIRO", "REDHORSE", "REDLINE",
-        "SANTALIA", "TERRA", "UNICERA", "VALENCIA", "ZEUS",
-        "ARW", "GEMILANG", "PCSO"
-    ]):
-        return "Keramik"
-    return "Lainnya"
+# Smallest body worth compressing
+GZIP_MINIMUM_SIZE = 1024
+
+# Compress responses for clients that accept gzip (the catalog JSON shrinks ~10x).
+# /api/v1/stock compresses and caches its own bodies, see read_stock().
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
+# Outermost, so request latency includes compression; see /metrics
+app.middleware("http")(record_request)
+
+# Largest page a client can ask for with ?limit=
+MAX_PAGE_SIZE = 5000
+
+def build_stock_response(gudangs_data, rows):
+    """
+    Builds the /api/v1/stock payload from the (gudangs, rows) returned by query_stock().
+    Every warehouse is listed for every item, missing cells are reported as 0.
+    """
+    response_data = []
+    for c_id, nama, total, category, quantities in rows:
+        response_data.append({
+            "id": c_id,
+            "nama": nama,
+            "total_stock": total or 0,
+            "category": category, # Stored when the item was created
+            "stock_per_gudang": {gname: quantities.get(gid, 0) or 0 for gid, gname in gudangs_data}
+        })
+    return response_data
 
 @app.get("/")
 def read_root():
@@ -102,9 +95,102 @@ def read_root():
     """
     return {"message": "Selamat Datang di API Stok Keramik"}
 
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    """
+    Request latency, SQL statements and SQL time per request by route, in
+    the Prometheus text format. Set SLOW_REQUEST_SECONDS to also log every
+    slower request together with its queries.
+    """
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# gzip level of cached /api/v1/stock bodies: compressed once per version,
+# but the first request of a version still waits for it
+STOCK_GZIP_LEVEL = 6
+
+# Rendered /api/v1/stock bodies keyed by (data version, query string, format, encoding)
+STOCK_CACHE_SIZE = 32
+_stock_cache = {}
+_stock_cache_lock = threading.Lock()
+
+def get_cached_stock(key):
+    with _stock_cache_lock:
+        return _stock_cache.get(key)
+
+def put_cached_stock(key, value):
+    with _stock_cache_lock:
+        # Entries of older versions can never be served again
+        for stale in [k for k in _stock_cache if k[0] != key[0]]:
+            del _stock_cache[stale]
+        if len(_stock_cache) >= STOCK_CACHE_SIZE:
+            del _stock_cache[next(iter(_stock_cache))]
+        _stock_cache[key] = value
+
+def render_json(content):
+    # Same bytes FastAPI's default JSONResponse produces
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def render_fast_json(content):
+    # Only used for new formats: orjson output is not guaranteed to match the
+    # bytes existing clients of the default format have always received.
+    return orjson.dumps(content)
+
+# Media type of the columnar stock format, see read_stock()
+COMPACT_MEDIA_TYPE = "application/vnd.stok.compact+json"
+
+def build_compact_stock_response(version, gudangs_data, rows):
+    """
+    Columnar form of build_stock_response(): the warehouse list is sent once,
+    followed by parallel arrays and a quantity matrix with one row per item
+    and one column per entry of "gudangs".
+    """
+    gudang_ids = [gid for gid, _ in gudangs_data]
+    return {
+        "version": version,
+        "gudangs": [gname for _, gname in gudangs_data],
+        "ids": [row[0] for row in rows],
+        "names": [row[1] for row in rows],
+        "categories": [row[3] for row in rows],
+        "totals": [row[2] or 0 for row in rows],
+        "quantities": [[quantities.get(gid, 0) or 0 for gid in gudang_ids] for *_, quantities in rows],
+    }
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def encode_cursor(sort, value, item_id):
+    raw = json.dumps([sort, value, item_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, item_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+    if cursor_sort != sort:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor was issued for a different sort order.")
+    return value, item_id
 
 @app.get("/api/v1/stock")
-def read_stock():
+def read_stock(
+    request: Request,
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    prefix: Optional[str] = None,
+    gudang: Optional[List[str]] = Query(None),
+    min_stock: Optional[int] = None,
+    max_stock: Optional[int] = None,
+    sort: str = "nama",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fmt: Optional[str] = Query(None, alias="format"),
+):
     """
     Get a detailed list of all ceramic stock across all warehouses.
     
@@ -114,117 +200,838 @@ def read_stock():
     - total_stock
     - category
     - stock_per_gudang (a dictionary where keys are warehouse names and values are the stock quantity)
+
+    Optional query parameters, all evaluated in SQL:
+    - category: only items of this category
+    - q: case-insensitive substring of the name
+    - prefix: case-insensitive start of the name
+    - gudang: repeatable, only these warehouses are listed and summed into total_stock
+    - min_stock / max_stock: bounds on total_stock
+    - sort: nama, total_stock or id, prefixed with '-' for descending order
+    - limit / cursor: page size and the X-Next-Cursor header of the previous page
+
+    Without parameters the full catalog is returned, as before.
+
+    format=compact (or an Accept header of application/vnd.stok.compact+json)
+    switches to a columnar body: {version, gudangs, ids, names, categories,
+    totals, quantities}, where quantities[i][j] is the stock of item i in
+    warehouse gudangs[j]. Filters and pagination work the same way.
+
+    Responses carry the data version in X-Data-Version (the starting point
+    for /api/v1/stock/changes) and as ETag. A request whose
+    If-None-Match still matches gets 304 Not Modified without touching the
+    stock tables, and rendered bodies are cached per version and query,
+    gzip-compressed for clients that accept it.
     """
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    if sort_key not in STOCK_SORT_KEYS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid sort key. Use one of: {', '.join(STOCK_SORT_KEYS)}.")
+    after = decode_cursor(cursor, sort) if cursor else None
+    if fmt not in (None, "json", "compact"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid format. Use json or compact.")
+    compact = fmt == "compact" or (fmt is None and COMPACT_MEDIA_TYPE in request.headers.get("accept", ""))
+
     try:
-        all_ceramics_data = get_stock_details()
-        gudangs_data = get_all_gudangs() # Returns list of tuples (id, name)
-        
-        response_data = []
-        
-        for c_id, nama, total in all_ceramics_data:
-            total_stock = total or 0
-            stock_per_gudang = {}
-            
-            for gid, gname in gudangs_data:
-                quantity = get_stock_by_ceramic_and_gudang(c_id, gid)
-                stock_per_gudang[gname] = quantity or 0
-            
-            ceramic_item = {
-                "id": c_id,
-                "nama": nama,
-                "total_stock": total_stock,
-                "category": get_category_by_name(nama),
-                "stock_per_gudang": stock_per_gudang
+        # Version check and data read share one snapshot, so a cached body
+        # always matches the version it is stored under
+        with transaction(immediate=False) as conn:
+            version = get_data_version(conn)
+            etag = f'"{version}-compact"' if compact else f'"{version}"'
+            headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Data-Version": str(version), "Vary": "Accept"}
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            # Compressed here rather than by GZipMiddleware, which would
+            # compress the cached body again on every request
+            accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
+            cache_key = (version, request.url.query, compact, accepts_gzip)
+            cached = get_cached_stock(cache_key)
+            if cached is None:
+                body, next_cursor = render_stock(conn, version, compact, sort, sort_key, descending, after, limit, category, q, prefix, gudang, min_stock, max_stock)
+                gzipped = accepts_gzip and len(body) >= GZIP_MINIMUM_SIZE
+                if gzipped:
+                    body = gzip.compress(body, compresslevel=STOCK_GZIP_LEVEL, mtime=0)
+                cached = (body, next_cursor, gzipped)
+                put_cached_stock(cache_key, cached)
+
+        body, next_cursor, gzipped = cached
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        if gzipped:
+            # GZipMiddleware passes encoded bodies through without adding Vary
+            headers.update({"Content-Encoding": "gzip", "Vary": "Accept, Accept-Encoding"})
+        return Response(content=body, media_type=COMPACT_MEDIA_TYPE if compact else "application/json", headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve stock data: {str(e)}")
+
+def render_stock(conn, version, compact, sort, sort_key, descending, after, limit, category, q, prefix, gudang, min_stock, max_stock):
+    """
+    Runs the stock query for read_stock() and returns (body bytes, next cursor or None).
+    """
+    gudang_ids = None
+    if gudang:
+        known = {gname: gid for gid, gname in get_all_gudangs(conn)}
+        unknown = [gname for gname in gudang if gname not in known]
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown warehouse: {', '.join(unknown)}")
+        gudang_ids = [known[gname] for gname in gudang]
+
+    # Whole matrix in one pass, no per-cell queries
+    gudangs_data, rows = query_stock(
+        category=category, search=q, prefix=prefix, gudang_ids=gudang_ids,
+        min_stock=min_stock, max_stock=max_stock, sort=sort_key, descending=descending,
+        limit=(limit + 1) if limit else None, after=after, conn=conn
+    )
+
+    next_cursor = None
+    if limit and len(rows) > limit:
+        # One extra row was fetched to know whether another page exists
+        rows = rows[:limit]
+        last = rows[-1]
+        value = {"nama": last[1], "total_stock": last[2], "id": last[0]}[sort_key]
+        next_cursor = encode_cursor(sort, value, last[0])
+
+    if compact:
+        return render_fast_json(build_compact_stock_response(version, gudangs_data, rows)), next_cursor
+    return render_json(build_stock_response(gudangs_data, rows)), next_cursor
+
+
+def build_changes_response(version, since, changes, gudang_names):
+    """
+    Shapes the rows of get_changes_since() for the API. Cells are keyed by
+    warehouse name like stock_per_gudang; cells of deleted items or
+    warehouses are left out because the item or column is removed entirely.
+    """
+    gudang_names = dict(gudang_names)
+    gudangs = {"upserted": [], "deleted": []}
+    items = {"upserted": [], "deleted": []}
+    cells = {"upserted": [], "deleted": []}
+    deleted_items, deleted_gudangs = set(), set()
+
+    for entity, op, ceramic_id, gudang_id, _, nama, category in changes:
+        if entity == "gudang":
+            gudang_names.setdefault(gudang_id, nama)
+            if op == "delete":
+                gudangs["deleted"].append(nama)
+                deleted_gudangs.add(gudang_id)
+            else:
+                gudangs["upserted"].append({"id": gudang_id, "nama": nama})
+        elif entity == "keramik":
+            if op == "delete":
+                items["deleted"].append(ceramic_id)
+                deleted_items.add(ceramic_id)
+            else:
+                items["upserted"].append({"id": ceramic_id, "nama": nama, "category": category})
+
+    for entity, op, ceramic_id, gudang_id, quantity, _, _ in changes:
+        if entity != "stok" or ceramic_id in deleted_items or gudang_id in deleted_gudangs:
+            continue
+        cell = {"id": ceramic_id, "gudang": gudang_names[gudang_id]}
+        if op == "delete":
+            cells["deleted"].append(cell)
+        else:
+            cell["quantity"] = quantity
+            cells["upserted"].append(cell)
+
+    return {"version": version, "since": since, "gudangs": gudangs, "items": items, "cells": cells}
+
+@app.get("/api/v1/stock/changes")
+def read_stock_changes(since: int = Query(..., ge=0)):
+    """
+    Returns only what changed after data version `since` (the X-Data-Version
+    of an earlier /api/v1/stock response or the version of a previous call):
+
+    - gudangs: upserted [{id, nama}] and deleted [nama]
+    - items: upserted [{id, nama, category}] and deleted [id]
+    - cells: upserted [{id, gudang, quantity}] and deleted [{id, gudang}] (now 0)
+
+    Responds 410 Gone when that version has been compacted out of the change
+    log; the client then reloads /api/v1/stock.
+    """
+    try:
+        with transaction(immediate=False) as conn:
+            result = get_changes_since(since, conn=conn)
+            if result is None:
+                raise HTTPException(status_code=status.HTTP_410_GONE, detail="Changes since this version are no longer available. Reload /api/v1/stock.")
+            version, changes = result
+            gudang_names = get_all_gudangs(conn)
+        return build_changes_response(version, since, changes, gudang_names)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve stock changes: {str(e)}")
+
+# Seconds between data version checks of the event broadcaster. Commits made
+# by this process wake it at once; the check catches other writers.
+EVENTS_POLL_SECONDS = 5
+
+# Seconds of silence after which an event stream gets a keep-alive comment
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Messages queued per subscriber; a client that falls further behind is
+# told to reload instead
+EVENTS_QUEUE_SIZE = 100
+
+def format_event(event, data, version):
+    return f"id: {version}\nevent: {event}\ndata: {render_json(data).decode('utf-8')}\n\n".encode("utf-8")
+
+def read_events_since(since):
+    """
+    Returns (version, event bytes) bringing a client at data version `since`
+    up to date: a "changes" event with the change feed, a "reload" event if
+    that part of the feed is gone, or None as the event when nothing changed.
+    """
+    with transaction(immediate=False) as conn:
+        version = get_data_version(conn)
+        if since is None or since == version:
+            return version, None
+        result = get_changes_since(since, conn=conn)
+        gudang_names = get_all_gudangs(conn)
+    if result is None or since > version:
+        return version, format_event("reload", {"version": version}, version)
+    version, changes = result
+    return version, format_event("changes", build_changes_response(version, since, changes, gudang_names), version)
+
+class StockEventHub:
+    """
+    Fans change notifications out to the /api/v1/stock/events streams.
+
+    One broadcaster task per event loop runs while anyone is subscribed. It
+    is woken by every committed write of this process (through
+    database.observe_commits) or every EVENTS_POLL_SECONDS, reads the change
+    feed once and hands the same encoded event to every subscriber queue.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+        self.version = None
+
+    def notify(self):
+        # Called on the committing thread
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self.wakeup.set)
+            except RuntimeError:
+                pass # The loop closed in between
+
+    def subscribe(self):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.loop is not loop:
+            self.loop, self.wakeup = loop, asyncio.Event()
+            self.subscribers, self.version = set(), None
+            self.task = loop.create_task(self._broadcast())
+        queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def start_at(self, version):
+        # A fresh broadcaster starts from the version of its first
+        # subscriber's catch-up, so nothing falls between the two
+        if self.version is None:
+            self.version = version
+            self.wakeup.set()
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            self.wakeup.set() # Lets the broadcaster see it can stop
+
+    async def _broadcast(self):
+        while self.subscribers:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), EVENTS_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            if not self.subscribers:
+                break
+            if self.version is None:
+                continue
+            try:
+                version, event = await run_in_threadpool(read_events_since, self.version)
+            except Exception:
+                continue # Retried on the next wake-up
+            self.version = version
+            if event is not None:
+                self._publish(version, event)
+
+    def _publish(self, version, event):
+        for queue in self.subscribers:
+            if queue.full():
+                # Too far behind to catch up event by event
+                while not queue.empty():
+                    queue.get_nowait()
+                event_for_queue = format_event("reload", {"version": version}, version)
+            else:
+                event_for_queue = event
+            queue.put_nowait((version, event_for_queue))
+
+stock_events = StockEventHub()
+observe_commits(stock_events.notify)
+
+@app.get("/api/v1/stock/events")
+async def read_stock_events(request: Request, since: Optional[int] = Query(None, ge=0)):
+    """
+    Server-Sent Events stream of stock changes, for live views.
+
+    Pass the X-Data-Version of the data the client holds as `since` (a
+    reconnecting EventSource sends it as Last-Event-ID). The stream starts
+    with a "ready" event {version}, then sends:
+
+    - "changes": the /api/v1/stock/changes payload since the last event,
+      sent after each committed write
+    - "reload" {version}: the changes cannot be delivered incrementally,
+      reload /api/v1/stock
+
+    Every event id is the data version it brings the client to. Idle
+    streams get a keep-alive comment every EVENTS_KEEPALIVE_SECONDS.
+    """
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+    queue = stock_events.subscribe()
+
+    async def stream():
+        try:
+            # Subscribed first, so nothing committed from here on is missed
+            version, catch_up = await run_in_threadpool(read_events_since, since)
+            stock_events.start_at(version)
+            yield format_event("ready", {"version": version}, version)
+            if catch_up is not None:
+                yield catch_up
+            delivered = version
+            while True:
+                try:
+                    version, event = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                # Older than the catch-up already sent
+                if version > delivered:
+                    delivered = version
+                    yield event
+        finally:
+            stock_events.unsubscribe(queue)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+def build_summary_response(version, gudangs_data, items, cells):
+    """
+    Builds the /api/v1/stock/summary payload from get_stock_summary().
+    Every category and warehouse is listed, missing cells are reported as 0.
+    """
+    def empty():
+        return {"quantity": 0, "items_in_stock": 0, "low_stock": 0}
+
+    gudang_names = dict(gudangs_data)
+    per_category = {category: {} for category in CATEGORIES}
+    for category, gudang_id, quantity, items_in_stock, low_stock in cells:
+        if gudang_id in gudang_names:
+            per_category.setdefault(category, {})[gudang_id] = (quantity, items_in_stock, low_stock)
+    for category in items:
+        per_category.setdefault(category, {})
+
+    categories = []
+    totals = {gname: empty() for gname in gudang_names.values()}
+    for category, counts in per_category.items():
+        item_count = items.get(category, 0)
+        per_gudang = {}
+        for gid, gname in gudangs_data:
+            quantity, items_in_stock, low_stock = counts.get(gid, (0, 0, 0))
+            per_gudang[gname] = {
+                "quantity": quantity,
+                "items_in_stock": items_in_stock,
+                "low_stock": low_stock,
+                "out_of_stock": item_count - items_in_stock,
             }
-            response_data.append(ceramic_item)
-            
-        return response_data
+            for key in ("quantity", "items_in_stock", "low_stock"):
+                totals[gname][key] += per_gudang[gname][key]
+        categories.append({
+            "category": category,
+            "items": item_count,
+            "total_stock": sum(cell["quantity"] for cell in per_gudang.values()),
+            "per_gudang": per_gudang,
+        })
+
+    item_total = sum(items.values())
+    for cell in totals.values():
+        cell["out_of_stock"] = item_total - cell["items_in_stock"]
+    return {
+        "version": version,
+        "low_stock_threshold": LOW_STOCK_THRESHOLD,
+        "gudangs": [gname for _, gname in gudangs_data],
+        "categories": categories,
+        "totals": {
+            "items": item_total,
+            "total_stock": sum(cell["quantity"] for cell in totals.values()),
+            "per_gudang": totals,
+        },
+    }
+
+@app.get("/api/v1/stock/summary")
+def read_stock_summary(request: Request):
+    """
+    Stock totals per category and warehouse for dashboards.
+
+    For every category: item count, total stock and per warehouse the
+    quantity, items in stock, low-stock items (1 up to low_stock_threshold)
+    and out-of-stock items; "totals" has the same over all categories.
+    Served from the summary tables kept current by the stock writes, so the
+    cost depends on categories x warehouses, not on the catalog size.
+    Carries the data version as ETag and answers a matching If-None-Match
+    with 304.
+    """
+    try:
+        version, gudangs_data, items, cells = get_stock_summary()
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve stock summary: {str(e)}")
+
+    etag = f'"{version}-summary"'
+    headers = {"ETag": etag, "X-Data-Version": str(version)}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=render_json(build_summary_response(version, gudangs_data, items, cells)), media_type="application/json", headers=headers)
+
+def current_matrix(gudang=None):
+    """Returns (matrix, column of gudang) for the analytical endpoints, 404 on an unknown warehouse."""
+    try:
+        matrix = get_matrix()
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve stock data: {str(e)}")
+    if gudang is not None and gudang not in matrix.gudang_index:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown warehouse: {gudang}")
+    return matrix, matrix.gudang_index.get(gudang)
+
+def matrix_response(matrix, content):
+    # Rendered directly: the items hold only JSON types, jsonable_encoder would cost more than the query
+    return Response(content=render_json(content), media_type="application/json", headers={"X-Data-Version": str(matrix.version)})
+
+def build_matrix_items(matrix, rows):
+    """Builds /api/v1/stock style items for rows of the analytics matrix."""
+    gudang_names = [gname for _, gname in matrix.gudangs]
+    items = []
+    for row in rows:
+        c_id, nama, category, total, quantities = matrix.item(row)
+        items.append({
+            "id": c_id,
+            "nama": nama,
+            "total_stock": total,
+            "category": category,
+            "stock_per_gudang": dict(zip(gudang_names, quantities))
+        })
+    return items
+
+@app.get("/api/v1/stock/top")
+def read_top_stock(
+    n: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    gudang: Optional[str] = None,
+    category: Optional[str] = None,
+    ascending: bool = False,
+):
+    """
+    The n items with the most stock in total, or in one warehouse, optionally
+    within one category; ascending=true gives the least. Answered from the
+    in-memory stock matrix (see analytics.py), updated after each write.
+    """
+    matrix, column = current_matrix(gudang)
+    rows = matrix.top_items(n, column=column, category=category, ascending=ascending)
+    return matrix_response(matrix, {"version": matrix.version, "items": build_matrix_items(matrix, rows)})
+
+@app.get("/api/v1/stock/low")
+def read_low_stock(
+    threshold: int = LOW_STOCK_THRESHOLD,
+    gudang: Optional[str] = None,
+    category: Optional[str] = None,
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """
+    Items with 1 up to threshold pieces in any warehouse (or in the given
+    one), lowest first, with the warehouses where they are low. "count" is
+    the number of matching items, of which at most limit are listed.
+    """
+    matrix, column = current_matrix(gudang)
+    rows = matrix.low_stock(threshold, column=column, category=category)
+    items = build_matrix_items(matrix, rows[:limit])
+    gudang_names = [gname for _, gname in matrix.gudangs]
+    for item in items:
+        item["low_gudangs"] = [
+            gname for gname in ([gudang] if gudang is not None else gudang_names)
+            if 0 < item["stock_per_gudang"][gname] <= threshold
+        ]
+    return matrix_response(matrix, {"version": matrix.version, "threshold": threshold, "count": len(rows), "items": items})
+
+@app.get("/api/v1/stock/categories")
+def read_category_stock():
+    """
+    Item count, total stock and stock per warehouse of every category,
+    summed over the in-memory stock matrix.
+    """
+    matrix, _ = current_matrix()
+    gudang_names = [gname for _, gname in matrix.gudangs]
+    return matrix_response(matrix, {
+        "version": matrix.version,
+        "categories": [
+            {
+                "category": category,
+                "items": int(items),
+                "total_stock": int(sums.sum()),
+                "stock_per_gudang": dict(zip(gudang_names, sums.tolist())),
+            }
+            for category, items, sums in zip(matrix.category_names, matrix.category_items, matrix.category_sums)
+        ],
+    })
+
 
+# Media types of the export formats, see export_stock()
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+@app.get("/api/v1/stock/export")
+def export_stock(fmt: str = Query("xlsx", alias="format"), category: Optional[str] = None, details: bool = False):
+    """
+    Downloads the items x warehouses stock table as format=xlsx (default) or
+    csv, optionally for one category.
+
+    The sheet has the import layout ('Item' in A1, one column per
+    warehouse), so an export can be edited and imported again; details=true
+    appends Category and Total columns. Rows are read from a database cursor
+    in blocks and streamed as they are written, so memory stays flat and the
+    download starts at once whatever the catalog size. The X-Data-Version
+    header is the version the whole file was read at.
+    """
+    if fmt not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid format. Use xlsx or csv.")
+    try:
+        version, gudangs_data, chunks = open_stock_export(category=category)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to export stock data: {str(e)}")
+
+    header = export_header(gudangs_data, details=details)
+    rows = export_rows(gudangs_data, chunks, details=details)
+    body = stream_xlsx(header, rows) if fmt == "xlsx" else stream_csv(header, rows)
+    label = "".join(ch if ch.isalnum() else "_" for ch in category) + "_" if category else ""
+    filename = f"stok_{label}{time.strftime('%Y%m%d')}.{fmt}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "X-Data-Version": str(version)}
+    return StreamingResponse(body, media_type=EXPORT_MEDIA_TYPES[fmt], headers=headers)
+
+def snapshot_info(snapshot):
+    if snapshot is None:
+        return None
+    snapshot_id, taken_at, version, source, _ = snapshot
+    return {"id": snapshot_id, "taken_at": taken_at, "version": version, "source": source}
+
+def parse_moment(value, name):
+    """
+    Reads a date or date-time query parameter as the local time string used
+    by the history tables. A bare date means the end of that day.
+    """
+    try:
+        if len(value) == 10:
+            return datetime.date.fromisoformat(value).strftime("%Y-%m-%d 23:59:59")
+        return datetime.datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {name}. Use YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS.")
+
+def resolve_history_filters(item, gudang):
+    """Returns (ceramic_id, gudang_id) for the history endpoints, 404 on an unknown warehouse."""
+    gudang_id = None
+    if gudang is not None:
+        known = {gname: gid for gid, gname in get_all_gudangs()}
+        if gudang not in known:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown warehouse: {gudang}")
+        gudang_id = known[gudang]
+    return item, gudang_id
+
+@app.get("/api/v1/stock/snapshots")
+def read_stock_snapshots():
+    """
+    Lists the stock snapshots recorded by every import: id, taken_at (local
+    time), data version, source, whether it is a full checkpoint and how
+    many cells it stores.
+    """
+    return [
+        {"id": snapshot_id, "taken_at": taken_at, "version": version, "source": source,
+         "checkpoint": bool(checkpoint), "cells": cells}
+        for snapshot_id, taken_at, version, source, checkpoint, cells in get_stock_snapshots()
+    ]
+
+@app.get("/api/v1/stock/history")
+def read_stock_history(at: str, item: Optional[int] = None, gudang: Optional[str] = None):
+    """
+    Stock as of a date: the state recorded by the last import at or before
+    `at` (YYYY-MM-DD for the end of that day, or a date-time), in the shape
+    of /api/v1/stock, limited to one item id and/or one warehouse if given.
+    Items without stock at that time are left out. "snapshot" is null when
+    nothing had been imported yet.
+    """
+    moment = parse_moment(at, "at")
+    ceramic_id, gudang_id = resolve_history_filters(item, gudang)
+    try:
+        snapshot, cells = get_stock_as_of(moment, ceramic_id=ceramic_id, gudang_id=gudang_id)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve stock history: {str(e)}")
+
+    items = {}
+    for cid, nama, category, gname, quantity in cells:
+        entry = items.setdefault(cid, {"id": cid, "nama": nama, "total_stock": 0, "category": category, "stock_per_gudang": {}})
+        entry["stock_per_gudang"][gname] = quantity
+        entry["total_stock"] += quantity
+    return {"at": moment, "snapshot": snapshot_info(snapshot), "items": list(items.values())}
+
+@app.get("/api/v1/stock/movement")
+def read_stock_movement(start: str, end: str, item: Optional[int] = None, gudang: Optional[str] = None):
+    """
+    Stock movement between two dates: every cell whose quantity differs
+    between the stock as of `start` and as of `end` (same rules as
+    /api/v1/stock/history), with before, after and change, plus the net
+    change per warehouse. Optionally limited to one item id and/or one
+    warehouse.
+    """
+    start_moment = parse_moment(start, "start")
+    end_moment = parse_moment(end, "end")
+    if start_moment > end_moment:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start must not be after end.")
+    ceramic_id, gudang_id = resolve_history_filters(item, gudang)
+    try:
+        first, last, cells = get_stock_movement(start_moment, end_moment, ceramic_id=ceramic_id, gudang_id=gudang_id)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to retrieve stock movement: {str(e)}")
+
+    per_gudang = {}
+    for _, _, _, gname, before, after in cells:
+        per_gudang[gname] = per_gudang.get(gname, 0) + after - before
+    return {
+        "start": {"at": start_moment, "snapshot": snapshot_info(first)},
+        "end": {"at": end_moment, "snapshot": snapshot_info(last)},
+        "cells": [
+            {"id": cid, "nama": nama, "category": category, "gudang": gname,
+             "before": before, "after": after, "change": after - before}
+            for cid, nama, category, gname, before, after in cells
+        ],
+        "net_change_per_gudang": per_gudang,
+    }
+
+# Most adjustments accepted in one request
+MAX_ADJUSTMENTS = 5000
+
+class StockAdjustment(BaseModel):
+    op: Literal["set", "delta", "transfer"]
+    item: Union[int, str]
+    gudang: str
+    quantity: int
+    to_gudang: Optional[str] = None
+
+class StockAdjustmentBatch(BaseModel):
+    adjustments: List[StockAdjustment] = Field(..., min_length=1, max_length=MAX_ADJUSTMENTS)
+    allow_negative: bool = False
+
+@app.post("/api/v1/stock/adjustments")
+def adjust_stock_api(batch: StockAdjustmentBatch, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """
+    Applies a batch of stock adjustments in one transaction: either all of
+    them or none.
+
+    Each adjustment names an item (id or name) and a warehouse. op "set"
+    makes quantity the new stock, "delta" adds it (negative for sales
+    deductions) and "transfer" moves quantity from gudang to to_gudang;
+    to_gudang is rejected on the other ops. They apply in order. Lowering a cell below 0 rejects the batch with 409
+    unless allow_negative is true.
+
+    Send an Idempotency-Key header to make retries safe: repeating the same
+    batch with the key returns the first response (with "replayed": true)
+    instead of applying it again; reusing the key for a different batch is
+    a 409.
+    """
+    adjustments = [
+        (a.op, normalize_ceramic_name(a.item) if isinstance(a.item, str) else a.item, a.gudang, a.quantity, a.to_gudang)
+        for a in batch.adjustments
+    ]
+    try:
+        version, cells, replayed = run_write(adjust_stock, adjustments, key=idempotency_key, allow_negative=batch.allow_negative)
+    except AdjustmentConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except AdjustmentError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as db_exc:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error during adjustment: {str(db_exc)}")
+
+    return {
+        "message": f"Applied {len(adjustments)} adjustments, {len(cells)} stock cells changed.",
+        "version": version,
+        "replayed": replayed,
+        "cells": [
+            {"id": cid, "nama": nama, "gudang": gname, "before": before, "after": after, "change": after - before}
+            for cid, nama, gname, before, after in cells
+        ],
+    }
 
 @app.post("/api/v1/import-excel")
-async def import_excel_api(file: UploadFile = File(...)):
+async def import_excel_api(file: UploadFile = File(...), stream: bool = False, diff: bool = False, dry_run: bool = False):
     """
     Imports stock data from an Excel file.
     Resets stock in specified warehouses and then updates from the file.
+
+    With stream=true an .xlsx upload is read row by row straight from the
+    spooled upload and written in fixed-size chunks, so memory stays bounded
+    for very large workbooks. The response then also reports the row count,
+    elapsed time and rows per second.
+
+    With diff=true the sheet is compared with the stored stock of its
+    warehouses and only the cells that differ are written, instead of
+    resetting the warehouses and rewriting every cell. The response adds
+    cells_changed (split into inserted, updated and zeroed) and new_items.
+    dry_run=true implies diff=true, writes nothing and also returns the
+    changes as [nama, gudang, old, new] lists. A diff needs the whole sheet
+    in memory, since cells the sheet leaves out are zeroed, so it cannot be
+    combined with stream=true.
+
+    The import runs in the threadpool so other requests are served meanwhile;
+    see /api/v1/import-jobs for imports that report progress.
     """
     if not file.filename.endswith((".xlsx", ".xls")):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file format. Please upload an Excel file (.xlsx or .xls).")
+    if stream and (diff or dry_run):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="stream cannot be combined with diff or dry_run.")
 
+    return await run_in_threadpool(excel_import, file.file, stream and file.filename.endswith(".xlsx"), diff or dry_run, dry_run)
+
+def excel_import(source, stream, diff=False, dry_run=False):
+    """
+    Runs a whole import for import_excel_api(), mapping failures to HTTP errors.
+    """
+    started = time.perf_counter()
     try:
-        # Read the file content into a BytesIO object
-        contents = await file.read()
-        excel_file = io.BytesIO(contents)
+        gudang_cols, chunks = open_workbook(source, stream=stream)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to import file: {str(e)}")
 
-        df = pd.read_excel(excel_file, header=0)
+    # --- Process Import ---
+    # Gudang creation, the stock reset and every row are written in one
+    # transaction, so a failure midway leaves the previous stock intact.
+    try:
+        if diff:
+            stats = diff_workbook(gudang_cols, chunks, dry_run=dry_run, started=started)
+        else:
+            stats = write_workbook(gudang_cols, chunks, started=started)
+    except ImportFormatError as e:
+        # A streamed workbook is only read, and can only fail, while it is written
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as db_exc:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error during import: {str(db_exc)}")
 
-        if df.columns.empty or df.columns[0].lower() != 'item':
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Excel format. First column (A1) must have header 'Item'.")
+    if dry_run:
+        response = {
+            "message": f"Dry run: {stats['cells_changed']} stock cells would change.",
+            "details": f"Nothing was written for warehouses: {', '.join(gudang_cols)}."
+        }
+    else:
+        response = import_summary(gudang_cols, stats)
+    if stream:
+        response.update(rows=stats["rows"], elapsed_seconds=stats["elapsed_seconds"], rows_per_second=stats["rows_per_second"])
+    if diff:
+        response.update({key: stats[key] for key in ("cells_changed", "inserted", "updated", "zeroed", "new_items")})
+    if dry_run:
+        response["changes"] = stats["changes"]
+    return response
 
-        item_col = df.columns[0]
-        gudang_cols = [col for col in df.columns[1:] if not str(col).lower().startswith('unnamed')]
+@app.post("/api/v1/import-excel/batch")
+async def import_excel_batch_api(files: List[UploadFile] = File(...)):
+    """
+    Imports several Excel workbooks (e.g. one per branch) in one request.
 
-        if len(gudang_cols) == 0:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No warehouse columns found in the Excel file (starting from B1) or all warehouse columns are unnamed.")
+    The files are parsed and normalized in parallel worker processes, then
+    all names are resolved in one pass and every workbook is written in a
+    single transaction, in upload order: either all files are imported or
+    none is.
+    """
+    for file in files:
+        if not file.filename.endswith((".xlsx", ".xls")):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid file format: {file.filename}. Please upload Excel files (.xlsx or .xls).")
 
-        # --- Process Import ---
-        # Get/create gudang IDs and reset stock in those gudangs
-        gudang_ids = {name: get_or_create_gudang(name) for name in gudang_cols}
-        
-        conn = sqlite3.connect("stok_keramik.db")
-        cursor = conn.cursor()
-        try:
-            for gid in gudang_ids.values():
-                # Reset stock for the gudangs being imported
-                cursor.execute("UPDATE stok SET quantity = 0 WHERE gudang_id = ?", (gid,))
-            conn.commit()
-
-            imported_count = 0
-            processed_items = set()
-            for index, row in df.iterrows():
-                nama_keramik = row[item_col]
-                if pd.isna(nama_keramik):
-                    continue
-                
-                nama_keramik = str(nama_keramik).strip()
-                if not nama_keramik:
-                    continue
-                
-                normalized_name = normalize_ceramic_name(nama_keramik)
-                ceramic_id = get_or_create_ceramic(normalized_name) # Ensure ceramic exists
-
-                processed_items.add(normalized_name) # Use normalized name for counting unique items
-
-                for gudang_nama in gudang_cols:
-                    gudang_id = gudang_ids[gudang_nama]
-                    
-                    try:
-                        quantity = 0
-                        if gudang_nama in row and not pd.isna(row[gudang_nama]):
-                            quantity = int(float(row[gudang_nama]))
-                    except (ValueError, TypeError):
-                        quantity = 0 # Default to 0 if conversion fails
-                    
-                    update_stock(ceramic_id, gudang_id, quantity) # Update stock in DB
-                
-                imported_count += 1
-            
-            return {
-                "message": f"Successfully processed {len(processed_items)} unique ceramic items.",
-                "details": f"Stock for warehouses: {', '.join(gudang_cols)} has been fully updated."
-            }
-        except Exception as db_exc:
-            conn.rollback() # Rollback on any database error during import
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error during import: {str(db_exc)}")
-        finally:
-            conn.close()
+    paths = [await run_in_threadpool(save_upload, file.file, os.path.splitext(file.filename)[1]) for file in files]
+    try:
+        return await run_in_threadpool(excel_batch_import, paths, [file.filename for file in files])
+    finally:
+        for path in paths:
+            os.remove(path)
 
-    except HTTPException:
-        raise # Re-raise HTTPExceptions
+def excel_batch_import(paths, filenames):
+    """
+    Runs a batch import for import_excel_batch_api(), mapping failures to HTTP errors.
+    """
+    started = time.perf_counter()
+    try:
+        workbooks = read_workbooks(paths, labels=filenames)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to import file: {str(e)}")
 
+    try:
+        run_bulk_write(import_stock_batch, workbooks)
+    except Exception as db_exc:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Database error during import: {str(db_exc)}")
+
+    files = []
+    for filename, (gudang_names, rows) in zip(filenames, workbooks):
+        stats = {"items": len({nama for nama, _ in rows})}
+        files.append(dict(import_summary(gudang_names, stats), filename=filename, rows=len(rows)))
+    return {
+        "message": f"Successfully imported {len(files)} files.",
+        "files": files,
+        "elapsed_seconds": round(time.perf_counter() - started, 3)
+    }
+
+@app.post("/api/v1/import-jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_import_job(file: UploadFile = File(...), stream: bool = True):
+    """
+    Queues an Excel import as a background job and returns it immediately.
+
+    The upload is copied to a temporary file and imported by a worker
+    thread (streaming .xlsx by default). Poll GET /api/v1/import-jobs/{id}
+    for status, rows parsed, rows written and elapsed time; DELETE cancels
+    it, rolling back anything it has written.
+    """
+    if not file.filename.endswith((".xlsx", ".xls")):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file format. Please upload an Excel file (.xlsx or .xls).")
+
+    path = await run_in_threadpool(save_upload, file.file, os.path.splitext(file.filename)[1])
+    job = submit_import(path, file.filename, stream=stream and file.filename.endswith(".xlsx"))
+    return job.to_dict()
+
+@app.get("/api/v1/import-jobs")
+def read_import_jobs():
+    """Lists the recent import jobs, newest first."""
+    return [job.to_dict() for job in list_jobs()]
+
+@app.get("/api/v1/import-jobs/{job_id}")
+def read_import_job(job_id: str):
+    """Status and progress of one import job."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import job not found.")
+    return job.to_dict()
+
+@app.delete("/api/v1/import-jobs/{job_id}")
+def cancel_import_job(job_id: str):
+    """Requests cancellation of a queued or running import job."""
+    job = cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import job not found.")
+    return job.to_dict()
+
 # This block allows running the script directly for development
 if __name__ == "__main__":
     uvicorn.run("backend:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Throughput benchmark: compiled classifier vs. the original chain of substring scans.
+
+Run from the repository root:
+
+    python benchmarks/bench_classifier.py [--repeat N]
+
+Names come from the keramik table of stok_keramik.db plus synthetic names
+built from the keyword tables. Both implementations must agree on every
+name before timings are reported.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classifier import RULES, get_category_by_name
+from database import DATABASE_NAME
+
+
+# Frozen copy of get_category_by_name() as it was in backend.py and main.py
+# before classifier.py, kept as the reference for results and speed.
+def legacy_get_category_by_name(name):
+    name_upper = str(name).strip().upper()
+    if "PINGUL" in name_upper or "PINGULAN" in name_upper or "GRAMETINDO" in name_upper:
+        return "PINGUL"
+    if "LIST" in name_upper:
+        return "LIST"
+    if name_upper.startswith("AM ") or " AM " in name_upper or "LEMKRA" in name_upper:
+        return "NAT"
+    if any(k in name_upper for k in ["STEP", "STP", "STEPNOSING"]):
+        return "STEPNOSING"
+    if any(k in name_upper for k in [
+        "KRAN", "STOP KRAN", "AUGUSTO", "BRACHIO", "GRAVINO", "VILANOVA",
+        "EXCEL", "SOBAR", "DEVEN", "HALMAR", "EINER", "CLASSIC", "FLEX",
+        "ISCO", "SAVITAR", "APOLLO", "WALLSHOWER", "SHOWER", "HANDSHOWER",
+        "ALPHARD", "HAWAI", "GENTONG", "COUPLING", "UNION", "SELANG", "BCP",
+        "PEMBERSIH", "SARGOT", "AVOR", "SARINGAN", "HANDLE", "BOSSINI",
+        "SAPHIRA", "ENGSEL", "KUNCI", "BOLZANO", "GRENDEL", "LAMPU", "RH",
+        "KAPSTOCK", "TISSUE", "KORDEN", "BAUT", "KAPSTK", "FIONI", "BATHUB",
+        "KAPS", "RAK", "KACA", "PISAU", "GERGAJI", "PENGUIN", "PROFIL", "PELAMPUNG",
+        "WATERHEAT", "WTRHEAT", "WATER HEATER", "WATER HEAT", "PELOR", "GIGI",
+        "TOILET", "COOKER", "KOMPOR", "KITCHEN", "ANGZDOOR", "PKM",
+        "BELLEZA", "COSTO", "DUPON", "FIDEM", "HAND SHOW", "BATH+SHOW", "K DIND",
+        "K DOUBLE", "K SHOW", "K TAMAN", "K WAST", "PLANGSET", "PLST+T", "RING H",
+        "SHOW BIDET", "SHW TNG", "STOP K", "SABUN", "TS CAIR", "WAST +KAB+KC",
+        "HANSA", "MOVE", "OULUSOLID", "SPC", "TASIN", "TOTO", "TRILLIUN", "TRISENSA",
+        "VAPELY", "MAGNET", "SPRINGKNEE", "WASSER", "CABINET",
+        "GERMANY", "IGM", "MASPION", "MERIDIAN", "OULU", "SOLID", "TUTUP", "HAK ANGIN"
+    ]):
+        return "Sanitari"
+    if any(k in name_upper for k in [
+        "ARNA 60/60", "RMN", "CERANOSA", "RUDY", "GRD", "PASADENA", "SANDIMAS",
+        "ALTHEA", "HELA", "IMPERIAL", "MAXNUM", "MELIUZ", "PAVIA", "REXTON",
+        "A&F", "CERA TILES", "CYAN", "GOLFGRES", "SMART TILES", "AMADEO", "COVE",
+        "GRANIT88", "GROSETO", "QIAOHUI", "ZED", "GRANITO", "NIRO", "DECOGRESS",
+        "INDECOR", "INDOGRES", "GRANIT", "CAVALLO", "CIMETRIC", "PEGASUS",
+        "WHTHORSE", "D-EURO", "TOPFRES", "IKAD", "SUNPWR", "CAVALI", "CITIGRES",
+        "ROTA", "SCAFATI", "PLATINUM", "CENTRO",
+        "A&Y", "DECOGRES 60X60", "GOLGRES", "PORTINO", "SPEEDO", "TOPGRES", "TOSCANA",
+        "DECOGRES 60/60", "WHTHRSE"
+    ]):
+        return "Granit"
+    if any(k in name_upper for k in [
+        "ARWANA", "UNO", "ALLEGRA", "ATENA", "BATIRUS", "CAKRA", "COLOSSAL",
+        "CONCORD", "DIVA", "ENIGMA", "GRAND", "HABITAT", "HECTOR", "IKAD",
+        "INDOTILE", "KIA", "LAGUNA", "LUNA", "MULIA", "MARINO", "MUSTIKA",
+        "PASCAL", "PASOLA", "PICASSO", "RAMIRO", "REDHORSE", "REDLINE",
+        "SANTALIA", "TERRA", "UNICERA", "VALENCIA", "ZEUS",
+        "ARW", "GEMILANG", "PCSO"
+    ]):
+        return "Keramik"
+    return "Lainnya"
+
+
+def sample_names(count, seed=0):
+    rng = random.Random(seed)
+    names = []
+    if os.path.exists(DATABASE_NAME):
+        conn = sqlite3.connect(DATABASE_NAME)
+        names = [nama for (nama,) in conn.execute("SELECT nama FROM keramik")]
+        conn.close()
+    keywords = [keyword for _, table in RULES for keyword in table]
+    while len(names) < count:
+        words = [rng.choice(keywords) for _ in range(rng.randint(0, 2))]
+        words += [rng.choice(["60X60", "WHITE", "KW1", "GLOSSY", "30X30"]) for _ in range(rng.randint(1, 3))]
+        rng.shuffle(words)
+        names.append(" ".join(words))
+    return names[:count]
+
+
+def measure(func, names, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for name in names:
+            func(name)
+        best = min(best, time.perf_counter() - started)
+    return len(names) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=20000, help="number of names to classify")
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs")
+    args = parser.parse_args()
+
+    names = sample_names(args.count)
+    mismatches = [name for name in names if get_category_by_name(name) != legacy_get_category_by_name(name)]
+    if mismatches:
+        print(f"{len(mismatches)} names classified differently, e.g. {mismatches[:5]}")
+        sys.exit(1)
+
+    legacy_rate = measure(legacy_get_category_by_name, names, args.repeat)
+    compiled_rate = measure(get_category_by_name, names, args.repeat)
+    print(f"names:    {len(names)} (identical results)")
+    print(f"legacy:   {legacy_rate:12,.0f} names/s")
+    print(f"compiled: {compiled_rate:12,.0f} names/s  ({compiled_rate / legacy_rate:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Mixed read/write load test against real uvicorn worker processes.
+
+Run from the repository root:
+
+    python benchmarks/load_test.py [--workers 1,2,4] [--modes queue,direct] [--duration 10]
+
+For every write mode and worker count a fresh temporary database is
+filled with a synthetic catalog, `uvicorn backend:app --workers N` is
+started on it and --clients threads send requests for --duration
+seconds: reads of /api/v1/stock pages and /api/v1/stock/summary, and
+with probability --write-ratio a small diff import into the client's
+own gudang. "queue" runs the backend with the single writer queue
+(writer.py, STOK_WRITE_QUEUE=1), "direct" with the default of every
+request thread writing on its own connection.
+
+Reported per run: reads and writes per second, failed requests (5xx or
+connection errors) and p50/p95 latencies in milliseconds. --output
+writes the table as JSON.
+
+The writer queue is per process, so with several workers their writers
+still contend for SQLite's single write lock. Compare the modes at equal
+worker counts; more workers are not expected to raise write throughput.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_benchmarks import percentiles
+from synthetic import make_names, make_gudangs, make_quantities, write_workbook
+
+# Items in every write request
+WRITE_ITEMS = 20
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(workdir, items, gudangs):
+    # The database module is only loaded here, in the parent, to fill the
+    # database; the server processes open it themselves
+    import database
+    database.DATABASE_NAME = os.path.join(workdir, "stok_keramik.db")
+    database.init_db()
+    names = make_names(items, seed=1)
+    rows = [(nama, [q or 0 for q in row]) for nama, row in zip(names, make_quantities(items, gudangs, seed=1))]
+    database.import_stock(make_gudangs(gudangs), rows)
+    database.close_connection()
+    return names
+
+
+def write_payloads(workdir, client, names):
+    # Two workbooks per client, alternated so every write changes cells
+    gudang = [f"LOAD {client:02d}"]
+    payloads = []
+    for variant in range(2):
+        path = os.path.join(workdir, f"load_{client}_{variant}.xlsx")
+        quantities = [[(i + variant) % 7 + 1] for i in range(WRITE_ITEMS)]
+        write_workbook(path, names[client * WRITE_ITEMS:(client + 1) * WRITE_ITEMS], gudang, quantities)
+        with open(path, "rb") as f:
+            payloads.append(f.read())
+    return payloads
+
+
+def start_server(workdir, workers, mode, port):
+    env = dict(os.environ, PYTHONPATH=ROOT, STOK_WRITE_QUEUE="1" if mode == "queue" else "0")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend:app", "--workers", str(workers),
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            requests.get(base + "/", timeout=1)
+            return process, base
+        except requests.RequestException:
+            if process.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("server did not start in time")
+
+
+def run_clients(base, payloads, names, args):
+    reads, writes, errors = [], [], []
+    lock = threading.Lock()
+    stop = time.perf_counter() + args.duration
+
+    def client(number):
+        rng = random.Random(number)
+        session = requests.Session()
+        variant = 0
+        while time.perf_counter() < stop:
+            write = rng.random() < args.write_ratio
+            started = time.perf_counter()
+            try:
+                if write:
+                    variant ^= 1
+                    response = session.post(
+                        base + "/api/v1/import-excel", params={"diff": True},
+                        files={"file": ("load.xlsx", payloads[number][variant])}, timeout=60,
+                    )
+                elif rng.random() < 0.5:
+                    response = session.get(base + "/api/v1/stock/summary", timeout=60)
+                else:
+                    term = rng.choice(names).split()[0]
+                    response = session.get(base + "/api/v1/stock", params={"q": term, "limit": 100}, timeout=60)
+                failed = response.status_code >= 500
+                detail = response.text[:200] if failed else None
+            except requests.RequestException as e:
+                failed, detail = True, str(e)[:200]
+            elapsed = time.perf_counter() - started
+            with lock:
+                if failed:
+                    errors.append(detail)
+                else:
+                    (writes if write else reads).append(elapsed)
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return reads, writes, errors
+
+
+def run(mode, workers, args):
+    workdir = tempfile.mkdtemp(prefix="stok-load-")
+    process = None
+    try:
+        names = prepare_database(workdir, args.items, args.gudangs)
+        payloads = [write_payloads(workdir, number, names) for number in range(args.clients)]
+        process, base = start_server(workdir, workers, mode, free_port())
+        reads, writes, errors = run_clients(base, payloads, names, args)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "mode": mode,
+        "workers": workers,
+        "reads_per_second": len(reads) / args.duration,
+        "writes_per_second": len(writes) / args.duration,
+        "errors": len(errors),
+    }
+    for label, samples in (("read", reads), ("write", writes)):
+        if samples:
+            for key, value in percentiles(samples).items():
+                result[f"{label}_{key}"] = value
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", default="1,2,4", help="comma separated uvicorn worker counts")
+    parser.add_argument("--modes", default="queue,direct", help="comma separated write modes: queue, direct")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load per run")
+    parser.add_argument("--write-ratio", type=float, default=0.2, help="share of requests that write")
+    parser.add_argument("--items", type=int, default=5000, help="items in the synthetic catalog")
+    parser.add_argument("--gudangs", type=int, default=10, help="gudangs in the synthetic catalog")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    results = []
+    print(f"{'mode':8} {'workers':>7} {'reads/s':>9} {'writes/s':>9} {'errors':>7} {'read p95':>9} {'write p95':>10}")
+    for mode in args.modes.split(","):
+        for workers in (int(count) for count in args.workers.split(",")):
+            result = run(mode, workers, args)
+            results.append(result)
+            print(
+                f"{mode:8} {workers:7d} {result['reads_per_second']:9.1f} {result['writes_per_second']:9.1f} "
+                f"{result['errors']:7d} {result.get('read_p95_ms', 0):9.1f} {result.get('write_p95_ms', 0):10.1f}"
+            )
+            if "first_error" in result:
+                print(f"  first error: {result['first_error']}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"clients": args.clients, "duration": args.duration, "write_ratio": args.write_ratio,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
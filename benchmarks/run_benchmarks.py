@@ -0,0 +1,332 @@
+"""
+Benchmark suite: stock endpoint latency, import throughput, classifier and normalizer throughput and peak memory.
+
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py [--scales 1000x5,10000x50] [--requests N]
+    python benchmarks/run_benchmarks.py --scales 100000x50 --output big.json --no-compare
+
+Every scale (items x gudangs) gets a fresh temporary database and a
+synthetic workbook from benchmarks/synthetic.py, imported and queried
+through the FastAPI TestClient, so the numbers include routing,
+validation and JSON rendering. Latencies are reported as p50/p95/p99 in
+milliseconds; "cold" requests clear the rendered-body cache first.
+
+Results are written as JSON to --output and compared with --baseline:
+metrics ending in _per_second must not drop, all others (milliseconds,
+megabytes) must not grow, by more than --tolerance. The exit status is 1
+when a metric regressed. Timings are compared after scaling the baseline
+by the calibration workload timed with every run, so a machine that is
+slower or busier than the one of the baseline does not read as a
+regression; latencies that grew by less than MIN_CHANGE_MS do not count. p95/p99 latencies are listed but not checked:
+taken from --requests samples they are mostly noise. Metrics the baseline
+does not have are listed as "no baseline" and not checked either.
+--save-baseline stores the results as the new baseline instead; record
+it again whenever a change moves the numbers on purpose.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import analytics
+import database
+import importer
+from classifier import get_category_by_name
+from synthetic import make_names, make_workbook
+
+DEFAULT_SCALES = "1000x5,10000x50"
+DEFAULT_OUTPUT = os.path.join(ROOT, "benchmarks", "results.json")
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {"p50_ms": rank(50) * 1000, "p95_ms": rank(95) * 1000, "p99_ms": rank(99) * 1000}
+
+
+def best_rate(func, values, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(values)
+        best = min(best, time.perf_counter() - started)
+    return len(values) / best
+
+
+def calibrate(repeat=5):
+    # Milliseconds of a fixed JSON and sorting workload, best of repeat: the
+    # speed of this machine right now, see compare()
+    payload = [{"id": i, "nama": f"ITEM {i:05d}", "stock": list(range(20))} for i in range(5000)]
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decoded = json.loads(json.dumps(payload))
+        sorted(decoded, key=lambda item: item["nama"], reverse=True)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def peak_memory_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_names(count, repeat):
+    names = make_names(count, seed=1)
+
+    def classify(values):
+        for name in values:
+            get_category_by_name(name)
+
+    def normalize(values):
+        for name in values:
+            importer.normalize_ceramic_name(name)
+
+    def normalize_vectorized(values):
+        importer._name_cache.clear() # measure the regex pipeline, not the memo
+        importer.normalize_names(values)
+
+    return {
+        "classifier_names_per_second": best_rate(classify, names, repeat),
+        "normalize_names_per_second": best_rate(normalize, names, repeat),
+        "normalize_vectorized_names_per_second": best_rate(normalize_vectorized, names, repeat),
+    }
+
+
+def bench_scale(items, gudangs, workdir, args):
+    database.DATABASE_NAME = os.path.join(workdir, f"bench_{items}x{gudangs}.db")
+    database.init_db()
+    # backend runs init_db() on import, so it is imported once a database is set
+    import backend
+    from fastapi.testclient import TestClient
+
+    client = TestClient(backend.app)
+    backend._stock_cache.clear() # versions restart at 0 in every new database
+
+    workbook = os.path.join(workdir, f"stock_{items}x{gudangs}.xlsx")
+    names, _ = make_workbook(workbook, items, gudangs, seed=items)
+    with open(workbook, "rb") as f:
+        content = f.read()
+
+    def post_import(stream):
+        response = client.post(
+            "/api/v1/import-excel",
+            params={"stream": stream},
+            files={"file": ("stock.xlsx", content)},
+        )
+        response.raise_for_status()
+
+    results = {}
+    for label, stream in (("import", False), ("import_stream", True)):
+        elapsed = []
+        for _ in range(args.import_repeat):
+            started = time.perf_counter()
+            post_import(stream)
+            elapsed.append(time.perf_counter() - started)
+        results[f"{label}_rows_per_second"] = items / min(elapsed)
+
+    search_term = names[0].split()[0]
+    etag = client.get("/api/v1/stock").headers["ETag"]
+    cases = {
+        "stock_full": ({}, {}, True),
+        "stock_full_cached": ({}, {}, False),
+        "stock_compact": ({"format": "compact"}, {}, True),
+        "stock_search": ({"q": search_term}, {}, True),
+        "stock_page": ({"limit": 100}, {}, True),
+        "stock_not_modified": ({}, {"If-None-Match": etag}, False),
+    }
+    for label, (params, headers, cold) in cases.items():
+        samples = []
+        for _ in range(args.requests):
+            if cold:
+                backend._stock_cache.clear()
+            started = time.perf_counter()
+            response = client.get("/api/v1/stock", params=params, headers=headers)
+            samples.append(time.perf_counter() - started)
+            if response.status_code not in (200, 304):
+                response.raise_for_status()
+        for key, value in percentiles(samples).items():
+            results[f"{label}_{key}"] = value
+
+    # The analytics matrix: its rebuild after a write (best of a few), the
+    # queries on the built matrix (median of many calls, after the first
+    # one sorted) and the endpoints on top of it
+    builds = []
+    for _ in range(5):
+        analytics._matrix = None
+        started = time.perf_counter()
+        matrix = analytics.get_matrix()
+        builds.append(time.perf_counter() - started)
+    results["matrix_build_ms"] = min(builds) * 1000
+    queries = {
+        "matrix_version_check": analytics.get_matrix,
+        "matrix_top": lambda: matrix.top_items(20),
+        "matrix_top_gudang": lambda: matrix.top_items(20, column=0),
+        "matrix_low": lambda: matrix.low_stock(database.LOW_STOCK_THRESHOLD),
+    }
+    for label, query in queries.items():
+        query()
+        samples = []
+        for _ in range(200):
+            started = time.perf_counter()
+            query()
+            samples.append(time.perf_counter() - started)
+        results[f"{label}_ms"] = percentiles(samples)["p50_ms"]
+    analytics_cases = {
+        "stock_top": ("/api/v1/stock/top", {"n": 20}),
+        "stock_low": ("/api/v1/stock/low", {"limit": 100}),
+        "stock_categories": ("/api/v1/stock/categories", {}),
+    }
+    for label, (path, params) in analytics_cases.items():
+        samples = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            client.get(path, params=params).raise_for_status()
+            samples.append(time.perf_counter() - started)
+        for key, value in percentiles(samples).items():
+            results[f"{label}_{key}"] = value
+
+    # Memory is traced in separate runs: tracemalloc slows everything down
+    results["import_peak_mb"] = peak_memory_mb(lambda: post_import(False))
+    results["import_stream_peak_mb"] = peak_memory_mb(lambda: post_import(True))
+
+    def read_full():
+        backend._stock_cache.clear()
+        client.get("/api/v1/stock")
+
+    results["stock_full_peak_mb"] = peak_memory_mb(read_full)
+    client.close()
+    return results
+
+
+def run(args):
+    calibration = [calibrate()]
+    results = {"names": bench_names(args.names, args.repeat)}
+    workdir = tempfile.mkdtemp(prefix="stok-bench-")
+    try:
+        for scale in args.scales.split(","):
+            items, gudangs = (int(part) for part in scale.lower().split("x"))
+            print(f"scale {items} items x {gudangs} gudangs ...", file=sys.stderr)
+            results[f"{items}x{gudangs}"] = bench_scale(items, gudangs, workdir, args)
+    finally:
+        database.close_connection()
+        shutil.rmtree(workdir, ignore_errors=True)
+    calibration.append(calibrate())
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scales": args.scales,
+            "requests": args.requests,
+            "calibration_ms": round(sum(calibration) / len(calibration), 3),
+        },
+        "results": {
+            group: {metric: round(value, 3) for metric, value in metrics.items()}
+            for group, metrics in results.items()
+        },
+    }
+
+
+# Tail latencies, reported but not checked by compare()
+UNGATED_SUFFIXES = ("_p95_ms", "_p99_ms")
+
+# Latency growth in milliseconds below which a metric never counts as regressed
+MIN_CHANGE_MS = 2.0
+
+
+def compare(current, baseline, tolerance):
+    """
+    Prints current vs. baseline per metric and returns the regressed metrics.
+    Baseline timings are scaled by the ratio of the two calibration_ms
+    first; memory is compared as is.
+    """
+    regressions = []
+    speed = 1.0
+    if baseline["meta"].get("calibration_ms") and current["meta"].get("calibration_ms"):
+        speed = current["meta"]["calibration_ms"] / baseline["meta"]["calibration_ms"]
+        print(f"calibration: this run is {speed:.2f}x the time of the baseline run, baseline timings are scaled by it")
+    print(f"{'metric':58} {'baseline':>12} {'current':>12} {'change':>8}")
+    for group, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            reference = baseline["results"].get(group, {}).get(metric)
+            if reference is None:
+                print(f"{group + '.' + metric:58} {'-':>12} {value:12.2f}   no baseline")
+                continue
+            if metric.endswith("_per_second"):
+                reference /= speed
+            elif metric.endswith("_ms"):
+                reference *= speed
+            if reference == 0:
+                continue
+            change = (value - reference) / reference
+            worse = -change if metric.endswith("_per_second") else change
+            flag = ""
+            if worse > tolerance and metric.endswith(UNGATED_SUFFIXES):
+                flag = "  (not checked)"
+            elif worse > tolerance and metric.endswith("_ms") and value - reference < MIN_CHANGE_MS:
+                flag = "  (below MIN_CHANGE_MS)"
+            elif worse > tolerance:
+                flag = "  REGRESSION"
+                regressions.append(f"{group}.{metric}")
+            print(f"{group + '.' + metric:58} {reference:12.2f} {value:12.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma separated ITEMSxGUDANGS, e.g. 1000x5,10000x50,100000x50")
+    parser.add_argument("--requests", type=int, default=20, help="requests per stock endpoint case")
+    parser.add_argument("--import-repeat", type=int, default=3, help="imports per mode, the best one counts")
+    parser.add_argument("--names", type=int, default=20000, help="names for the classifier and normalizer runs")
+    parser.add_argument("--repeat", type=int, default=5, help="best of N runs for name throughput")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before a metric counts as regressed")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline instead of comparing")
+    parser.add_argument("--no-compare", action="store_true", help="only write the results")
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+    current = run(args)
+
+    target = args.baseline if args.save_baseline else args.output
+    with open(target, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"results written to {target}", file=sys.stderr)
+
+    if args.save_baseline or args.no_compare:
+        return
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline to create one", file=sys.stderr)
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
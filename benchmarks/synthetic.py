@@ -0,0 +1,65 @@
+"""
+Synthetic catalogs and stock workbooks for the benchmarks.
+
+Item names are built from the classifier keyword tables (brand or product
+keyword, size, colour/finish and sometimes a KW grade suffix that the
+importer strips), so every category is represented roughly like in the real
+workbooks. Everything is derived from a seed and reproducible.
+"""
+import random
+
+from openpyxl import Workbook
+
+from classifier import RULES
+
+SIZES = ["20X20", "25X40", "30X30", "40X40", "50X50", "60X60", "60/60", "80X80", "20X100", "1/2\"", "3/4\""]
+FINISHES = ["WHITE", "PUTIH", "HITAM", "CREAM", "GREY", "GLOSSY", "MATT", "POLISH", "RUSTIC", "MARBLE", "WOOD", "BEIGE"]
+GRADES = ["", "", "", " KW1", " KW2", " KW-1", " I", " II", " GR"]
+
+
+def make_names(count, seed=0):
+    """Returns count distinct item names as they would appear in a workbook."""
+    rng = random.Random(seed)
+    keywords = [keyword for _, table in RULES for keyword in table]
+    names, seen = [], set()
+    while len(names) < count:
+        words = [rng.choice(keywords)]
+        if rng.random() < 0.3:
+            words.append(rng.choice(keywords))
+        words += [rng.choice(SIZES), rng.choice(FINISHES), f"{rng.randint(1, 999):03d}"]
+        name = " ".join(words) + rng.choice(GRADES)
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def make_gudangs(count):
+    return [f"GUDANG {i + 1:02d}" for i in range(count)]
+
+
+def make_quantities(item_count, gudang_count, seed=0, empty=0.6):
+    """Rows of stock cells; about `empty` of the cells are blank, like real sheets."""
+    rng = random.Random(seed)
+    return [
+        [None if rng.random() < empty else rng.randint(1, 500) for _ in range(gudang_count)]
+        for _ in range(item_count)
+    ]
+
+
+def write_workbook(path, names, gudangs, quantities):
+    """Writes an import workbook: 'Item' in A1, one gudang per column from B1."""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["Item"] + gudangs)
+    for name, row in zip(names, quantities):
+        sheet.append([name] + row)
+    workbook.save(path)
+
+
+def make_workbook(path, items, gudangs, seed=0):
+    """Generates and writes a workbook of items x gudangs, returns (names, gudang names)."""
+    names = make_names(items, seed=seed)
+    gudang_names = make_gudangs(gudangs)
+    write_workbook(path, names, gudang_names, make_quantities(items, gudangs, seed=seed))
+    return names, gudang_names
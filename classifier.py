@@ -0,0 +1,111 @@
+import re
+
+# Keyword tables, in rule priority order: the first rule with a matching
+# keyword decides the category of an item.
+PINGUL_KEYWORDS = ["PINGUL", "PINGULAN", "GRAMETINDO"]
+
+LIST_KEYWORDS = ["LIST"]
+
+# NAT also matches names that start with "AM " (see _compile_rules)
+NAT_KEYWORDS = [" AM ", "LEMKRA"]
+
+STEPNOSING_KEYWORDS = ["STEP", "STP", "STEPNOSING"]
+
+SANITARI_KEYWORDS = [
+    "KRAN", "STOP KRAN", "AUGUSTO", "BRACHIO", "GRAVINO", "VILANOVA",
+    "EXCEL", "SOBAR", "DEVEN", "HALMAR", "EINER", "CLASSIC", "FLEX",
+    "ISCO", "SAVITAR", "APOLLO", "WALLSHOWER", "SHOWER", "HANDSHOWER",
+    "ALPHARD", "HAWAI", "GENTONG", "COUPLING", "UNION", "SELANG", "BCP",
+    "PEMBERSIH", "SARGOT", "AVOR", "SARINGAN", "HANDLE", "BOSSINI",
+    "SAPHIRA", "ENGSEL", "KUNCI", "BOLZANO", "GRENDEL", "LAMPU", "RH",
+    "KAPSTOCK", "TISSUE", "KORDEN", "BAUT", "KAPSTK", "FIONI", "BATHUB",
+    "KAPS", "RAK", "KACA", "PISAU", "GERGAJI", "PENGUIN", "PROFIL", "PELAMPUNG",
+    "WATERHEAT", "WTRHEAT", "WATER HEATER", "WATER HEAT", "PELOR", "GIGI",
+    "TOILET", "COOKER", "KOMPOR", "KITCHEN", "ANGZDOOR", "PKM",
+    "BELLEZA", "COSTO", "DUPON", "FIDEM", "HAND SHOW", "BATH+SHOW", "K DIND",
+    "K DOUBLE", "K SHOW", "K TAMAN", "K WAST", "PLANGSET", "PLST+T", "RING H",
+    "SHOW BIDET", "SHW TNG", "STOP K", "SABUN", "TS CAIR", "WAST +KAB+KC",
+    "HANSA", "MOVE", "OULUSOLID", "SPC", "TASIN", "TOTO", "TRILLIUN", "TRISENSA",
+    "VAPELY", "MAGNET", "SPRINGKNEE", "WASSER", "CABINET",
+    "GERMANY", "IGM", "MASPION", "MERIDIAN", "OULU", "SOLID", "TUTUP", "HAK ANGIN"
+]
+
+GRANIT_KEYWORDS = [
+    "ARNA 60/60", "RMN", "CERANOSA", "RUDY", "GRD", "PASADENA", "SANDIMAS",
+    "ALTHEA", "HELA", "IMPERIAL", "MAXNUM", "MELIUZ", "PAVIA", "REXTON",
+    "A&F", "CERA TILES", "CYAN", "GOLFGRES", "SMART TILES", "AMADEO", "COVE",
+    "GRANIT88", "GROSETO", "QIAOHUI", "ZED", "GRANITO", "NIRO", "DECOGRESS",
+    "INDECOR", "INDOGRES", "GRANIT", "CAVALLO", "CIMETRIC", "PEGASUS",
+    "WHTHORSE", "D-EURO", "TOPFRES", "IKAD", "SUNPWR", "CAVALI", "CITIGRES",
+    "ROTA", "SCAFATI", "PLATINUM", "CENTRO",
+    "A&Y", "DECOGRES 60X60", "GOLGRES", "PORTINO", "SPEEDO", "TOPGRES", "TOSCANA",
+    "DECOGRES 60/60", "WHTHRSE"
+]
+
+KERAMIK_KEYWORDS = [
+    "ARWANA", "UNO", "ALLEGRA", "ATENA", "BATIRUS", "CAKRA", "COLOSSAL",
+    "CONCORD", "DIVA", "ENIGMA", "GRAND", "HABITAT", "HECTOR", "IKAD",
+    "INDOTILE", "KIA", "LAGUNA", "LUNA", "MULIA", "MARINO", "MUSTIKA",
+    "PASCAL", "PASOLA", "PICASSO", "RAMIRO", "REDHORSE", "REDLINE",
+    "SANTALIA", "TERRA", "UNICERA", "VALENCIA", "ZEUS",
+    "ARW", "GEMILANG", "PCSO"
+]
+
+RULES = [
+    ("PINGUL", PINGUL_KEYWORDS),
+    ("LIST", LIST_KEYWORDS),
+    ("NAT", NAT_KEYWORDS),
+    ("STEPNOSING", STEPNOSING_KEYWORDS),
+    ("Sanitari", SANITARI_KEYWORDS),
+    ("Granit", GRANIT_KEYWORDS),
+    ("Keramik", KERAMIK_KEYWORDS),
+]
+
+DEFAULT_CATEGORY = "Lainnya"
+
+CATEGORIES = [category for category, _ in RULES] + [DEFAULT_CATEGORY]
+
+
+def _trie_pattern(keywords):
+    # Builds a regex alternation shaped like a trie of the keywords, so the
+    # engine checks each character once per position instead of once per keyword.
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    return emit(trie)
+
+
+def _compile_rules():
+    # One anchored alternation with a lookahead per rule. Alternatives are
+    # tried left to right, so the first matching rule wins exactly like the
+    # chain of if-statements it replaces, and match.lastgroup is the category.
+    branches = []
+    for category, keywords in RULES:
+        pattern = _trie_pattern(keywords)
+        if category == "NAT":
+            pattern = f"AM |.*?{pattern}"
+        else:
+            pattern = f".*?{pattern}"
+        branches.append(f"(?=(?:{pattern}))(?P<{category}>)")
+    return re.compile("|".join(branches), re.DOTALL)
+
+
+_CATEGORY_PATTERN = _compile_rules()
+
+
+def get_category_by_name(name):
+    match = _CATEGORY_PATTERN.match(str(name).strip().upper())
+    return match.lastgroup if match else DEFAULT_CATEGORY
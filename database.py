@@ -1,101 +1,804 @@
+import hashlib
+import json
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from classifier import get_category_by_name
 
 DATABASE_NAME = "stok_keramik.db"
 
-def init_db():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
+# Applied to every connection opened by get_connection()
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",        # readers no longer block the writer
+    "PRAGMA synchronous = NORMAL",      # safe with WAL, one fsync per checkpoint
+    "PRAGMA cache_size = -32000",       # ~32 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",     # 256 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON",
+)
 
-    # Table for ceramics (keramik)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS keramik (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nama TEXT NOT NULL UNIQUE
+# Seconds a connection waits on a locked database before raising
+BUSY_TIMEOUT = 10
+
+_local = threading.local()
+
+# Called as observer(sql, seconds) after every statement, see observe_queries()
+_query_observer = None
+
+def observe_queries(observer):
+    """
+    Registers observer(sql, seconds), called after every execute() and
+    executemany() on connections of get_connection(); None unregisters it.
+    The time covers running the statement up to its first result row,
+    not fetching the remaining rows.
+    """
+    global _query_observer
+    _query_observer = observer
+
+# Called as observer() after every commit that changed the data version, see observe_commits()
+_commit_observer = None
+
+def observe_commits(observer):
+    """
+    Registers observer(), called on the committing thread right after a
+    transaction that bumped the data version has committed; None
+    unregisters it. Must be quick and must not raise.
+    """
+    global _commit_observer
+    _commit_observer = observer
+
+class _TimedConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        if _query_observer is None:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _query_observer(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, parameters):
+        if _query_observer is None:
+            return super().executemany(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            _query_observer(sql, time.perf_counter() - started)
+
+def _connect(check_same_thread=True):
+    # isolation_level=None: transactions are controlled explicitly by transaction()
+    conn = sqlite3.connect(
+        DATABASE_NAME, timeout=BUSY_TIMEOUT, isolation_level=None, factory=_TimedConnection,
+        check_same_thread=check_same_thread
+    )
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection():
+    """
+    Returns the long-lived connection of the calling thread, opening it on first use.
+    A new connection is opened if DATABASE_NAME has changed since.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.database != DATABASE_NAME:
+        if conn is not None:
+            conn.close()
+        conn = _connect()
+        _local.conn = conn
+        _local.database = DATABASE_NAME
+    return conn
+
+def close_connection():
+    """Closes the connection of the calling thread, if any."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaction(conn=None, immediate=True):
+    """
+    Runs the block inside a single transaction and yields the connection.
+
+    Commits on success and rolls back on any exception. When the connection is
+    already inside a transaction the block simply joins it, so functions below
+    can be combined by the caller into one atomic unit of work. Read-only
+    blocks pass immediate=False to get a consistent snapshot without taking
+    the write lock.
+    """
+    if conn is None:
+        conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+        if id(conn) in _versioned_transactions and _commit_observer is not None:
+            _commit_observer()
+    finally:
+        _versioned_transactions.discard(id(conn))
+
+# Connections whose open transaction has already bumped the data version
+_versioned_transactions = set()
+
+@contextmanager
+def savepoint(conn, name="write_item"):
+    """
+    Runs the block in a savepoint of the transaction open on conn: on error
+    only the block's writes are rolled back and the exception is re-raised,
+    the transaction stays open for the rest of the work.
+    """
+    versioned = id(conn) in _versioned_transactions
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        # A bump made inside the block was rolled back with it; one made
+        # before the savepoint still stands
+        if not versioned:
+            _versioned_transactions.discard(id(conn))
+        raise
+    else:
+        conn.execute(f"RELEASE {name}")
+
+def get_data_version(conn=None):
+    """Returns the current data version, increased by every committed write."""
+    conn = conn or get_connection()
+    return conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
+
+def bump_data_version(conn):
+    """
+    Increases the data version once for the transaction open on conn and
+    returns it. Write helpers call this before writing, so nested helpers
+    inside one transaction share a single new version.
+    """
+    if id(conn) not in _versioned_transactions:
+        conn.execute("UPDATE data_version SET version = version + 1 WHERE id = 1")
+        _versioned_transactions.add(id(conn))
+    return get_data_version(conn)
+
+def init_db(conn=None):
+    with transaction(conn) as conn:
+        cursor = conn.cursor()
+
+        # Table for ceramics (keramik)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS keramik (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nama TEXT NOT NULL UNIQUE
+            )
+        """)
+
+        # Table for gudangs (mitra/warehouses)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS gudang (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nama TEXT NOT NULL UNIQUE
+            )
+        """)
+
+        # Junction table for stock (stok) linking ceramics and gudangs
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS stok (
+                ceramic_id INTEGER NOT NULL,
+                gudang_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (ceramic_id, gudang_id),
+                FOREIGN KEY (ceramic_id) REFERENCES keramik(id) ON DELETE CASCADE,
+                FOREIGN KEY (gudang_id) REFERENCES gudang(id) ON DELETE CASCADE
+            )
+        """)
+
+        # Single-row counter bumped by every write, used for ETags and change tracking
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+
+        # Category is computed once when an item is stored, so reads never reclassify
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(keramik)")]
+        if "category" not in columns:
+            cursor.execute("ALTER TABLE keramik ADD COLUMN category TEXT")
+        backfill_categories(conn)
+
+        _create_change_log(conn)
+
+        # Indexes behind the filtered / paginated stock queries
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stok_gudang ON stok (gudang_id, ceramic_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_keramik_category_nama ON keramik (category, nama)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_keramik_nama_nocase ON keramik (nama COLLATE NOCASE)")
+        _create_name_search_index(conn)
+        _create_stock_summary(conn)
+        _create_stock_history(conn)
+        _create_stock_adjustments(conn)
+
+# Change log compaction limits, see compact_changes()
+CHANGE_LOG_VERSIONS = 200
+CHANGE_LOG_MAX_ROWS = 500000
+
+def _create_change_log(conn):
+    # Every visible change to stok, keramik and gudang is appended by triggers,
+    # stamped with the data version of the writing transaction (write helpers
+    # bump the version before they write). changes_floor is the newest version
+    # whose entries may already have been compacted away.
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(data_version)")]
+    if "changes_floor" not in columns:
+        conn.execute("ALTER TABLE data_version ADD COLUMN changes_floor INTEGER NOT NULL DEFAULT 0")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            entity TEXT NOT NULL,
+            op TEXT NOT NULL,
+            ceramic_id INTEGER,
+            gudang_id INTEGER,
+            quantity INTEGER,
+            nama TEXT,
+            category TEXT
         )
     """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_log_version ON change_log (version)")
 
-    # Table for gudangs (mitra/warehouses)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS gudang (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nama TEXT NOT NULL UNIQUE
+    version = "(SELECT version FROM data_version WHERE id = 1)"
+    triggers = {
+        # Cells missing from stok read as 0, so rows that hold 0 are not news
+        "stok_log_insert": f"""
+            AFTER INSERT ON stok WHEN new.quantity <> 0 BEGIN
+                INSERT INTO change_log (version, entity, op, ceramic_id, gudang_id, quantity)
+                VALUES ({version}, 'stok', 'upsert', new.ceramic_id, new.gudang_id, new.quantity);
+            END""",
+        "stok_log_update": f"""
+            AFTER UPDATE ON stok WHEN old.quantity IS NOT new.quantity BEGIN
+                INSERT INTO change_log (version, entity, op, ceramic_id, gudang_id, quantity)
+                VALUES ({version}, 'stok', 'upsert', new.ceramic_id, new.gudang_id, new.quantity);
+            END""",
+        "stok_log_delete": f"""
+            AFTER DELETE ON stok WHEN old.quantity <> 0 BEGIN
+                INSERT INTO change_log (version, entity, op, ceramic_id, gudang_id)
+                VALUES ({version}, 'stok', 'delete', old.ceramic_id, old.gudang_id);
+            END""",
+        "keramik_log_insert": f"""
+            AFTER INSERT ON keramik BEGIN
+                INSERT INTO change_log (version, entity, op, ceramic_id, nama, category)
+                VALUES ({version}, 'keramik', 'upsert', new.id, new.nama, new.category);
+            END""",
+        "keramik_log_update": f"""
+            AFTER UPDATE OF nama, category ON keramik BEGIN
+                INSERT INTO change_log (version, entity, op, ceramic_id, nama, category)
+                VALUES ({version}, 'keramik', 'upsert', new.id, new.nama, new.category);
+            END""",
+        "keramik_log_delete": f"""
+            AFTER DELETE ON keramik BEGIN
+                INSERT INTO change_log (version, entity, op, ceramic_id)
+                VALUES ({version}, 'keramik', 'delete', old.id);
+            END""",
+        "gudang_log_insert": f"""
+            AFTER INSERT ON gudang BEGIN
+                INSERT INTO change_log (version, entity, op, gudang_id, nama)
+                VALUES ({version}, 'gudang', 'upsert', new.id, new.nama);
+            END""",
+        "gudang_log_update": f"""
+            AFTER UPDATE OF nama ON gudang BEGIN
+                INSERT INTO change_log (version, entity, op, gudang_id, nama)
+                VALUES ({version}, 'gudang', 'upsert', new.id, new.nama);
+            END""",
+        "gudang_log_delete": f"""
+            AFTER DELETE ON gudang BEGIN
+                INSERT INTO change_log (version, entity, op, gudang_id, nama)
+                VALUES ({version}, 'gudang', 'delete', old.id, old.nama);
+            END""",
+    }
+    for name, body in triggers.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+def compact_changes(keep_versions=CHANGE_LOG_VERSIONS, max_rows=CHANGE_LOG_MAX_ROWS, conn=None):
+    """
+    Keeps the change log bounded: entries older than the last keep_versions
+    versions are dropped, then whole old versions until at most max_rows
+    remain. Clients asking for changes below the new floor must reload.
+    """
+    with transaction(conn) as conn:
+        floor = get_data_version(conn) - keep_versions
+        overflow = conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0] - max_rows
+        if overflow > 0:
+            row = conn.execute("SELECT version FROM change_log ORDER BY id LIMIT 1 OFFSET ?", (overflow - 1,)).fetchone()
+            floor = max(floor, row[0])
+        current_floor = conn.execute("SELECT changes_floor FROM data_version WHERE id = 1").fetchone()[0]
+        if floor > current_floor:
+            conn.execute("DELETE FROM change_log WHERE version <= ?", (floor,))
+            conn.execute("UPDATE data_version SET changes_floor = ? WHERE id = 1", (floor,))
+
+def get_changes_since(since, conn=None):
+    """
+    Returns (version, changes) with the latest entry per changed item, gudang
+    and stock cell after version since, or None when since is older than
+    the compacted part of the log and the caller has to reload everything.
+
+    changes is a list of (entity, op, ceramic_id, gudang_id, quantity, nama, category).
+    """
+    with transaction(conn, immediate=False) as conn:
+        version, floor = conn.execute("SELECT version, changes_floor FROM data_version WHERE id = 1").fetchone()
+        if since < floor:
+            return None
+        changes = conn.execute("""
+            SELECT entity, op, ceramic_id, gudang_id, quantity, nama, category
+            FROM change_log
+            WHERE id IN (
+                SELECT MAX(id) FROM change_log
+                WHERE version > ?
+                GROUP BY entity, ceramic_id, gudang_id
+            )
+            ORDER BY id
+        """, (since,)).fetchall()
+    return version, changes
+
+# Quantities from 1 up to this count as low stock in the summary tables
+LOW_STOCK_THRESHOLD = 10
+
+def _summary_delta(sign, row):
+    # Values one stok row (old or new) contributes to its stock_summary cell
+    return (
+        f"{sign}{row}.quantity, "
+        f"{sign}({row}.quantity > 0), "
+        f"{sign}({row}.quantity > 0 AND {row}.quantity <= {LOW_STOCK_THRESHOLD})"
+    )
+
+def _create_stock_summary(conn):
+    # Materialized totals per (category, gudang), kept current by triggers on
+    # stok and keramik, so dashboards read categories x gudangs rows instead of
+    # every stock cell. The triggers are recreated and the tables rebuilt on
+    # every start, which also picks up a changed LOW_STOCK_THRESHOLD.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_summary (
+            category TEXT NOT NULL,
+            gudang_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            items_in_stock INTEGER NOT NULL DEFAULT 0,
+            low_stock INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (category, gudang_id)
         )
     """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS category_summary (
+            category TEXT PRIMARY KEY,
+            items INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    upsert = """
+        INSERT INTO stock_summary (category, gudang_id, quantity, items_in_stock, low_stock)
+        SELECT {category}, {gudang_id}, {values} FROM {source}
+        ON CONFLICT (category, gudang_id) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            items_in_stock = items_in_stock + excluded.items_in_stock,
+            low_stock = low_stock + excluded.low_stock;"""
+    item_count = """
+        INSERT INTO category_summary (category, items) VALUES ({category}, {items})
+        ON CONFLICT (category) DO UPDATE SET items = items + excluded.items;"""
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(data_version)")]
+    if "summary_paused" not in columns:
+        conn.execute("ALTER TABLE data_version ADD COLUMN summary_paused INTEGER NOT NULL DEFAULT 0")
+    active = "(SELECT summary_paused FROM data_version WHERE id = 1) = 0"
+
+    def cell(sign, row):
+        # A deleted keramik row has no category left: its stock was already
+        # taken out by summary_keramik_delete before the cascade reached stok
+        return upsert.format(
+            category="k.category", gudang_id=f"{row}.gudang_id", values=_summary_delta(sign, row),
+            source=f"keramik AS k WHERE k.id = {row}.ceramic_id"
+        )
+
+    def item_stock(sign, category):
+        return upsert.format(
+            category=category, gudang_id="s.gudang_id", values=_summary_delta(sign, "s"),
+            source="stok AS s WHERE s.ceramic_id = old.id AND s.quantity <> 0"
+        )
 
-    # Junction table for stock (stok) linking ceramics and gudangs
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS stok (
+    triggers = {
+        "summary_stok_insert": f"""
+            AFTER INSERT ON stok WHEN new.quantity <> 0 AND {active} BEGIN{cell("", "new")}
+            END""",
+        "summary_stok_update": f"""
+            AFTER UPDATE OF quantity ON stok WHEN old.quantity IS NOT new.quantity AND {active} BEGIN{cell("-", "old")}{cell("", "new")}
+            END""",
+        "summary_stok_delete": f"""
+            AFTER DELETE ON stok WHEN old.quantity <> 0 AND {active} BEGIN{cell("-", "old")}
+            END""",
+        "summary_keramik_insert": f"""
+            AFTER INSERT ON keramik BEGIN{item_count.format(category="new.category", items=1)}
+            END""",
+        "summary_keramik_category": f"""
+            AFTER UPDATE OF category ON keramik WHEN old.category IS NOT new.category BEGIN{item_stock("-", "old.category")}{item_stock("", "new.category")}{item_count.format(category="old.category", items=-1)}{item_count.format(category="new.category", items=1)}
+            END""",
+        "summary_keramik_delete": f"""
+            BEFORE DELETE ON keramik BEGIN{item_stock("-", "old.category")}{item_count.format(category="old.category", items=-1)}
+            END""",
+        "summary_gudang_delete": """
+            AFTER DELETE ON gudang BEGIN
+                DELETE FROM stock_summary WHERE gudang_id = old.id;
+            END""",
+    }
+    for name, body in triggers.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+    rebuild_stock_summary(conn)
+
+def rebuild_stock_summary(conn=None):
+    """Recomputes stock_summary and category_summary from stok and keramik."""
+    with transaction(conn) as conn:
+        conn.execute("DELETE FROM stock_summary")
+        conn.execute(f"""
+            INSERT INTO stock_summary (category, gudang_id, quantity, items_in_stock, low_stock)
+            SELECT k.category, s.gudang_id, SUM(s.quantity),
+                   SUM(s.quantity > 0), SUM(s.quantity > 0 AND s.quantity <= {LOW_STOCK_THRESHOLD})
+            FROM stok AS s
+            JOIN keramik AS k ON k.id = s.ceramic_id
+            WHERE s.quantity <> 0
+            GROUP BY k.category, s.gudang_id
+        """)
+        conn.execute("DELETE FROM category_summary")
+        conn.execute("INSERT INTO category_summary (category, items) SELECT category, COUNT(*) FROM keramik GROUP BY category")
+
+def refresh_stock_summary(gudang_ids, conn=None):
+    """Recomputes the stock_summary rows of the given gudangs from stok."""
+    with transaction(conn) as conn:
+        for chunk in _chunks(list(gudang_ids)):
+            placeholders = ", ".join("?" * len(chunk))
+            conn.execute(f"DELETE FROM stock_summary WHERE gudang_id IN ({placeholders})", chunk)
+            conn.execute(f"""
+                INSERT INTO stock_summary (category, gudang_id, quantity, items_in_stock, low_stock)
+                SELECT k.category, s.gudang_id, SUM(s.quantity),
+                       SUM(s.quantity > 0), SUM(s.quantity > 0 AND s.quantity <= {LOW_STOCK_THRESHOLD})
+                FROM stok AS s
+                JOIN keramik AS k ON k.id = s.ceramic_id
+                WHERE s.gudang_id IN ({placeholders}) AND s.quantity <> 0
+                GROUP BY k.category, s.gudang_id
+            """, chunk)
+
+@contextmanager
+def bulk_stock_writes(gudang_ids, conn):
+    """
+    Suspends the per-cell summary triggers for a bulk rewrite of the stock of
+    gudang_ids inside the transaction open on conn, then refreshes their
+    summary rows in one aggregate pass. On error the transaction is rolled
+    back, which also undoes the pause.
+    """
+    conn.execute("UPDATE data_version SET summary_paused = 1 WHERE id = 1")
+    yield
+    conn.execute("UPDATE data_version SET summary_paused = 0 WHERE id = 1")
+    refresh_stock_summary(gudang_ids, conn=conn)
+
+def get_stock_summary(conn=None):
+    """
+    Reads the materialized summary: returns (version, gudangs, items, cells)
+    where gudangs is [(id, nama)], items maps category -> item count and cells
+    is a list of (category, gudang_id, quantity, items_in_stock, low_stock).
+    Runs in O(categories x gudangs), whatever the size of the catalog.
+    """
+    with transaction(conn, immediate=False) as conn:
+        version = get_data_version(conn)
+        gudangs = conn.execute("SELECT id, nama FROM gudang").fetchall()
+        items = dict(conn.execute("SELECT category, items FROM category_summary WHERE items <> 0"))
+        cells = conn.execute(
+            "SELECT category, gudang_id, quantity, items_in_stock, low_stock FROM stock_summary"
+        ).fetchall()
+    return version, gudangs, items, cells
+
+# A snapshot stores the full stock (a checkpoint) instead of a delta when
+# this many snapshots build on the current checkpoint, or when their deltas
+# add up to as many cells as the checkpoint itself. Either way rebuilding
+# any snapshot reads at most about twice a full copy of the stock.
+HISTORY_CHECKPOINT_EVERY = 30
+
+def _create_stock_history(conn):
+    # Every import and adjustment batch appends a stock_snapshot. A checkpoint snapshot copies all
+    # non-zero cells into stock_history; the others only hold the cells that
+    # changed since the previous snapshot, with 0 for cells that emptied.
+    # The state at a snapshot is the newest row per cell between its
+    # checkpoint and itself. No foreign keys: history outlives deleted items.
+    # change_id is the last change_log entry the snapshot includes.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_snapshot (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            taken_at TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            checkpoint_id INTEGER NOT NULL,
+            cells INTEGER NOT NULL DEFAULT 0,
+            change_id INTEGER
+        )
+    """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(stock_snapshot)")]
+    if "change_id" not in columns:
+        conn.execute("ALTER TABLE stock_snapshot ADD COLUMN change_id INTEGER")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_history (
+            snapshot_id INTEGER NOT NULL,
             ceramic_id INTEGER NOT NULL,
             gudang_id INTEGER NOT NULL,
-            quantity INTEGER NOT NULL DEFAULT 0,
-            PRIMARY KEY (ceramic_id, gudang_id),
-            FOREIGN KEY (ceramic_id) REFERENCES keramik(id) ON DELETE CASCADE,
-            FOREIGN KEY (gudang_id) REFERENCES gudang(id) ON DELETE CASCADE
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, ceramic_id, gudang_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_snapshot_taken_at ON stock_snapshot (taken_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_history_cell ON stock_history (ceramic_id, gudang_id, snapshot_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_history_gudang ON stock_history (gudang_id, snapshot_id)")
+
+def _history_state_sql(ceramic_id=None, gudang_id=None):
+    # Cells of the snapshot (checkpoint_id, snapshot_id) as (ceramic_id,
+    # gudang_id, quantity); SQLite takes the bare columns from the MAX() row
+    where = ["snapshot_id BETWEEN :checkpoint_id AND :snapshot_id"]
+    if ceramic_id is not None:
+        where.append("ceramic_id = :ceramic_id")
+    if gudang_id is not None:
+        where.append("gudang_id = :gudang_id")
+    return f"""
+        SELECT ceramic_id, gudang_id, quantity FROM (
+            SELECT ceramic_id, gudang_id, quantity, MAX(snapshot_id)
+            FROM stock_history
+            WHERE {" AND ".join(where)}
+            GROUP BY ceramic_id, gudang_id
         )
+        WHERE quantity <> 0
+    """
+
+def record_stock_snapshot(source, conn=None):
+    """
+    Appends the current stock to the history as a new snapshot, a delta
+    against the previous snapshot or a checkpoint (see
+    HISTORY_CHECKPOINT_EVERY). Called by the imports and adjust_stock()
+    inside their transaction. Returns the snapshot id.
+    """
+    with transaction(conn) as conn:
+        last = conn.execute(
+            "SELECT id, checkpoint_id, version, change_id FROM stock_snapshot ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        checkpoint = last is None
+        if last is not None:
+            checkpoint_cells, deltas, delta_cells = conn.execute("""
+                SELECT SUM(CASE WHEN id = checkpoint_id THEN cells END),
+                       COUNT(*) - 1,
+                       TOTAL(CASE WHEN id <> checkpoint_id THEN cells END)
+                FROM stock_snapshot WHERE checkpoint_id = ?
+            """, (last[1],)).fetchone()
+            checkpoint = deltas + 1 >= HISTORY_CHECKPOINT_EVERY or delta_cells >= (checkpoint_cells or 0)
+
+        snapshot_id = conn.execute(
+            "INSERT INTO stock_snapshot (taken_at, version, source, checkpoint_id, change_id) "
+            "VALUES (?, ?, ?, 0, (SELECT MAX(id) FROM change_log))",
+            (time.strftime("%Y-%m-%d %H:%M:%S"), get_data_version(conn), source)
+        ).lastrowid
+        params = {"new_id": snapshot_id}
+        if last is not None:
+            params.update(checkpoint_id=last[1], snapshot_id=last[0], change_id=last[3] or 0)
+            floor = conn.execute("SELECT changes_floor FROM data_version WHERE id = 1").fetchone()[0]
+        if checkpoint:
+            cells = conn.execute("""
+                INSERT INTO stock_history (snapshot_id, ceramic_id, gudang_id, quantity)
+                SELECT ?, ceramic_id, gudang_id, quantity FROM stok WHERE quantity <> 0
+            """, (snapshot_id,)).rowcount
+            checkpoint_id = snapshot_id
+        elif last[3] is not None and floor < last[2]:
+            # Only cells in the change log since the last snapshot can differ;
+            # the log still has all of them as nothing of its version was compacted
+            cells = conn.execute("""
+                INSERT INTO stock_history (snapshot_id, ceramic_id, gudang_id, quantity)
+                SELECT :new_id, c.ceramic_id, c.gudang_id, COALESCE(s.quantity, 0)
+                FROM (
+                    SELECT DISTINCT ceramic_id, gudang_id FROM change_log
+                    WHERE id > :change_id AND entity = 'stok'
+                ) AS c
+                LEFT JOIN stok AS s ON s.ceramic_id = c.ceramic_id AND s.gudang_id = c.gudang_id
+                WHERE COALESCE(s.quantity, 0) <> COALESCE((
+                    SELECT h.quantity FROM stock_history AS h
+                    WHERE h.ceramic_id = c.ceramic_id AND h.gudang_id = c.gudang_id
+                      AND h.snapshot_id BETWEEN :checkpoint_id AND :snapshot_id
+                    ORDER BY h.snapshot_id DESC LIMIT 1
+                ), 0)
+            """, params).rowcount
+            checkpoint_id = last[1]
+        else:
+            cells = conn.execute(f"""
+                INSERT INTO stock_history (snapshot_id, ceramic_id, gudang_id, quantity)
+                WITH previous AS MATERIALIZED ({_history_state_sql()})
+                SELECT :new_id, s.ceramic_id, s.gudang_id, s.quantity
+                FROM stok AS s
+                LEFT JOIN previous AS p ON p.ceramic_id = s.ceramic_id AND p.gudang_id = s.gudang_id
+                WHERE s.quantity <> 0 AND p.quantity IS NOT s.quantity
+                UNION ALL
+                SELECT :new_id, p.ceramic_id, p.gudang_id, 0
+                FROM previous AS p
+                LEFT JOIN stok AS s ON s.ceramic_id = p.ceramic_id AND s.gudang_id = p.gudang_id
+                WHERE COALESCE(s.quantity, 0) = 0
+            """, params).rowcount
+            checkpoint_id = last[1]
+        conn.execute("UPDATE stock_snapshot SET checkpoint_id = ?, cells = ? WHERE id = ?", (checkpoint_id, cells, snapshot_id))
+    return snapshot_id
+
+def get_stock_snapshots(conn=None):
+    """Returns every snapshot as (id, taken_at, version, source, is checkpoint, cells stored)."""
+    conn = conn or get_connection()
+    return conn.execute(
+        "SELECT id, taken_at, version, source, id = checkpoint_id, cells FROM stock_snapshot ORDER BY id"
+    ).fetchall()
+
+def _snapshot_at(moment, conn):
+    return conn.execute("""
+        SELECT id, taken_at, version, source, checkpoint_id
+        FROM stock_snapshot WHERE taken_at <= ? ORDER BY taken_at DESC, id DESC LIMIT 1
+    """, (moment,)).fetchone()
+
+def _history_state(snapshot, ceramic_id, gudang_id, conn):
+    if snapshot is None:
+        return {}
+    params = {"checkpoint_id": snapshot[4], "snapshot_id": snapshot[0], "ceramic_id": ceramic_id, "gudang_id": gudang_id}
+    return {
+        (cid, gid): quantity
+        for cid, gid, quantity in conn.execute(_history_state_sql(ceramic_id, gudang_id), params)
+    }
+
+def _history_names(table, ids, conn):
+    names = {}
+    for chunk in _chunks(list(ids)):
+        placeholders = ", ".join("?" * len(chunk))
+        names.update((row[0], row[1:]) for row in conn.execute(
+            f"SELECT id, nama{', category' if table == 'keramik' else ''} FROM {table} WHERE id IN ({placeholders})", chunk
+        ))
+    return names
+
+def get_stock_as_of(moment, ceramic_id=None, gudang_id=None, conn=None):
+    """
+    Reconstructs the stock at the last snapshot taken at or before moment
+    ('YYYY-MM-DD HH:MM:SS', local time), optionally for one item and/or one
+    gudang. Returns (snapshot, cells) where snapshot is (id, taken_at,
+    version, source, checkpoint_id) or None if there is no snapshot yet, and
+    cells is a list of (ceramic_id, nama, category, gudang, quantity) for
+    the non-zero cells of items and gudangs that still exist.
+    """
+    with transaction(conn, immediate=False) as conn:
+        snapshot = _snapshot_at(moment, conn)
+        state = _history_state(snapshot, ceramic_id, gudang_id, conn)
+        items = _history_names("keramik", {cid for cid, _ in state}, conn)
+        gudangs = _history_names("gudang", {gid for _, gid in state}, conn)
+    cells = [
+        (cid, *items[cid], gudangs[gid][0], quantity)
+        for (cid, gid), quantity in state.items()
+        if cid in items and gid in gudangs
+    ]
+    cells.sort(key=lambda cell: (cell[1], cell[3]))
+    return snapshot, cells
+
+def get_stock_movement(start, end, ceramic_id=None, gudang_id=None, conn=None):
+    """
+    Compares the stock as of start with the stock as of end (see
+    get_stock_as_of()). Returns (start snapshot, end snapshot, cells) where
+    cells lists (ceramic_id, nama, category, gudang, before, after) for every
+    cell whose quantity differs.
+    """
+    with transaction(conn, immediate=False) as conn:
+        first = _snapshot_at(start, conn)
+        last = _snapshot_at(end, conn)
+        before = _history_state(first, ceramic_id, gudang_id, conn)
+        after = _history_state(last, ceramic_id, gudang_id, conn) if last != first else before
+        changed = {key for key in before.keys() | after.keys() if before.get(key, 0) != after.get(key, 0)}
+        items = _history_names("keramik", {cid for cid, _ in changed}, conn)
+        gudangs = _history_names("gudang", {gid for _, gid in changed}, conn)
+    cells = [
+        (cid, *items[cid], gudangs[gid][0], before.get((cid, gid), 0), after.get((cid, gid), 0))
+        for cid, gid in changed
+        if cid in items and gid in gudangs
+    ]
+    cells.sort(key=lambda cell: (cell[1], cell[3]))
+    return first, last, cells
+
+def _create_name_search_index(conn):
+    # Trigram full-text index on keramik.nama for substring search, kept in
+    # sync by triggers. Skipped when the SQLite build has no FTS5; searches
+    # then fall back to a LIKE scan.
+    if has_name_search_index(conn):
+        return
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE keramik_fts USING fts5(
+                nama, content='keramik', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError:
+        return
+    conn.execute("""
+        CREATE TRIGGER keramik_fts_insert AFTER INSERT ON keramik BEGIN
+            INSERT INTO keramik_fts (rowid, nama) VALUES (new.id, new.nama);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER keramik_fts_delete AFTER DELETE ON keramik BEGIN
+            INSERT INTO keramik_fts (keramik_fts, rowid, nama) VALUES ('delete', old.id, old.nama);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER keramik_fts_update AFTER UPDATE OF nama ON keramik BEGIN
+            INSERT INTO keramik_fts (keramik_fts, rowid, nama) VALUES ('delete', old.id, old.nama);
+            INSERT INTO keramik_fts (rowid, nama) VALUES (new.id, new.nama);
+        END
     """)
+    conn.execute("INSERT INTO keramik_fts (keramik_fts) VALUES ('rebuild')")
 
-    conn.commit()
-    conn.close()
+def has_name_search_index(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'keramik_fts'").fetchone() is not None
+
+def backfill_categories(conn=None):
+    """Stores the category of every keramik row that does not have one yet."""
+    with transaction(conn) as conn:
+        missing = conn.execute("SELECT id, nama FROM keramik WHERE category IS NULL").fetchall()
+        if missing:
+            bump_data_version(conn)
+        conn.executemany(
+            "UPDATE keramik SET category = ? WHERE id = ?",
+            ((get_category_by_name(nama), c_id) for c_id, nama in missing)
+        )
 
-def add_ceramic(nama):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
+def add_ceramic(nama, conn=None):
     try:
-        cursor.execute("INSERT INTO keramik (nama) VALUES (?)", (nama,))
-        conn.commit()
-        return cursor.lastrowid
+        with transaction(conn) as conn:
+            bump_data_version(conn)
+            cursor = conn.execute(
+                "INSERT INTO keramik (nama, category) VALUES (?, ?)",
+                (nama, get_category_by_name(nama))
+            )
+            return cursor.lastrowid
     except sqlite3.IntegrityError:
         print(f"Keramik '{nama}' sudah ada.")
         return None
-    finally:
-        conn.close()
 
-def get_all_ceramics():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, nama FROM keramik")
-    ceramics = cursor.fetchall()
-    conn.close()
-    return ceramics
-
-def add_gudang(nama_gudang):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
+def get_all_ceramics(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("SELECT id, nama FROM keramik").fetchall()
+
+def add_gudang(nama_gudang, conn=None):
     try:
-        cursor.execute("INSERT INTO gudang (nama) VALUES (?)", (nama_gudang,))
-        conn.commit()
-        return cursor.lastrowid
+        with transaction(conn) as conn:
+            bump_data_version(conn)
+            cursor = conn.execute("INSERT INTO gudang (nama) VALUES (?)", (nama_gudang,))
+            return cursor.lastrowid
     except sqlite3.IntegrityError:
         print(f"Gudang '{nama_gudang}' sudah ada.")
         return None
-    finally:
-        conn.close()
 
-def get_all_gudangs():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, nama FROM gudang")
-    gudangs = cursor.fetchall()
-    conn.close()
-    return gudangs
-
-def update_stock(ceramic_id, gudang_id, quantity):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO stok (ceramic_id, gudang_id, quantity) VALUES (?, ?, ?) "
-        "ON CONFLICT(ceramic_id, gudang_id) DO UPDATE SET quantity = excluded.quantity",
-        (ceramic_id, gudang_id, quantity)
-    )
-    conn.commit()
-    conn.close()
+def get_all_gudangs(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("SELECT id, nama FROM gudang").fetchall()
+
+def update_stock(ceramic_id, gudang_id, quantity, conn=None):
+    with transaction(conn) as conn:
+        bump_data_version(conn)
+        conn.execute(
+            "INSERT INTO stok (ceramic_id, gudang_id, quantity) VALUES (?, ?, ?) "
+            "ON CONFLICT(ceramic_id, gudang_id) DO UPDATE SET quantity = excluded.quantity",
+            (ceramic_id, gudang_id, quantity)
+        )
 
 
 
-def get_stock_details():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
+def get_stock_details(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("""
         SELECT
             k.id,
             k.nama,
@@ -108,65 +811,596 @@ def get_stock_details():
             k.id, k.nama
         ORDER BY
             k.nama
-    """)
-    details = cursor.fetchall()
-    conn.close()
-    return details
-
-def get_stock_by_ceramic_and_gudang(ceramic_id, gudang_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
+    """).fetchall()
+
+def get_stock_matrix(conn=None):
+    """
+    Returns the whole keramik x gudang stock matrix using two set-based queries.
+
+    The result is a tuple (gudangs, rows): gudangs is the list of (id, nama)
+    in the same order as get_all_gudangs(), rows follows get_stock_details()
+    ordering and holds (id, nama, total_stok, category, {gudang_id: quantity}).
+    """
+    return query_stock(conn=conn)
+
+# sort key -> (SQL expression, unique), see query_stock()
+STOCK_SORT_KEYS = {
+    "nama": ("k.nama", True),
+    "total_stock": ("total_stok", False),
+    "id": ("k.id", True),
+}
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def query_stock(category=None, search=None, prefix=None, gudang_ids=None,
+                min_stock=None, max_stock=None, sort="nama", descending=False,
+                limit=None, after=None, conn=None):
+    """
+    Filtered, sorted and optionally paginated version of get_stock_matrix().
+
+    - category: stored item category
+    - search: case-insensitive substring of the name (trigram index when available)
+    - prefix: case-insensitive name prefix (range scan on the NOCASE index)
+    - gudang_ids: only these warehouses are returned and summed into total_stok
+    - min_stock / max_stock: bounds on total_stok
+    - sort: a key of STOCK_SORT_KEYS, ties are broken by id
+    - limit / after: keyset pagination, after is the (sort value, id) of the
+      last row of the previous page
+
+    Returns (gudangs, rows) in the same shape as get_stock_matrix().
+    """
+    sort_expr, sort_unique = STOCK_SORT_KEYS[sort]
+    direction = "DESC" if descending else "ASC"
+    comparison = "<" if descending else ">"
+
+    stok_filter, stok_params = "", []
+    if gudang_ids is not None:
+        gudang_ids = list(gudang_ids)
+        stok_filter = f" AND s.gudang_id IN ({', '.join('?' * len(gudang_ids))})"
+        stok_params = gudang_ids
+
+    where, params = [], []
+    if category:
+        where.append("k.category = ?")
+        params.append(category)
+    if prefix:
+        # Range on the NOCASE index, LIKE keeps the exact prefix semantics
+        lower = prefix.lower()
+        where.append("k.nama COLLATE NOCASE >= ? AND k.nama LIKE ? ESCAPE '\\'")
+        params += [lower, _escape_like(prefix) + "%"]
+        # U+10FFFF has no successor: the bound is taken from the prefix
+        # without it, and a prefix of nothing else has no upper bound
+        stem = lower.rstrip(chr(0x10FFFF))
+        if stem:
+            where.append("k.nama COLLATE NOCASE < ?")
+            params.append(stem[:-1] + chr(ord(stem[-1]) + 1))
+    if search:
+        if len(search) >= 3 and has_name_search_index(conn):
+            where.append("k.id IN (SELECT rowid FROM keramik_fts WHERE keramik_fts MATCH ?)")
+            params.append('"' + search.replace('"', '""') + '"')
+        else:
+            where.append("k.nama LIKE ? ESCAPE '\\'")
+            params.append("%" + _escape_like(search) + "%")
+    if min_stock is not None:
+        where.append("total_stok >= ?")
+        params.append(min_stock)
+    if max_stock is not None:
+        where.append("total_stok <= ?")
+        params.append(max_stock)
+    if after is not None:
+        after_value, after_id = after
+        if sort_unique:
+            where.append(f"{sort_expr} {comparison} ?")
+            params.append(after_value)
+        else:
+            where.append(f"({sort_expr} {comparison} ? OR ({sort_expr} = ? AND k.id {comparison} ?))")
+            params += [after_value, after_value, after_id]
+
+    # The total is a correlated subquery on the stok primary key, so a page
+    # sorted by name or id walks an index and stops after `limit` items.
+    sql = f"""
+        SELECT
+            k.id,
+            k.nama,
+            (SELECT COALESCE(SUM(s.quantity), 0) FROM stok AS s
+             WHERE s.ceramic_id = k.id{stok_filter}) AS total_stok,
+            k.category
+        FROM
+            keramik AS k
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY
+            {sort_expr} {direction}, k.id {direction}
+        {"LIMIT ?" if limit is not None else ""}
+    """
+    params = stok_params + params + ([limit] if limit is not None else [])
+
+    # One read transaction so every query sees the same snapshot
+    with transaction(conn, immediate=False) as conn:
+        gudangs = get_all_gudangs(conn)
+        if gudang_ids is not None:
+            selected = set(gudang_ids)
+            gudangs = [(gid, gname) for gid, gname in gudangs if gid in selected]
+
+        items = conn.execute(sql, params).fetchall()
+
+        quantities = {}
+        if limit is None:
+            # Unpaginated listing: one scan of stok instead of huge IN lists
+            item_ids = {c_id for c_id, _, _, _ in items}
+            gudang_set = {gid for gid, _ in gudangs}
+            for ceramic_id, gudang_id, quantity in conn.execute("SELECT ceramic_id, gudang_id, quantity FROM stok"):
+                if ceramic_id in item_ids and gudang_id in gudang_set:
+                    quantities.setdefault(ceramic_id, {})[gudang_id] = quantity
+        else:
+            page_ids = [c_id for c_id, _, _, _ in items]
+            for chunk in _chunks(page_ids):
+                cells = conn.execute(
+                    f"SELECT ceramic_id, gudang_id, quantity FROM stok AS s "
+                    f"WHERE s.ceramic_id IN ({', '.join('?' * len(chunk))}){stok_filter}",
+                    chunk + stok_params
+                )
+                for ceramic_id, gudang_id, quantity in cells:
+                    quantities.setdefault(ceramic_id, {})[gudang_id] = quantity
+
+    rows = [
+        (c_id, nama, total, category, quantities.get(c_id, {}))
+        for c_id, nama, total, category in items
+    ]
+    return gudangs, rows
+
+# Items per block handed out by open_stock_export()
+EXPORT_CHUNK_SIZE = 1000
+
+def open_stock_export(category=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Opens a streaming read of the whole stock matrix, ordered by name and
+    optionally limited to one category. Returns (version, gudangs, chunks)
+    where chunks yields lists of at most chunk_size
+    (id, nama, category, {gudang_id: quantity}) rows, non-zero cells only.
+
+    The rows come straight from one cursor over keramik joined with stok,
+    so memory is bounded by the block size. The export has its own
+    connection and read transaction, giving one consistent snapshot while
+    writers carry on; the connection is closed when chunks is exhausted or
+    closed. It may be resumed from different threads, as a streaming
+    response does, but not concurrently.
+    """
+    conn = _connect(check_same_thread=False)
+    try:
+        conn.execute("BEGIN")
+        version = get_data_version(conn)
+        gudangs = get_all_gudangs(conn)
+        # Walks the unique name index (or the category/name one), no sort step
+        cursor = conn.execute(f"""
+            SELECT k.id, k.nama, k.category, s.gudang_id, s.quantity
+            FROM keramik AS k
+            LEFT JOIN stok AS s ON s.ceramic_id = k.id AND s.quantity <> 0
+            {"WHERE k.category = ?" if category else ""}
+            ORDER BY k.nama
+        """, (category,) if category else ())
+    except BaseException:
+        conn.close()
+        raise
+
+    def chunks():
+        try:
+            block, current = [], None
+            for c_id, nama, item_category, gudang_id, quantity in cursor:
+                if current is None or current[0] != c_id:
+                    if len(block) >= chunk_size:
+                        yield block
+                        block = []
+                    current = (c_id, nama, item_category, {})
+                    block.append(current)
+                if gudang_id is not None:
+                    current[3][gudang_id] = quantity
+            if block:
+                yield block
+        finally:
+            conn.close()
+
+    return version, gudangs, chunks()
+
+def get_stock_by_ceramic_and_gudang(ceramic_id, gudang_id, conn=None):
+    conn = conn or get_connection()
+    result = conn.execute(
         "SELECT quantity FROM stok WHERE ceramic_id = ? AND gudang_id = ?",
         (ceramic_id, gudang_id)
-    )
-    result = cursor.fetchone()
-    conn.close()
+    ).fetchone()
     return result[0] if result else 0
 
-def delete_ceramic(ceramic_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM keramik WHERE id = ?", (ceramic_id,))
-    conn.commit()
-    conn.close()
-
-def delete_gudang(gudang_id):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM gudang WHERE id = ?", (gudang_id,))
-    conn.commit()
-    conn.close()
-
-def get_or_create_gudang(nama_gudang):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM gudang WHERE nama = ?", (nama_gudang,))
-    result = cursor.fetchone()
-    if result:
-        conn.close()
-        return result[0]
-    else:
-        cursor.execute("INSERT INTO gudang (nama) VALUES (?)", (nama_gudang,))
-        conn.commit()
-        last_id = cursor.lastrowid
-        conn.close()
-        return last_id
-
-def get_or_create_ceramic(nama):
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM keramik WHERE nama = ?", (nama,))
-    result = cursor.fetchone()
-    if result:
-        conn.close()
-        return result[0]
-    else:
-        cursor.execute("INSERT INTO keramik (nama) VALUES (?)", (nama,))
-        conn.commit()
-        last_id = cursor.lastrowid
-        conn.close()
-        return last_id
+def delete_ceramic(ceramic_id, conn=None):
+    with transaction(conn) as conn:
+        bump_data_version(conn)
+        conn.execute("DELETE FROM keramik WHERE id = ?", (ceramic_id,))
+
+def delete_gudang(gudang_id, conn=None):
+    with transaction(conn) as conn:
+        bump_data_version(conn)
+        conn.execute("DELETE FROM gudang WHERE id = ?", (gudang_id,))
+
+def get_or_create_gudang(nama_gudang, conn=None):
+    with transaction(conn) as conn:
+        result = conn.execute("SELECT id FROM gudang WHERE nama = ?", (nama_gudang,)).fetchone()
+        if result:
+            return result[0]
+        bump_data_version(conn)
+        return conn.execute("INSERT INTO gudang (nama) VALUES (?)", (nama_gudang,)).lastrowid
+
+def get_or_create_ceramic(nama, conn=None):
+    with transaction(conn) as conn:
+        result = conn.execute("SELECT id FROM keramik WHERE nama = ?", (nama,)).fetchone()
+        if result:
+            return result[0]
+        bump_data_version(conn)
+        return conn.execute(
+            "INSERT INTO keramik (nama, category) VALUES (?, ?)",
+            (nama, get_category_by_name(nama))
+        ).lastrowid
+
+def _chunks(values, size=500):
+    # Keeps IN (...) lists well under SQLITE_MAX_VARIABLE_NUMBER
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def _lookup_ids(table, names, conn):
+    ids = {}
+    for chunk in _chunks(names):
+        placeholders = ", ".join("?" * len(chunk))
+        ids.update(conn.execute(f"SELECT nama, id FROM {table} WHERE nama IN ({placeholders})", chunk))
+    return ids
+
+def get_or_create_gudangs(gudang_names, conn=None):
+    """Returns the ids of gudang_names, in the same order, creating missing gudangs."""
+    unique_names = list(dict.fromkeys(gudang_names))
+    with transaction(conn) as conn:
+        # Look the names up first: INSERT OR IGNORE would burn AUTOINCREMENT
+        # ids for every existing name, so only the missing ones are inserted.
+        ids = _lookup_ids("gudang", unique_names, conn)
+        missing = [nama for nama in unique_names if nama not in ids]
+        if missing:
+            bump_data_version(conn)
+            conn.executemany("INSERT INTO gudang (nama) VALUES (?)", ((nama,) for nama in missing))
+            ids.update(_lookup_ids("gudang", missing, conn))
+    return [ids[nama] for nama in gudang_names]
+
+def get_or_create_ceramics(names, conn=None):
+    """
+    Resolves item names to keramik ids in one pass, creating missing items in
+    first-seen order together with their category. Returns a dict {nama: id}.
+    """
+    unique_names = list(dict.fromkeys(names))
+    with transaction(conn) as conn:
+        ids = _lookup_ids("keramik", unique_names, conn)
+        missing = [nama for nama in unique_names if nama not in ids]
+        if missing:
+            bump_data_version(conn)
+            conn.executemany(
+                "INSERT INTO keramik (nama, category) VALUES (?, ?)",
+                ((nama, get_category_by_name(nama)) for nama in missing)
+            )
+            ids.update(_lookup_ids("keramik", missing, conn))
+        return ids
+
+def reset_stock(gudang_ids, conn=None):
+    """Sets every stock cell of the given gudangs to 0."""
+    with transaction(conn) as conn:
+        bump_data_version(conn)
+        conn.executemany("UPDATE stok SET quantity = 0 WHERE gudang_id = ?", ((gid,) for gid in gudang_ids))
+
+def write_stock_rows(gudang_ids, rows, conn=None):
+    """
+    Upserts a block of stock rows with a single executemany.
+    rows is an iterable of (ceramic_id, quantities) where quantities is aligned with gudang_ids.
+    """
+    with transaction(conn) as conn:
+        bump_data_version(conn)
+        conn.executemany(
+            "INSERT INTO stok (ceramic_id, gudang_id, quantity) VALUES (?, ?, ?) "
+            "ON CONFLICT(ceramic_id, gudang_id) DO UPDATE SET quantity = excluded.quantity",
+            (
+                (ceramic_id, gudang_id, quantity)
+                for ceramic_id, quantities in rows
+                for gudang_id, quantity in zip(gudang_ids, quantities)
+            )
+        )
+
+def import_stock(gudang_names, rows, conn=None):
+    """
+    Replaces the stock of gudang_names with rows of (nama, quantities) atomically.
+
+    The gudangs are created if needed and reset to 0, item names are resolved
+    in one pass and all cells are upserted in the same transaction, so a
+    failure leaves the previous stock untouched. Later rows for the same item
+    overwrite earlier ones. Returns the list of gudang ids.
+    """
+    return import_stock_chunks(gudang_names, [list(rows)], conn=conn)
+
+def import_stock_chunks(gudang_names, chunks, conn=None):
+    """
+    Same as import_stock() but takes an iterable of row blocks, which are
+    resolved and written one at a time inside the single import transaction.
+    Used by the streaming import to keep memory bounded by the block size.
+    """
+    with transaction(conn) as conn:
+        bump_data_version(conn)
+        gudang_ids = get_or_create_gudangs(gudang_names, conn=conn)
+        with bulk_stock_writes(gudang_ids, conn):
+            reset_stock(gudang_ids, conn=conn)
+            for rows in chunks:
+                ceramic_ids = get_or_create_ceramics([nama for nama, _ in rows], conn=conn)
+                write_stock_rows(gudang_ids, ((ceramic_ids[nama], quantities) for nama, quantities in rows), conn=conn)
+        compact_changes(conn=conn)
+        record_stock_snapshot("import", conn=conn)
+    return gudang_ids
+
+def diff_stock(gudang_names, rows, conn=None):
+    """
+    Compares rows of (nama, quantities) with the stored stock of gudang_names.
+
+    Returns the list of cells an import of the rows would change, as
+    (nama, gudang, old quantity, new quantity). Missing cells count as 0 and
+    stored cells of these gudangs that the rows do not mention become 0, the
+    same outcome as import_stock(). Nothing is written.
+    """
+    incoming = {}
+    for nama, quantities in rows:
+        for gudang, quantity in zip(gudang_names, quantities):
+            incoming[nama, gudang] = quantity
+
+    with transaction(conn, immediate=False) as conn:
+        current = {}
+        unique_gudangs = list(dict.fromkeys(gudang_names))
+        for chunk in _chunks(unique_gudangs):
+            placeholders = ", ".join("?" * len(chunk))
+            current.update(((nama, gudang), quantity) for nama, gudang, quantity in conn.execute(f"""
+                SELECT k.nama, g.nama, s.quantity
+                FROM stok s
+                JOIN keramik k ON k.id = s.ceramic_id
+                JOIN gudang g ON g.id = s.gudang_id
+                WHERE g.nama IN ({placeholders}) AND s.quantity <> 0
+            """, chunk))
+
+    changes = [(nama, gudang, current.get((nama, gudang), 0), quantity)
+               for (nama, gudang), quantity in incoming.items()
+               if quantity != current.get((nama, gudang), 0)]
+    changes.extend((nama, gudang, quantity, 0)
+                   for (nama, gudang), quantity in current.items()
+                   if (nama, gudang) not in incoming)
+    return changes
+
+def import_stock_diff(gudang_names, rows, dry_run=False, conn=None):
+    """
+    Imports rows of (nama, quantities) like import_stock(), but writes only
+    the cells whose quantity actually changes instead of resetting the
+    gudangs and rewriting every cell, so unchanged cells cost no writes, no
+    WAL pages and no change_log entries. Missing gudangs and items are still
+    created, and the data version is only bumped when something changed.
+
+    Returns (changes, new_items) where changes is the diff_stock() list and
+    new_items the names that do not exist yet. With dry_run=True nothing is
+    written.
+    """
+    rows = list(rows)
+    names = list(dict.fromkeys(nama for nama, _ in rows))
+    with transaction(conn, immediate=not dry_run) as conn:
+        changes = diff_stock(gudang_names, rows, conn=conn)
+        known = _lookup_ids("keramik", names, conn)
+        new_items = [nama for nama in names if nama not in known]
+        if dry_run:
+            return changes, new_items
+
+        gudang_ids = dict(zip(gudang_names, get_or_create_gudangs(gudang_names, conn=conn)))
+        # Cells being zeroed can belong to items the rows do not mention
+        ceramic_ids = get_or_create_ceramics(names + [nama for nama, *_ in changes], conn=conn)
+        if changes:
+            bump_data_version(conn)
+            conn.executemany(
+                "INSERT INTO stok (ceramic_id, gudang_id, quantity) VALUES (?, ?, ?) "
+                "ON CONFLICT(ceramic_id, gudang_id) DO UPDATE SET quantity = excluded.quantity",
+                (
+                    (ceramic_ids[nama], gudang_ids[gudang], new)
+                    for nama, gudang, _, new in changes
+                )
+            )
+            compact_changes(conn=conn)
+        record_stock_snapshot("diff import", conn=conn)
+    return changes, new_items
+
+def import_stock_batch(workbooks, conn=None):
+    """
+    Imports several parsed workbooks in one transaction.
+
+    workbooks is a list of (gudang_names, rows) like the arguments of
+    import_stock(). All gudang and item names are resolved in one pass up
+    front, then each workbook resets its gudangs and writes its rows in
+    order, so the result is the same as importing the files one after the
+    other, but atomic. Returns the gudang ids of every workbook.
+    """
+    workbooks = [(gudang_names, list(rows)) for gudang_names, rows in workbooks]
+    with transaction(conn) as conn:
+        bump_data_version(conn)
+        all_gudangs = [nama for gudang_names, _ in workbooks for nama in gudang_names]
+        gudang_ids = dict(zip(all_gudangs, get_or_create_gudangs(all_gudangs, conn=conn)))
+        ceramic_ids = get_or_create_ceramics([nama for _, rows in workbooks for nama, _ in rows], conn=conn)
+
+        result = []
+        with bulk_stock_writes(set(gudang_ids.values()), conn):
+            for gudang_names, rows in workbooks:
+                ids = [gudang_ids[nama] for nama in gudang_names]
+                reset_stock(ids, conn=conn)
+                write_stock_rows(ids, ((ceramic_ids[nama], quantities) for nama, quantities in rows), conn=conn)
+                result.append(ids)
+        compact_changes(conn=conn)
+        record_stock_snapshot("batch import", conn=conn)
+    return result
+
+# Days an idempotency key of adjust_stock() is remembered
+ADJUSTMENT_KEY_DAYS = 7
+
+ADJUSTMENT_OPS = ("set", "delta", "transfer")
+
+class AdjustmentError(ValueError):
+    """Raised by adjust_stock() for a batch that cannot be applied; nothing is written."""
+
+class AdjustmentConflict(AdjustmentError):
+    """A batch that conflicts with the stored stock or with an earlier use of its idempotency key."""
+
+def _create_stock_adjustments(conn):
+    # Result of every adjustment batch sent with an idempotency key, so a
+    # retried request gets the first response instead of being applied
+    # twice. fingerprint tells a retry from another batch reusing the key.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stock_adjustment (
+            key TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            result TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_stock_adjustment_created_at ON stock_adjustment (created_at)")
+
+def _resolve_adjustments(adjustments, conn):
+    # Expands the batch into (seq, ceramic_id, gudang_id, op, quantity) rows,
+    # a transfer into two deltas of the same seq
+    names = [item for _, item, *_ in adjustments if isinstance(item, str)]
+    items = _lookup_ids("keramik", names, conn)
+    ids = list({item for _, item, *_ in adjustments if not isinstance(item, str)})
+    for chunk in _chunks(ids):
+        placeholders = ", ".join("?" * len(chunk))
+        items.update((cid, cid) for cid, in conn.execute(f"SELECT id FROM keramik WHERE id IN ({placeholders})", chunk))
+    for seq, (op, _, gudang, quantity, to_gudang) in enumerate(adjustments):
+        if op not in ADJUSTMENT_OPS:
+            raise AdjustmentError(f"Adjustment {seq}: unknown op {op!r}, use {', '.join(ADJUSTMENT_OPS)}.")
+        if op == "transfer":
+            if not to_gudang or to_gudang == gudang or quantity <= 0:
+                raise AdjustmentError(f"Adjustment {seq}: a transfer needs a positive quantity and a different to_gudang.")
+        elif to_gudang is not None:
+            raise AdjustmentError(f"Adjustment {seq}: to_gudang only applies to transfer.")
+    named = [g for _, _, gudang, _, to_gudang in adjustments for g in (gudang, to_gudang) if g]
+    gudangs = _lookup_ids("gudang", named, conn)
+
+    unknown_items = list(dict.fromkeys(str(item) for _, item, *_ in adjustments if item not in items))
+    if unknown_items:
+        raise AdjustmentError(f"Unknown items: {', '.join(unknown_items[:10])}")
+    unknown_gudangs = list(dict.fromkeys(g for g in named if g not in gudangs))
+    if unknown_gudangs:
+        raise AdjustmentError(f"Unknown warehouses: {', '.join(unknown_gudangs[:10])}")
+
+    rows = []
+    for seq, (op, item, gudang, quantity, to_gudang) in enumerate(adjustments):
+        if op == "transfer":
+            rows.append((seq, items[item], gudangs[gudang], "delta", -quantity))
+            rows.append((seq, items[item], gudangs[to_gudang], "delta", quantity))
+        else:
+            rows.append((seq, items[item], gudangs[gudang], op, quantity))
+    return rows
+
+def adjust_stock(adjustments, key=None, allow_negative=False, conn=None):
+    """
+    Applies a batch of stock adjustments atomically.
+
+    adjustments is a list of (op, item, gudang, quantity, to_gudang) with
+    item a keramik id or name and gudang a gudang name. op 'set' makes
+    quantity the new stock, 'delta' adds it (negative to deduct) and
+    'transfer' moves it from gudang to to_gudang, which the other ops must
+    leave None. They apply in order, so a delta after a set on the same
+    cell adds to the set value. The batch is loaded into a temporary table
+    and every cell is computed and written by a few set-based statements,
+    however many adjustments it holds.
+
+    Unknown items or gudangs raise AdjustmentError; a cell the batch would
+    lower to below 0 raises AdjustmentConflict unless allow_negative. Either way
+    nothing is written. With a key the result is kept for
+    ADJUSTMENT_KEY_DAYS days: the same batch sent again with the key returns
+    it unchanged instead of being applied twice, a different batch with
+    the key raises AdjustmentConflict.
+
+    Returns (version, cells, replayed) where cells lists the changed cells
+    as [ceramic_id, nama, gudang, old, new] and replayed tells whether the
+    result is the stored one of an earlier request.
+    """
+    adjustments = [tuple(adjustment) for adjustment in adjustments]
+    fingerprint = hashlib.sha256(json.dumps([adjustments, allow_negative]).encode("utf-8")).hexdigest()
+    with transaction(conn) as conn:
+        if key is not None:
+            stored = conn.execute("SELECT fingerprint, result FROM stock_adjustment WHERE key = ?", (key,)).fetchone()
+            if stored is not None:
+                if stored[0] != fingerprint:
+                    raise AdjustmentConflict(f"Idempotency key {key!r} was already used for a different batch.")
+                version, cells = json.loads(stored[1])
+                return version, cells, True
+
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS adjustment_input (
+                seq INTEGER NOT NULL, ceramic_id INTEGER NOT NULL, gudang_id INTEGER NOT NULL,
+                op TEXT NOT NULL, quantity INTEGER NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS adjustment_result (
+                ceramic_id INTEGER NOT NULL, gudang_id INTEGER NOT NULL, old INTEGER NOT NULL, new INTEGER NOT NULL,
+                PRIMARY KEY (ceramic_id, gudang_id)
+            )
+        """)
+        conn.execute("DELETE FROM adjustment_input")
+        conn.execute("DELETE FROM adjustment_result")
+        conn.executemany("INSERT INTO adjustment_input VALUES (?, ?, ?, ?, ?)", _resolve_adjustments(adjustments, conn))
+
+        # Per cell: the last set (or the stored quantity) plus the deltas after it
+        conn.execute("""
+            INSERT INTO adjustment_result (ceramic_id, gudang_id, old, new)
+            WITH ordered AS (
+                SELECT ceramic_id, gudang_id, op, quantity, seq,
+                       MAX(CASE WHEN op = 'set' THEN seq END) OVER (PARTITION BY ceramic_id, gudang_id) AS last_set
+                FROM adjustment_input
+            ),
+            cells AS (
+                SELECT ceramic_id, gudang_id,
+                       MAX(CASE WHEN op = 'set' AND seq = last_set THEN quantity END) AS set_quantity,
+                       COALESCE(SUM(CASE WHEN op = 'delta' AND seq > COALESCE(last_set, -1) THEN quantity END), 0) AS delta
+                FROM ordered
+                GROUP BY ceramic_id, gudang_id
+            )
+            SELECT c.ceramic_id, c.gudang_id, COALESCE(s.quantity, 0), COALESCE(c.set_quantity, s.quantity, 0) + c.delta
+            FROM cells AS c
+            LEFT JOIN stok AS s ON s.ceramic_id = c.ceramic_id AND s.gudang_id = c.gudang_id
+        """)
+        changed = """
+            SELECT r.ceramic_id, k.nama, g.nama, r.old, r.new
+            FROM adjustment_result AS r
+            JOIN keramik AS k ON k.id = r.ceramic_id
+            JOIN gudang AS g ON g.id = r.gudang_id
+            WHERE {}
+            ORDER BY k.nama, g.nama
+        """
+        if not allow_negative:
+            negative = conn.execute(changed.format("r.new < 0 AND r.new < r.old") + " LIMIT 10").fetchall()
+            if negative:
+                raise AdjustmentConflict("Stock would go below 0: " + ", ".join(
+                    f"{nama} in {gudang} ({new})" for _, nama, gudang, _, new in negative))
+
+        cells = [list(row) for row in conn.execute(changed.format("r.old <> r.new"))]
+        if cells:
+            bump_data_version(conn)
+            conn.execute("""
+                INSERT INTO stok (ceramic_id, gudang_id, quantity)
+                SELECT ceramic_id, gudang_id, new FROM adjustment_result WHERE old <> new
+                ON CONFLICT(ceramic_id, gudang_id) DO UPDATE SET quantity = excluded.quantity
+            """)
+            compact_changes(conn=conn)
+            record_stock_snapshot("adjustment", conn=conn)
+        version = get_data_version(conn)
+
+        if key is not None:
+            expired = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() - ADJUSTMENT_KEY_DAYS * 86400))
+            conn.execute("DELETE FROM stock_adjustment WHERE created_at < ?", (expired,))
+            conn.execute(
+                "INSERT INTO stock_adjustment (key, created_at, fingerprint, result) VALUES (?, ?, ?, ?)",
+                (key, time.strftime("%Y-%m-%d %H:%M:%S"), fingerprint, json.dumps([version, cells]))
+            )
+    return version, cells, False
 
 if __name__ == "__main__":
     init_db()
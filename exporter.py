@@ -0,0 +1,135 @@
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+# Characters XML 1.0 cannot carry at all; dropped from exported text
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>"""
+
+_ROOT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>"""
+
+# Header row frozen, so it stays visible while scrolling
+_SHEET_START = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>
+<sheetData>"""
+
+_SHEET_END = "</sheetData></worksheet>"
+
+
+def export_header(gudangs, details=False):
+    """
+    Column titles of an export: 'Item' and one column per gudang, the layout
+    the importer reads, followed by Category and Total with details=True.
+    """
+    return ["Item"] + [gname for _, gname in gudangs] + (["Category", "Total"] if details else [])
+
+
+def export_rows(gudangs, chunks, details=False):
+    """Turns the blocks of database.open_stock_export() into blocks of export_header() aligned rows."""
+    gudang_ids = [gid for gid, _ in gudangs]
+    for block in chunks:
+        rows = []
+        for _, nama, category, quantities in block:
+            cells = [quantities.get(gid, 0) or 0 for gid in gudang_ids]
+            if details:
+                cells += [category, sum(quantities.values())]
+            rows.append([nama] + cells)
+        yield rows
+
+
+def stream_csv(header, blocks):
+    """
+    Yields a CSV file as bytes, one piece per block of rows. Starts with a
+    UTF-8 byte order mark so Excel detects the encoding.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield b"\xef\xbb\xbf" + buffer.getvalue().encode("utf-8")
+    for rows in blocks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _ZipSink:
+    # Write-only file object for zipfile; has no tell(), so zipfile writes a
+    # streamable archive (data descriptors after each member)
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_XML_ILLEGAL.sub("", str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_rows(rows):
+    return "".join("<row>" + "".join(_xlsx_cell(value) for value in row) + "</row>" for row in rows)
+
+
+def stream_xlsx(header, blocks, sheet_name="Stok"):
+    """
+    Yields a single-sheet .xlsx workbook as bytes, one piece per block of
+    rows, without ever holding the workbook in memory or on disk.
+
+    openpyxl's write-only mode still saves through a finished file, so the
+    minimal package (content types, workbook, one worksheet with inline
+    strings) is written here through zipfile into a streaming sink.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _ROOT_RELS)
+        archive.writestr("xl/workbook.xml", _WORKBOOK.format(name=escape(sheet_name, {'"': "&quot;"})))
+        archive.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write((_SHEET_START + _xlsx_rows([header])).encode("utf-8"))
+            yield sink.take()
+            for rows in blocks:
+                sheet.write(_xlsx_rows(rows).encode("utf-8"))
+                data = sink.take()
+                if data:
+                    yield data
+            sheet.write(_SHEET_END.encode("utf-8"))
+    yield sink.take()
@@ -0,0 +1,353 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+from database import import_stock_chunks, import_stock_diff
+from writer import run_bulk_write
+
+# Rows handed to the database per executemany batch in streaming mode
+STREAM_CHUNK_SIZE = 2000
+
+# Worker processes used by read_workbooks(); None means one per CPU
+PARSE_WORKERS = None
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+class ImportFormatError(ValueError):
+    """Raised when an uploaded workbook does not follow the 'Item' + gudang columns layout."""
+
+
+# Hapus suffix varian
+_VARIANT_SUFFIX = re.compile(r'\s*(KW1-B|KW2-B|KW1-N|KW1-G|KW-1|KW-2|KW1|KW2|I|II)$')
+# Ganti 'GR' atau 'GRIS' menjadi 'GRISS' jika di akhir nama
+_GRISS_SUFFIX = re.compile(r'\s*(GR|GRIS)$')
+# Hapus spasi berlebih
+_SPACES = re.compile(r'\s+')
+
+# Upper bound of the raw -> normalized name memo; oldest entries are evicted first
+NAME_CACHE_SIZE = 50000
+
+_name_cache = {}
+_name_cache_lock = threading.Lock()
+
+
+def normalize_ceramic_name(name):
+    name = str(name).strip().upper()
+    name = _VARIANT_SUFFIX.sub('', name)
+    name = _GRISS_SUFFIX.sub('GRISS', name)
+    name = _SPACES.sub(' ', name).strip()
+    return name
+
+
+def _remember(pairs):
+    with _name_cache_lock:
+        for raw, normalized in pairs:
+            _name_cache[raw] = normalized
+        while len(_name_cache) > NAME_CACHE_SIZE:
+            del _name_cache[next(iter(_name_cache))]
+
+
+def normalize_names(names):
+    """
+    Normalizes a whole pandas Series (or any sequence) of raw names at once.
+
+    Returns a Series with the same index and exactly the values of
+    normalize_ceramic_name(). Each distinct raw name is normalized once:
+    names already seen by earlier imports come from a bounded memo, the rest
+    go through the precompiled patterns as one vectorized .str pipeline.
+    """
+    if not isinstance(names, pd.Series):
+        names = pd.Series(names, dtype=object)
+
+    if pd.api.types.infer_dtype(names, skipna=False) != "string":
+        names = names.map(str)
+
+    uniques = pd.unique(names)
+    with _name_cache_lock:
+        known = {raw: _name_cache[raw] for raw in uniques if raw in _name_cache}
+    misses = [raw for raw in uniques if raw not in known]
+
+    if misses:
+        # object dtype keeps Python's re semantics for \s and $ on every pandas backend
+        normalized = (
+            pd.Series(misses, dtype=object)
+            .str.strip().str.upper()
+            .str.replace(_VARIANT_SUFFIX, '', regex=True)
+            .str.replace(_GRISS_SUFFIX, 'GRISS', regex=True)
+            .str.replace(_SPACES, ' ', regex=True)
+            .str.strip()
+        )
+        computed = dict(zip(misses, normalized))
+        _remember(computed.items())
+        known.update(computed)
+
+    return names.map(known)
+
+
+def _parse_quantity(value):
+    # float() reads some cells pd.to_numeric rejects, e.g. full-width digits or '1_000'
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def to_quantities(frame):
+    """
+    Converts a block of raw stock cells to an int64 matrix in one vectorized step.
+    Same rules as the old per-cell int(float(value)): decimals are truncated,
+    empty or non-numeric cells become 0. Cells pd.to_numeric cannot read go
+    through float() one by one. A quantity that is infinite or does not fit
+    in int64 raises ImportFormatError.
+    """
+    values = frame.apply(pd.to_numeric, errors="coerce").to_numpy(dtype="float64", na_value=np.nan, copy=True)
+    # Only object columns (text cells) can hold values to_numeric rejected
+    columns = [i for i, dtype in enumerate(frame.dtypes) if dtype == object]
+    if columns:
+        rows, positions = np.nonzero(np.isnan(values[:, columns]))
+        cells = frame.iloc[:, columns].to_numpy(dtype=object)[rows, positions]
+        rejected = pd.notna(cells)
+        for row, position, cell in zip(rows[rejected], positions[rejected], cells[rejected]):
+            values[row, columns[position]] = _parse_quantity(cell)
+
+    values = np.trunc(np.where(np.isnan(values), 0, values))
+    out_of_range = (values >= 2.0 ** 63) | (values < -2.0 ** 63)
+    if out_of_range.any():
+        row, column = np.argwhere(out_of_range)[0]
+        raise ImportFormatError(f"Stock quantity {frame.iat[row, column]!r} is out of range.")
+    return values.astype("int64")
+
+
+def _check_header(columns):
+    # Returns (item column, gudang columns) or raises ImportFormatError
+    if len(columns) == 0 or str(columns[0]).lower() != 'item':
+        raise ImportFormatError("Invalid Excel format. First column (A1) must have header 'Item'.")
+    gudang_cols = [col for col in columns[1:] if not str(col).lower().startswith('unnamed')]
+    if len(gudang_cols) == 0:
+        raise ImportFormatError("No warehouse columns found in the Excel file (starting from B1) or all warehouse columns are unnamed.")
+    return columns[0], gudang_cols
+
+
+def read_workbook(source):
+    """
+    Reads a stock workbook into (gudang_names, names, quantities).
+
+    names holds the normalized item name of every usable row (rows with an
+    empty item are skipped) and quantities is an int64 matrix of shape
+    (len(names), len(gudang_names)).
+    """
+    df = pd.read_excel(source, header=0)
+    item_col, gudang_cols = _check_header(df.columns)
+
+    items = df[item_col]
+    items = items[items.notna()].astype(str).str.strip()
+    items = items[items != ""]
+
+    names = normalize_names(items).tolist()
+    quantities = to_quantities(df.loc[items.index, gudang_cols])
+    return [str(col) for col in gudang_cols], names, quantities
+
+
+def _header_labels(header_row):
+    # Same labels pandas gives the header row: empty cells become
+    # 'Unnamed: <n>' and repeated names get a '.<n>' suffix.
+    labels, seen = [], {}
+    for position, value in enumerate(header_row):
+        label = f"Unnamed: {position}" if value is None else value
+        if label in seen:
+            seen[label] += 1
+            label = f"{label}.{seen[label]}"
+        else:
+            seen[label] = 0
+        labels.append(label)
+    return labels
+
+
+def stream_workbook(source, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Opens an .xlsx workbook for streaming and returns (gudang_names, chunks).
+
+    Rows are read one at a time with openpyxl's read-only mode and chunks
+    yields lists of at most chunk_size (nama, quantities) rows, so memory
+    stays bounded by the chunk size instead of the sheet size. Rows are
+    filtered, normalized and converted exactly like read_workbook().
+    """
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    sheet = workbook.worksheets[0]
+    rows = sheet.iter_rows(values_only=True)
+
+    labels = _header_labels(next(rows, ()))
+    try:
+        _, gudang_cols = _check_header(labels)
+    except ImportFormatError:
+        workbook.close()
+        raise
+    positions = [labels.index(col) for col in gudang_cols]
+
+    def chunks():
+        try:
+            block = []
+            for row in rows:
+                nama = row[0] if row else None
+                if nama is None or (isinstance(nama, float) and np.isnan(nama)):
+                    continue
+                nama = str(nama).strip()
+                if not nama:
+                    continue
+                block.append((nama, [row[i] if i < len(row) else None for i in positions]))
+                if len(block) >= chunk_size:
+                    yield _convert_block(block, gudang_cols)
+                    block = []
+            if block:
+                yield _convert_block(block, gudang_cols)
+        finally:
+            workbook.close()
+
+    return [str(col) for col in gudang_cols], chunks()
+
+
+def _convert_block(block, gudang_cols):
+    names = normalize_names([nama for nama, _ in block]).tolist()
+    quantities = to_quantities(pd.DataFrame([cells for _, cells in block], columns=range(len(gudang_cols)), dtype=object))
+    return list(zip(names, quantities.tolist()))
+
+
+def open_workbook(source, stream=False):
+    """
+    Parses the layout of a workbook and returns (gudang_names, chunks) ready
+    for write_workbook(). With stream=True rows are read lazily by
+    stream_workbook(); otherwise the sheet is read up front by read_workbook()
+    and handed out in blocks of STREAM_CHUNK_SIZE so progress can be tracked.
+    """
+    if stream:
+        return stream_workbook(source)
+    gudang_names, names, quantities = read_workbook(source)
+    rows = list(zip(names, quantities.tolist()))
+    return gudang_names, (rows[start:start + STREAM_CHUNK_SIZE] for start in range(0, len(rows), STREAM_CHUNK_SIZE))
+
+
+def write_workbook(gudang_names, chunks, on_progress=None, started=None):
+    """
+    Writes the chunks of open_workbook() with import_stock_chunks(), so the
+    whole import is one transaction. on_progress(rows_parsed, rows_written)
+    is called after every block is parsed and after it is written; raising
+    from it aborts and rolls back the import.
+
+    Returns the statistics used by import_summary().
+    """
+    started = started or time.perf_counter()
+    rows_parsed = rows_written = 0
+    processed_items = set()
+
+    def tracked():
+        nonlocal rows_parsed, rows_written
+        for rows in chunks:
+            rows_parsed += len(rows)
+            processed_items.update(nama for nama, _ in rows)
+            if on_progress:
+                on_progress(rows_parsed, rows_written)
+            yield rows
+            # Resumed by import_stock_chunks once the block is written
+            rows_written += len(rows)
+            if on_progress:
+                on_progress(rows_parsed, rows_written)
+
+    run_bulk_write(import_stock_chunks, gudang_names, tracked())
+    elapsed = time.perf_counter() - started
+    return {
+        "items": len(processed_items),
+        "rows": rows_written,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows_written / elapsed, 1) if elapsed > 0 else None
+    }
+
+
+def diff_workbook(gudang_names, chunks, dry_run=False, started=None):
+    """
+    Imports the chunks of open_workbook() with import_stock_diff(), writing
+    only the cells that change. With dry_run=True nothing is written.
+
+    Unlike write_workbook() this reads every block into memory first: the
+    diff zeroes cells of items the sheet leaves out, so it needs the whole
+    sheet before anything can be compared.
+
+    Returns write_workbook()-like statistics plus the size of the diff:
+    cells_changed split into inserted (0 -> n), updated (n -> m) and zeroed
+    (n -> 0), new_items, and changes as [nama, gudang, old, new] lists.
+    """
+    started = started or time.perf_counter()
+    rows = [row for block in chunks for row in block]
+    if dry_run:
+        changes, new_items = import_stock_diff(gudang_names, rows, dry_run=True)
+    else:
+        changes, new_items = run_bulk_write(import_stock_diff, gudang_names, rows)
+    elapsed = time.perf_counter() - started
+    return {
+        "items": len({nama for nama, _ in rows}),
+        "rows": len(rows),
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(len(rows) / elapsed, 1) if elapsed > 0 else None,
+        "cells_changed": len(changes),
+        "inserted": sum(1 for *_, old, new in changes if old == 0),
+        "updated": sum(1 for *_, old, new in changes if old != 0 and new != 0),
+        "zeroed": sum(1 for *_, new in changes if new == 0),
+        "new_items": len(new_items),
+        "changes": [list(change) for change in changes],
+    }
+
+
+def _parse_workbook_file(path):
+    # Runs in a worker process: only plain lists cross the process boundary
+    gudang_names, names, quantities = read_workbook(path)
+    return gudang_names, list(zip(names, quantities.tolist()))
+
+
+def _get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # Spawned, not forked: the pool starts inside a running server,
+            # and a fork could copy a lock held by another thread into the child
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+
+def read_workbooks(paths, labels=None):
+    """
+    Parses several workbook files in parallel worker processes.
+
+    Returns a list of (gudang_names, rows) in the order of paths, ready for
+    import_stock_batch(). The pool is started on first use and kept, so a
+    batch costs about as much as its slowest file. A workbook with a bad
+    layout raises ImportFormatError prefixed with its label (the file name).
+    """
+    labels = labels or [os.path.basename(path) for path in paths]
+    if len(paths) == 1:
+        results = [lambda: _parse_workbook_file(paths[0])]
+    else:
+        pool = _get_parse_pool()
+        results = [pool.submit(_parse_workbook_file, path).result for path in paths]
+
+    parsed = []
+    for label, result in zip(labels, results):
+        try:
+            parsed.append(result())
+        except ImportFormatError as e:
+            raise ImportFormatError(f"{label}: {e}") from e
+    return parsed
+
+
+def import_summary(gudang_names, stats):
+    return {
+        "message": f"Successfully processed {stats['items']} unique ceramic items.",
+        "details": f"Stock for warehouses: {', '.join(gudang_names)} has been fully updated."
+    }
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from importer import ImportFormatError, open_workbook, write_workbook, import_summary
+
+# Imports take the database write lock for their whole transaction, so more
+# than one worker would only queue on SQLite instead of in the executor.
+IMPORT_WORKERS = 1
+
+# Finished jobs kept for status queries; the oldest are forgotten first
+JOB_HISTORY = 100
+
+_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class ImportCancelled(Exception):
+    """Raised inside a running import to roll it back after DELETE /api/v1/import-jobs/{id}."""
+
+
+class ImportJob:
+    def __init__(self, path, filename, stream):
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.filename = filename
+        self.stream = stream
+        self.status = "queued"
+        self.rows_parsed = 0
+        self.rows_written = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.cancel_requested = threading.Event()
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_parsed": self.rows_parsed,
+            "rows_written": self.rows_written,
+            "elapsed_seconds": round(self.elapsed(), 3),
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def on_progress(self, rows_parsed, rows_written):
+        self.rows_parsed = rows_parsed
+        self.rows_written = rows_written
+        if self.cancel_requested.is_set():
+            raise ImportCancelled()
+
+
+def save_upload(source, suffix):
+    """Copies an upload stream to a temporary file that outlives the request."""
+    handle, path = tempfile.mkstemp(prefix="stok-import-", suffix=suffix)
+    with os.fdopen(handle, "wb") as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    return path
+
+
+def submit_import(path, filename, stream=True):
+    """Queues the workbook at path for import; the file is deleted when the job ends."""
+    job = ImportJob(path, filename, stream)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        finished = [job_id for job_id, other in _jobs.items() if other.finished_at is not None]
+        for job_id in finished[:max(0, len(finished) - JOB_HISTORY)]:
+            del _jobs[job_id]
+    _executor.submit(_run, job)
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs():
+    with _jobs_lock:
+        return sorted(_jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+
+def cancel_job(job_id):
+    job = get_job(job_id)
+    if job is not None and job.finished_at is None:
+        job.cancel_requested.set()
+    return job
+
+
+def _run(job):
+    job.started_at = time.time()
+    try:
+        if job.cancel_requested.is_set():
+            raise ImportCancelled()
+        job.status = "running"
+        gudang_names, chunks = open_workbook(job.path, stream=job.stream)
+        stats = write_workbook(gudang_names, chunks, on_progress=job.on_progress)
+        job.result = dict(import_summary(gudang_names, stats), **stats)
+        job.status = "done"
+    except ImportCancelled:
+        job.status = "cancelled"
+    except ImportFormatError as e:
+        job.status = "failed"
+        job.error = str(e)
+    except Exception as e:
+        job.status = "failed"
+        job.error = f"Failed to import file: {str(e)}"
+    finally:
+        job.finished_at = time.time()
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
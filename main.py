@@ -1,11 +1,16 @@
+import bisect
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox, filedialog
 import pandas as pd
+import json
 import os
+import queue
 import sqlite3
 import re
+import threading
+import time
 import requests # NEW: Import requests for API calls
 
 # Keep database imports for now, as import_excel still uses them locally
@@ -15,70 +20,171 @@ from database import (
     get_stock_by_ceramic_and_gudang, get_or_create_gudang, get_or_create_ceramic
 )
 
+from classifier import get_category_by_name
+
 # NEW: API Base URL
 API_BASE_URL = "http://127.0.0.1:8000" # Ensure your backend is running on this address
 
-def normalize_ceramic_name(name):
-    name = str(name).strip().upper()
-    # Hapus suffix varian
-    name = re.sub(r'\s*(KW1-B|KW2-B|KW1-N|KW1-G|KW-1|KW-2|KW1|KW2|I|II)$', '', name)
-    # Ganti 'GR' atau 'GRIS' menjadi 'GRISS' jika di akhir nama
-    name = re.sub(r'\s*(GR|GRIS)$', 'GRISS', name)
-    # Hapus spasi berlebih
-    name = re.sub(r'\s+', ' ', name).strip()
-    return name
-
-def get_category_by_name(name):
-    name_upper = str(name).strip().upper()
-    if "PINGUL" in name_upper or "PINGULAN" in name_upper or "GRAMETINDO" in name_upper:
-        return "PINGUL"
-    if "LIST" in name_upper:
-        return "LIST"
-    if name_upper.startswith("AM ") or " AM " in name_upper or "LEMKRA" in name_upper:
-        return "NAT"
-    if any(k in name_upper for k in ["STEP", "STP", "STEPNOSING"]):
-        return "STEPNOSING"
-    if any(k in name_upper for k in [
-        "KRAN", "STOP KRAN", "AUGUSTO", "BRACHIO", "GRAVINO", "VILANOVA",
-        "EXCEL", "SOBAR", "DEVEN", "HALMAR", "EINER", "CLASSIC", "FLEX",
-        "ISCO", "SAVITAR", "APOLLO", "WALLSHOWER", "SHOWER", "HANDSHOWER",
-        "ALPHARD", "HAWAI", "GENTONG", "COUPLING", "UNION", "SELANG", "BCP",
-        "PEMBERSIH", "SARGOT", "AVOR", "SARINGAN", "HANDLE", "BOSSINI",
-        "SAPHIRA", "ENGSEL", "KUNCI", "BOLZANO", "GRENDEL", "LAMPU", "RH",
-        "KAPSTOCK", "TISSUE", "KORDEN", "BAUT", "KAPSTK", "FIONI", "BATHUB",
-        "KAPS", "RAK", "KACA", "PISAU", "GERGAJI", "PENGUIN", "PROFIL", "PELAMPUNG",
-        "WATERHEAT", "WTRHEAT", "WATER HEATER", "WATER HEAT", "PELOR", "GIGI",
-        "TOILET", "COOKER", "KOMPOR", "KITCHEN", "ANGZDOOR", "PKM",
-        "BELLEZA", "COSTO", "DUPON", "FIDEM", "HAND SHOW", "BATH+SHOW", "K DIND",
-        "K DOUBLE", "K SHOW", "K TAMAN", "K WAST", "PLANGSET", "PLST+T", "RING H",
-        "SHOW BIDET", "SHW TNG", "STOP K", "SABUN", "TS CAIR", "WAST +KAB+KC",
-        "HANSA", "MOVE", "OULUSOLID", "SPC", "TASIN", "TOTO", "TRILLIUN", "TRISENSA",
-        "VAPELY", "MAGNET", "SPRINGKNEE", "WASSER", "CABINET",
-        "GERMANY", "IGM", "MASPION", "MERIDIAN", "OULU", "SOLID", "TUTUP", "HAK ANGIN"
-    ]):
-        return "Sanitari"
-    if any(k in name_upper for k in [
-        "ARNA 60/60", "RMN", "CERANOSA", "RUDY", "GRD", "PASADENA", "SANDIMAS",
-        "ALTHEA", "HELA", "IMPERIAL", "MAXNUM", "MELIUZ", "PAVIA", "REXTON",
-        "A&F", "CERA TILES", "CYAN", "GOLFGRES", "SMART TILES", "AMADEO", "COVE",
-        "GRANIT88", "GROSETO", "QIAOHUI", "ZED", "GRANITO", "NIRO", "DECOGRESS",
-        "INDECOR", "INDOGRES", "GRANIT", "CAVALLO", "CIMETRIC", "PEGASUS",
-        "WHTHORSE", "D-EURO", "TOPFRES", "IKAD", "SUNPWR", "CAVALI", "CITIGRES",
-        "ROTA", "SCAFATI", "PLATINUM", "CENTRO",
-        "A&Y", "DECOGRES 60X60", "GOLGRES", "PORTINO", "SPEEDO", "TOPGRES", "TOSCANA",
-        "DECOGRES 60/60", "WHTHRSE"
-    ]):
-        return "Granit"
-    if any(k in name_upper for k in [
-        "ARWANA", "UNO", "ALLEGRA", "ATENA", "BATIRUS", "CAKRA", "COLOSSAL",
-        "CONCORD", "DIVA", "ENIGMA", "GRAND", "HABITAT", "HECTOR", "IKAD",
-        "INDOTILE", "KIA", "LAGUNA", "LUNA", "MULIA", "MARINO", "MUSTIKA",
-        "PASCAL", "PASOLA", "PICASSO", "RAMIRO", "REDHORSE", "REDLINE",
-        "SANTALIA", "TERRA", "UNICERA", "VALENCIA", "ZEUS",
-        "ARW", "GEMILANG", "PCSO"
-    ]):
-        return "Keramik"
-    return "Lainnya"
+# Jeda polling status job impor (ms)
+IMPORT_POLL_MS = 500
+
+# Jeda setelah ketikan terakhir sebelum pencarian dijalankan (ms)
+SEARCH_DEBOUNCE_MS = 150
+
+# Batas waktu request ke backend: (connect, read) dalam detik
+REQUEST_TIMEOUT = (5, 60)
+
+# Interval refresh otomatis data stok (ms)
+AUTO_REFRESH_MS = 30000
+
+# Seberapa sering hasil dari worker jaringan diambil oleh thread Tk (ms)
+RESULT_POLL_MS = 50
+
+# Jeda sebelum menyambung ulang ke stream update langsung (ms)
+EVENTS_RETRY_MS = 5000
+
+# Batas waktu baca stream update langsung (detik); server mengirim keep-alive tiap 15 detik
+EVENTS_READ_TIMEOUT = 60
+
+class ApiWorker:
+    """
+    Runs backend calls on one background thread so the Tk main loop never waits on the network.
+
+    Calls share one requests.Session, so the connection to the backend is
+    kept alive between requests and responses may be gzip-compressed. A
+    task is a function taking the session; it must not touch widgets. Its
+    result (or exception) is handed to on_done (or on_error) on the Tk
+    thread, picked up by polling with after() because Tk is not thread-safe.
+    """
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.session = requests.Session()
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        threading.Thread(target=self._run, name="api-worker", daemon=True).start()
+        self.widget.after(RESULT_POLL_MS, self._deliver)
+
+    def submit(self, task, on_done, on_error):
+        self.tasks.put((task, on_done, on_error))
+
+    def post(self, callback, value):
+        # Hands value to callback on the Tk thread; safe from any thread
+        self.results.put((callback, value))
+
+    def _run(self):
+        while True:
+            task, on_done, on_error = self.tasks.get()
+            try:
+                self.results.put((on_done, task(self.session)))
+            except Exception as e:
+                self.results.put((on_error, e))
+
+    def _deliver(self):
+        try:
+            while True:
+                try:
+                    callback, value = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                callback(value)
+        finally:
+            self.widget.after(RESULT_POLL_MS, self._deliver)
+
+class StockEventListener:
+    """
+    Follows the backend's live stock stream (/api/v1/stock/events) on a background thread.
+
+    Every Server-Sent Event is handed to on_event((event, data)) on the Tk
+    thread through the ApiWorker. The stream is resumed from get_version(),
+    the data version the app holds, after a dropped connection. on_state is
+    told "connected", "disconnected" or "unsupported" (an older backend
+    without the stream, the listener then stops).
+    """
+
+    def __init__(self, api, get_version, on_event, on_state):
+        self.api = api
+        self.get_version = get_version
+        self.on_event = on_event
+        self.on_state = on_state
+        threading.Thread(target=self._run, name="stock-events", daemon=True).start()
+
+    def _run(self):
+        while True:
+            since = self.get_version()
+            try:
+                with requests.get(
+                    f"{API_BASE_URL}/api/v1/stock/events", params={"since": since} if since is not None else {},
+                    stream=True, timeout=(REQUEST_TIMEOUT[0], EVENTS_READ_TIMEOUT)
+                ) as response:
+                    if response.status_code == 404:
+                        self.api.post(self.on_state, "unsupported")
+                        return
+                    response.raise_for_status()
+                    self.api.post(self.on_state, "connected")
+                    for event in self._read_events(response):
+                        self.api.post(self.on_event, event)
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+            self.api.post(self.on_state, "disconnected")
+            time.sleep(EVENTS_RETRY_MS / 1000)
+
+    @staticmethod
+    def _read_events(response):
+        # Minimal text/event-stream parser: yields (event, parsed JSON data)
+        event, data = "message", []
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                if data:
+                    yield event, json.loads("\n".join(data))
+                event, data = "message", []
+            elif line.startswith(":"):
+                continue # Keep-alive
+            else:
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "event":
+                    event = value
+                elif field == "data":
+                    data.append(value)
+
+class SearchIndex:
+    """
+    Substring search over the item names of one tab, built once per data refresh.
+
+    Names are lowercased once and every trigram of a name points to the
+    positions of the names containing it, so a search only verifies the
+    names sharing the rarest trigram of the term. A term that extends the
+    previous one (the usual case while typing) only rechecks the previous
+    matches. Results are positions in display order.
+    """
+
+    def __init__(self, items):
+        self.iids = [str(item['id']) for item in items]
+        self.names = [item['nama'].lower() for item in items]
+        self.trigrams = None # Built by the first search that needs it
+        self.last_term = ""
+        self.last_matches = range(len(self.names))
+
+    def search(self, term):
+        if not term:
+            matches = range(len(self.names))
+        else:
+            if self.last_term and term.startswith(self.last_term):
+                candidates = self.last_matches
+            elif len(term) >= 3:
+                if self.trigrams is None:
+                    self.trigrams = {}
+                    for position, name in enumerate(self.names):
+                        for gram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                            self.trigrams.setdefault(gram, []).append(position)
+                grams = {term[i:i + 3] for i in range(len(term) - 2)}
+                candidates = min((self.trigrams.get(gram, ()) for gram in grams), key=len)
+            else:
+                candidates = range(len(self.names))
+            matches = [position for position in candidates if term in self.names[position]]
+        self.last_term, self.last_matches = term, matches
+        return [self.iids[position] for position in matches]
 
 class App(ctk.CTk):
     def __init__(self):
@@ -105,13 +211,20 @@ class App(ctk.CTk):
         self.main_frame.grid_rowconfigure(1, weight=1)
         self.main_frame.grid_columnconfigure(0, weight=1)
 
-        self.tab_view = ctk.CTkTabview(self.main_frame)
+        # Tabs are filled lazily: only the visible one on refresh, the others when selected
+        self.tab_view = ctk.CTkTabview(self.main_frame, command=self._on_tab_changed)
         self.tab_view.grid(row=1, column=0, padx=20, pady=(0,10), sticky="nsew")
 
         self.categories = ["Semua", "Granit", "Keramik", "Sanitari", "LIST", "PINGUL", "NAT", "STEPNOSING", "Lainnya"]
 
         self.treeviews = {}
         self.tab_frames = {}
+        self.tree_columns = {} # Gudang columns each treeview currently has
+        self.shown_rows = {} # Rows each treeview holds, visible or detached: iid -> values
+        self.stale_tabs = set() # Tabs whose rows no longer match the data
+        self.search_indexes = {} # SearchIndex per tab, built on first search after a refresh
+        self.tab_search_terms = {} # Search term each tab currently shows the results of
+        self._search_job = None # Pending debounced search, see _on_search()
 
         for category in self.categories:
             self.tab_view.add(category)
@@ -120,6 +233,7 @@ class App(ctk.CTk):
             tab_frame.grid_rowconfigure(0, weight=1)
             tab_frame.grid_columnconfigure(0, weight=1)
             self.tab_frames[category] = tab_frame
+            self._create_treeview(tab_frame, category)
 
         self.bottom_frame = ctk.CTkFrame(self.main_frame)
         self.bottom_frame.grid(row=2, column=0, padx=20, pady=10, sticky="ew")
@@ -134,83 +248,328 @@ class App(ctk.CTk):
         self.search_entry = ctk.CTkEntry(self.bottom_frame, placeholder_text="Cari di tab saat ini...")
         self.search_entry.grid(row=0, column=3, padx=(0, 20), sticky="ew")
         self.search_entry.bind("<KeyRelease>", self._on_search)
+
+        # Runs while any backend call is in flight, hidden otherwise
+        self.progress_bar = ctk.CTkProgressBar(self.bottom_frame, mode="indeterminate")
+        self._busy = 0
+
+        self.api = ApiWorker(self)
+        self._stock_fetch_pending = False
+        self._stock_refetch = None # Refresh requested while one was under way
         
         self.all_ceramics_data = [] # Will store raw data (list of dictionaries) from API
         self.categorized_data = {cat: [] for cat in self.categories}
         self.gudangs_data = [] # Will store (gname, gname) tuples derived from API response
+        self.stock_etag = None # ETag of the data currently shown, sent back as If-None-Match
+        self.data_version = None # Server data version of the data currently shown
+        self.items_by_id = {} # Same item dictionaries as all_ceramics_data, by id, for applying changes
+        self.live_updates = False # Connected to the server's live stream, see StockEventListener
         
         self.display_ceramics_stock()
+        self.after(AUTO_REFRESH_MS, self._auto_refresh)
+        self.stock_events = StockEventListener(self.api, lambda: self.data_version, self._on_stock_event, self._on_live_state)
+
+    def _begin_busy(self):
+        self._busy += 1
+        if self._busy == 1:
+            self.progress_bar.grid(row=0, column=1, padx=10, sticky="ew")
+            self.progress_bar.start()
+
+    def _end_busy(self):
+        self._busy -= 1
+        if self._busy == 0:
+            self.progress_bar.stop()
+            self.progress_bar.grid_remove()
+
+    def _run_in_background(self, task, on_done, on_error):
+        # Submits task to the network worker with the progress bar running until it returns
+        self._begin_busy()
+
+        def finished(callback):
+            def run(value):
+                self._end_busy()
+                callback(value)
+            return run
+
+        self.api.submit(task, finished(on_done), finished(on_error))
+
+    def display_ceramics_stock(self, auto=False):
+        # auto=True is the periodic refresh: it keeps the search term and
+        # does not interrupt the user with error dialogs
+        if self._stock_fetch_pending:
+            # The refresh under way may have been sent before the data changed
+            if not auto or not self._stock_refetch:
+                self._stock_refetch = "auto" if auto else "manual"
+            return
+        self._stock_fetch_pending = True
 
-    def display_ceramics_stock(self):
+        data_version, stock_etag = self.data_version, self.stock_etag
+        self._run_in_background(
+            lambda session: self._fetch_stock(session, data_version, stock_etag),
+            lambda result: self._on_stock_fetched(result, auto),
+            lambda error: self._on_stock_error(error, auto)
+        )
+
+    def _auto_refresh(self):
+        # Not needed while the server pushes every change
+        if not self.live_updates:
+            self.display_ceramics_stock(auto=True)
+        self.after(AUTO_REFRESH_MS, self._auto_refresh)
+
+    def _on_live_state(self, state):
+        was_live, self.live_updates = self.live_updates, state == "connected"
+        if was_live and not self.live_updates:
+            # Changes may be missed until the stream is back
+            self.display_ceramics_stock(auto=True)
+
+    def _on_stock_event(self, event):
+        name, data = event
+        if name == "reload":
+            self.display_ceramics_stock(auto=True)
+        elif name == "changes":
+            if self._stock_fetch_pending or self.data_version is None or data["since"] > self.data_version:
+                # A refresh under way or a gap: let the regular refresh catch up
+                self.display_ceramics_stock(auto=True)
+                return
+            if data["version"] <= self.data_version:
+                return # Already applied
+            try:
+                self._apply_stock_changes(data)
+            except Exception:
+                self.display_ceramics_stock(auto=True)
+                return
+            self._show_current_tab(clear_search=False)
+
+    @staticmethod
+    def _fetch_stock(session, data_version, stock_etag):
+        # Runs on the network worker and must not touch the app. Returns None
+        # when nothing changed on the server, ("changes", feed) when the change
+        # feed can bring our copy up to date and ("full", body, etag, version)
+        # otherwise.
+        if data_version is not None:
+            # Only download what changed since the data we already hold
+            response = session.get(f"{API_BASE_URL}/api/v1/stock/changes", params={"since": data_version}, timeout=REQUEST_TIMEOUT)
+            # 404/410: the server cannot serve the delta and a full reload is needed
+            if response.status_code not in (404, 410):
+                response.raise_for_status()
+                changes = response.json()
+                if changes["version"] == data_version:
+                    return None
+                return ("changes", changes)
+
+        headers = {"If-None-Match": stock_etag} if stock_etag else {}
+        # Columnar format: warehouse names are sent once instead of once per item
+        response = session.get(f"{API_BASE_URL}/api/v1/stock", params={"format": "compact"}, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304:
+            return None # Our copy is current
+        response.raise_for_status() # Raises an HTTPError for bad responses (4xx or 5xx) 
+        return ("full", response.json(), response.headers.get("ETag"), response.headers.get("X-Data-Version"))
+
+    def _finish_stock_fetch(self):
+        self._stock_fetch_pending = False
+        if self._stock_refetch:
+            auto, self._stock_refetch = self._stock_refetch == "auto", None
+            self.display_ceramics_stock(auto=auto)
+
+    def _on_stock_fetched(self, result, auto):
+        if result is None:
+            self._finish_stock_fetch()
+            return # Nothing changed on the server since the last refresh
         try:
-            response = requests.get(f"{API_BASE_URL}/api/v1/stock")
-            response.raise_for_status() # Raises an HTTPError for bad responses (4xx or 5xx) 
-            api_data = response.json()
-            
-            self.all_ceramics_data = [] # Reset to store API data
-            
-            # Extract gudang data from the first item, assuming all items have the same gudangs
-            if api_data:
-                first_item_gudangs = api_data[0]['stock_per_gudang']
-                self.gudangs_data = [(gname, gname) for gname in first_item_gudangs.keys()]
+            if result[0] == "changes":
+                self._apply_stock_changes(result[1])
+                self._show_current_tab(clear_search=not auto)
             else:
-                self.gudangs_data = []
-
-            # Reset categorized data for new API response
-            self.categorized_data = {cat: [] for cat in self.categories}
-
-            for item in api_data:
-                # Use existing categorization logic on item['nama']
-                category = get_category_by_name(item['nama'])
-                
-                # If category is not in our tabs, default to Lainnya
-                if category not in self.categorized_data:
-                    category = "Lainnya"
-
-                self.categorized_data[category].append(item) # Append full item dictionary
-                self.categorized_data["Semua"].append(item)
-                self.all_ceramics_data.append(item) # Keep raw data (dictionaries) for search
-            
-        except requests.exceptions.RequestException as e:
-            messagebox.showerror("Network Error", f"Failed to connect to backend API: {e}\nPlease ensure the backend server is running at {API_BASE_URL}")
-            self.all_ceramics_data = [] # Clear data on error
-            self.gudangs_data = []
-            self.categorized_data = {cat: [] for cat in self.categories}
+                self._load_full_stock(*result[1:])
+                self._show_stock(clear_search=not auto)
         except Exception as e:
-            messagebox.showerror("Error", f"An unexpected error occurred: {e}")
-            self.all_ceramics_data = [] # Clear data on error
-            self.gudangs_data = []
-            self.categorized_data = {cat: [] for cat in self.categories}
-
-        for category in self.categories:
-            self._populate_treeview(self.tab_frames[category], category, self.categorized_data[category])
-        
-        # Clear search box and trigger a search to show all items in the current tab
-        self.search_entry.delete(0, 'end')
-        self._on_search(None) 
-
-    def _populate_treeview(self, parent_frame, category_name, ceramics_data):
-        for widget in parent_frame.winfo_children():
-            widget.destroy()
-
-        base_columns = ('id', 'nama', 'total') # Added 'id' as it's useful
-        base_headings = ('ID', 'Nama Keramik', 'Total Stok') # Added 'ID'
-        
-        # Gudangs data is now derived from API response and is a list of (name, name) tuples
-        gudang_columns = tuple(f'g_{gname}' for gid, gname in self.gudangs_data) # Use gname as key
-        gudang_headings = tuple(gname for gid, gname in self.gudangs_data)
+            self._on_stock_error(e, auto)
+            return
+        self._finish_stock_fetch()
+
+    def _on_stock_error(self, error, auto):
+        if auto:
+            self._finish_stock_fetch()
+            return # Keep showing the data we have, the next refresh tries again
+        if isinstance(error, requests.exceptions.RequestException):
+            messagebox.showerror("Network Error", f"Failed to connect to backend API: {error}\nPlease ensure the backend server is running at {API_BASE_URL}")
+        else:
+            messagebox.showerror("Error", f"An unexpected error occurred: {error}")
+        self._clear_stock_data() # Clear data on error
+        self._show_stock(clear_search=True)
+        self._finish_stock_fetch()
+
+    def _show_stock(self, clear_search):
+        # Every tab has to catch up with the new data, but only when it is shown
+        self.stale_tabs = set(self.categories)
+        self._show_current_tab(clear_search)
+
+    def _show_current_tab(self, clear_search):
+        if clear_search:
+            # Clear search box and trigger a search to show all items in the current tab
+            self.search_entry.delete(0, 'end')
+        self._on_search(None)
+
+    def _load_full_stock(self, api_data, etag, version):
+        if isinstance(api_data, dict):
+            gudang_names = api_data["gudangs"]
+            api_data = self._expand_compact_stock(api_data)
+        else:
+            # An older backend that ignores format=compact sent the item list:
+            # extract gudang data from the first item, assuming all items have the same gudangs
+            gudang_names = list(api_data[0]['stock_per_gudang'].keys()) if api_data else []
+        self.gudangs_data = [(gname, gname) for gname in gudang_names]
+        self.stock_etag = etag
+        self.data_version = int(version) if version is not None else None
+
+        self.items_by_id = {item['id']: item for item in api_data}
+        self._categorize(api_data)
+
+    @staticmethod
+    def _expand_compact_stock(compact):
+        # Back to the item dictionaries of the default format used everywhere in the UI
+        gudang_names = compact["gudangs"]
+        return [
+            {
+                "id": ceramic_id,
+                "nama": nama,
+                "total_stock": total,
+                "category": category,
+                "stock_per_gudang": dict(zip(gudang_names, quantities)),
+            }
+            for ceramic_id, nama, category, total, quantities in zip(
+                compact["ids"], compact["names"], compact["categories"], compact["totals"], compact["quantities"]
+            )
+        ]
+
+    def _apply_stock_changes(self, changes):
+        # Patches items_by_id, categorized_data and the tab rows with a
+        # response of the server's change feed. Only the items it names are
+        # touched: they are moved to their sorted place with bisect and only
+        # the rows of their tabs are updated.
+        gudang_names = [gname for _, gname in self.gudangs_data]
+        for gname in changes["gudangs"]["deleted"]:
+            if gname in gudang_names:
+                gudang_names.remove(gname)
+            for item in self.items_by_id.values():
+                item['stock_per_gudang'].pop(gname, None)
+        for gudang in changes["gudangs"]["upserted"]:
+            if gudang["nama"] not in gudang_names:
+                gudang_names.append(gudang["nama"])
+                for item in self.items_by_id.values():
+                    item['stock_per_gudang'][gudang["nama"]] = 0
+        columns_changed = [gname for _, gname in self.gudangs_data] != gudang_names
+        self.gudangs_data = [(gname, gname) for gname in gudang_names]
+
+        left = {} # Tab -> ids of the items that left it
+        placed = [] # New, renamed or recategorized items
+
+        def unplace(item):
+            for tab in self._unplace_item(item):
+                left.setdefault(tab, set()).add(item['id'])
+
+        for ceramic_id in changes["items"]["deleted"]:
+            item = self.items_by_id.pop(ceramic_id, None)
+            if item is not None:
+                unplace(item)
+        for upserted in changes["items"]["upserted"]:
+            item = self.items_by_id.get(upserted["id"])
+            if item is None:
+                item = {"id": upserted["id"], "total_stock": 0, "stock_per_gudang": {gname: 0 for gname in gudang_names}}
+                self.items_by_id[upserted["id"]] = item
+            elif (item["nama"], item.get("category")) == (upserted["nama"], upserted["category"]):
+                continue
+            else:
+                unplace(item)
+            item["nama"] = upserted["nama"]
+            item["category"] = upserted["category"]
+            placed.append(item)
+        for item in placed:
+            self._place_item(item)
+
+        touched = set()
+        for cell in changes["cells"]["upserted"]:
+            self.items_by_id[cell["id"]]['stock_per_gudang'][cell["gudang"]] = cell["quantity"]
+            touched.add(cell["id"])
+        for cell in changes["cells"]["deleted"]:
+            self.items_by_id[cell["id"]]['stock_per_gudang'][cell["gudang"]] = 0
+            touched.add(cell["id"])
+        if changes["gudangs"]["deleted"]:
+            touched = self.items_by_id.keys()
+        for ceramic_id in touched:
+            item = self.items_by_id[ceramic_id]
+            item['total_stock'] = sum(item['stock_per_gudang'].values())
+
+        self.data_version = changes["version"]
+        self.stock_etag = None # Our copy no longer matches any full response the server sent
+
+        # Tabs whose items came or went search and order their rows again
+        for item in placed:
+            left.setdefault(self._tab_of(item), set())
+            left.setdefault("Semua", set())
+        for tab in left:
+            self.search_indexes.pop(tab, None)
+            self.tab_search_terms.pop(tab, None)
+
+        if columns_changed:
+            self.stale_tabs = set(self.categories)
+            return
+        updated = {} # Tab -> items whose row is new or may show other values
+        for item in placed + [self.items_by_id[ceramic_id] for ceramic_id in touched]:
+            for tab in (self._tab_of(item), "Semua"):
+                updated.setdefault(tab, {})[item['id']] = item
+        for tab in set(left) | set(updated):
+            if tab not in self.stale_tabs:
+                self._patch_treeview(tab, updated.get(tab, {}), left.get(tab, set()))
+
+    def _tab_of(self, item):
+        # The API sends the category stored for each item; only classify
+        # locally when talking to an older backend that does not send it
+        category = item.get('category') or get_category_by_name(item['nama'])
+        # If category is not in our tabs, default to Lainnya
+        return category if category in self.categorized_data else "Lainnya"
+
+    def _item_lists(self, item):
+        # Every list holding item, all in the API order: by name
+        return (self.categorized_data[self._tab_of(item)], self.categorized_data["Semua"], self.all_ceramics_data)
+
+    def _place_item(self, item):
+        for items in self._item_lists(item):
+            bisect.insort(items, item, key=lambda other: other['nama'])
+
+    def _unplace_item(self, item):
+        # Removes item from its lists and returns the tabs it left
+        for items in self._item_lists(item):
+            index = bisect.bisect_left(items, item['nama'], key=lambda other: other['nama'])
+            if items[index] is not item:
+                raise ValueError(f"Item {item['id']} is not in its sorted place")
+            del items[index]
+        return (self._tab_of(item), "Semua")
+
+    def _categorize(self, items):
+        self.search_indexes = {}
+        self.all_ceramics_data = [] # Reset to store API data
+        # Reset categorized data for new API response
+        self.categorized_data = {cat: [] for cat in self.categories}
 
-        columns = base_columns + gudang_columns
-        headings = base_headings + gudang_headings
+        for item in items:
+            self.categorized_data[self._tab_of(item)].append(item) # Append full item dictionary
+            self.categorized_data["Semua"].append(item)
+            self.all_ceramics_data.append(item) # Keep raw data (dictionaries) for search
+
+    def _clear_stock_data(self):
+        self.search_indexes = {}
+        self.all_ceramics_data = []
+        self.items_by_id = {}
+        self.stock_etag = None
+        self.data_version = None
+        self.gudangs_data = []
+        self.categorized_data = {cat: [] for cat in self.categories}
 
-        tree = ttk.Treeview(parent_frame, columns=columns, show='headings', selectmode='browse')
-        
-        for col, head in zip(columns, headings):
-            tree.heading(col, text=head)
-            tree.column(col, anchor='center', width=120)
-        
-        tree.column('id', anchor='center', width=50) # Set column width for ID
-        tree.column('nama', anchor='w', width=250)
+    def _create_treeview(self, parent_frame, category_name):
+        # The treeview and its scrollbars live as long as the app; refreshes
+        # only change their columns and rows, see _populate_treeview()
+        tree = ttk.Treeview(parent_frame, columns=(), show='headings', selectmode='browse')
 
         vsb = ttk.Scrollbar(parent_frame, orient='vertical', command=tree.yview)
         hsb = ttk.Scrollbar(parent_frame, orient='horizontal', command=tree.xview)
@@ -221,43 +580,148 @@ class App(ctk.CTk):
         hsb.grid(row=1, column=0, sticky='ew')
 
         self.treeviews[category_name] = tree
-        self._update_treeview_data(tree, ceramics_data)
+        self.tree_columns[category_name] = None
+        self.shown_rows[category_name] = {}
 
-    def _update_treeview_data(self, tree, ceramics_data):
-        # Clear existing data
-        for i in tree.get_children():
-            tree.delete(i)
-        
-        # Insert new data
-        # ceramics_data is now a list of dictionaries (API response format)
-        for item in ceramics_data:
-            values = [item['id'], item['nama'], item['total_stock']]
-            for gid_placeholder, gname in self.gudangs_data: # Iterate through (gname, gname) tuples
-                values.append(item['stock_per_gudang'].get(gname, 0)) # Get quantity by warehouse name
-            
-            tree.insert('', 'end', iid=item['id'], values=values)
+    def _populate_treeview(self, category_name, ceramics_data):
+        tree = self.treeviews[category_name]
+
+        # Gudangs data is now derived from API response and is a list of (name, name) tuples
+        gudang_names = tuple(gname for gid, gname in self.gudangs_data)
+        if self.tree_columns[category_name] != gudang_names:
+            base_columns = ('id', 'nama', 'total') # Added 'id' as it's useful
+            base_headings = ('ID', 'Nama Keramik', 'Total Stok') # Added 'ID'
+
+            gudang_columns = tuple(f'g_{gname}' for gname in gudang_names) # Use gname as key
+            columns = base_columns + gudang_columns
+            headings = base_headings + gudang_names
+
+            tree.configure(columns=columns, displaycolumns='#all')
+            for col, head in zip(columns, headings):
+                tree.heading(col, text=head)
+                tree.column(col, anchor='center', width=120)
+
+            tree.column('id', anchor='center', width=50) # Set column width for ID
+            tree.column('nama', anchor='w', width=250)
+
+            self.tree_columns[category_name] = gudang_names
+            # The values of every row shown are laid out for the old columns
+            self.shown_rows[category_name] = dict.fromkeys(self.shown_rows[category_name])
+
+        self._update_treeview_data(category_name, ceramics_data)
+        self.stale_tabs.discard(category_name)
+
+    def _update_treeview_data(self, category_name, ceramics_data):
+        # Brings the rows of the tab in line with ceramics_data (a list of item
+        # dictionaries) by touching only what differs: rows are matched by iid
+        # (the item id), so unchanged rows cost nothing. _show_rows() then
+        # decides which rows are visible and in which order.
+        tree = self.treeviews[category_name]
+        shown = self.shown_rows[category_name]
+
+        wanted = {str(item['id']): self._row_values(item) for item in ceramics_data}
+
+        gone = [iid for iid in shown if iid not in wanted]
+        if gone:
+            tree.delete(*gone)
+
+        # On a tab without visible rows (e.g. the first fill) new rows can
+        # stay attached: appended in data order they are already in place
+        detach_added = bool(tree.get_children())
+        added = []
+        for iid, values in wanted.items():
+            if iid not in shown:
+                tree.insert('', 'end', iid=iid, values=values)
+                added.append(iid)
+            elif shown[iid] != values:
+                tree.item(iid, values=values)
+        if added and detach_added:
+            tree.detach(*added)
+
+        self.shown_rows[category_name] = wanted
+
+    def _row_values(self, item):
+        values = [item['id'], item['nama'], item['total_stock']]
+        for gid_placeholder, gname in self.gudangs_data: # Iterate through (gname, gname) tuples
+            values.append(item['stock_per_gudang'].get(gname, 0)) # Get quantity by warehouse name
+        return tuple(values)
+
+    def _patch_treeview(self, category_name, items, left):
+        # Applies a change feed to a tab that is otherwise current: rows of
+        # the ids in left are deleted, rows of items (id -> item) are added or
+        # updated. New rows stay detached until _show_rows() places them.
+        tree = self.treeviews[category_name]
+        shown = self.shown_rows[category_name]
+
+        gone = [str(ceramic_id) for ceramic_id in left if ceramic_id not in items and str(ceramic_id) in shown]
+        if gone:
+            tree.delete(*gone)
+            for iid in gone:
+                del shown[iid]
+
+        for ceramic_id, item in items.items():
+            iid = str(ceramic_id)
+            values = self._row_values(item)
+            if iid not in shown:
+                tree.insert('', 'end', iid=iid, values=values)
+                tree.detach(iid)
+            elif shown[iid] != values:
+                tree.item(iid, values=values)
+            shown[iid] = values
+
+    def _show_rows(self, category_name, iids):
+        # Makes exactly iids visible, in that order, by detaching and
+        # reattaching existing rows instead of deleting and reinserting them
+        tree = self.treeviews[category_name]
+        attached = tree.get_children()
+        if attached == tuple(iids):
+            return
+
+        keep = set(iids)
+        hidden = [iid for iid in attached if iid not in keep]
+        if hidden:
+            tree.detach(*hidden)
+
+        # Rows still attached keep their relative order, so reattaching each
+        # missing row at its final index leaves the rows before it in place
+        attached = set(attached).difference(hidden)
+        for index, iid in enumerate(iids):
+            if iid not in attached:
+                tree.move(iid, '', index)
+
+        # Only a renamed item can move relative to the others
+        if tree.get_children() != tuple(iids):
+            for index, iid in enumerate(iids):
+                tree.move(iid, '', index)
+
+    def _refresh_tab(self, category_name):
+        if category_name in self.stale_tabs:
+            self._populate_treeview(category_name, self.categorized_data[category_name])
 
-    def _on_search(self, event):
         search_term = self.search_entry.get().lower()
+        if category_name not in self.search_indexes:
+            self.search_indexes[category_name] = SearchIndex(self.categorized_data[category_name])
+        self._show_rows(category_name, self.search_indexes[category_name].search(search_term))
+        self.tab_search_terms[category_name] = search_term
+
+    def _on_tab_changed(self):
         current_tab = self.tab_view.get()
-        
-        if not current_tab:
-             return
+        if current_tab in self.stale_tabs or self.tab_search_terms.get(current_tab) != self.search_entry.get().lower():
+            self._refresh_tab(current_tab)
 
-        # self.categorized_data now stores dictionaries
-        original_data = self.categorized_data[current_tab]
+    def _on_search(self, event):
+        # Typing only (re)starts a short timer, the search runs once typing pauses
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+            self._search_job = None
+        if event is not None:
+            self._search_job = self.after(SEARCH_DEBOUNCE_MS, self._on_search, None)
+            return
 
-        if not search_term:
-            filtered_data = original_data
-        else:
-            filtered_data = [
-                item for item in original_data 
-                if search_term in item['nama'].lower() # Access 'nama' key
-            ]
-        
-        tree_to_update = self.treeviews.get(current_tab)
-        if tree_to_update:
-            self._update_treeview_data(tree_to_update, filtered_data)
+        current_tab = self.tab_view.get()
+        if not current_tab:
+             return
+        self._refresh_tab(current_tab)
 
     def import_excel(self):
         file_path = filedialog.askopenfilename(
@@ -267,26 +731,56 @@ class App(ctk.CTk):
         if not file_path:
             return
 
-        try:
+        def upload(session):
             with open(file_path, "rb") as f:
-                files = {"file": (os.path.basename(file_path), f.read(), "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
-                
-                response = requests.post(f"{API_BASE_URL}/api/v1/import-excel", files=files)
+                files = {"file": (os.path.basename(file_path), f, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")}
+                # Impor berjalan sebagai job di backend; progres dipantau lewat polling
+                response = session.post(f"{API_BASE_URL}/api/v1/import-jobs", files=files, timeout=REQUEST_TIMEOUT)
                 response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-                
-                api_response = response.json()
-                
-                if response.status_code == 200:
-                    messagebox.showinfo("Impor Selesai", api_response.get("message", "Impor berhasil.") + "\n" + api_response.get("details", ""))
-                    self.display_ceramics_stock() # Refresh data after successful import
-                else:
-                    messagebox.showerror("Error Impor", api_response.get("detail", "Terjadi kesalahan yang tidak diketahui saat mengimpor."))
-
-        except requests.exceptions.RequestException as e:
-            messagebox.showerror("Network Error", f"Gagal terhubung ke backend API untuk impor Excel: {e}\nPastikan server backend berjalan pada {API_BASE_URL}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Terjadi kesalahan saat memproses file Excel: {e}")
+                return response.json()
+
+        # The progress bar keeps running until the job has finished
+        self._begin_busy()
+        self.import_excel_button.configure(state="disabled", text="Impor...")
+        self.api.submit(upload, self._on_import_submitted, self._on_import_error)
+
+    def _on_import_submitted(self, job):
+        self.after(IMPORT_POLL_MS, self._poll_import_job, job["id"])
+
+    def _poll_import_job(self, job_id):
+        def check(session):
+            response = session.get(f"{API_BASE_URL}/api/v1/import-jobs/{job_id}", timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+
+        self.api.submit(check, self._on_import_status, lambda error: self._on_import_error(error, polling=True))
+
+    def _on_import_error(self, error, polling=False):
+        self._end_busy()
+        self.import_excel_button.configure(state="normal", text="Impor Excel")
+        if polling and isinstance(error, requests.exceptions.RequestException):
+            messagebox.showerror("Network Error", f"Gagal memantau status impor Excel: {error}\nPastikan server backend berjalan pada {API_BASE_URL}")
+        elif isinstance(error, requests.exceptions.RequestException):
+            messagebox.showerror("Network Error", f"Gagal terhubung ke backend API untuk impor Excel: {error}\nPastikan server backend berjalan pada {API_BASE_URL}")
+        else:
+            messagebox.showerror("Error", f"Terjadi kesalahan saat memproses file Excel: {error}")
+
+    def _on_import_status(self, job):
+        if job["status"] in ("queued", "running"):
+            self.import_excel_button.configure(text=f"Impor... {job['rows_written']} baris")
+            self.after(IMPORT_POLL_MS, self._poll_import_job, job["id"])
+            return
 
+        self._end_busy()
+        self.import_excel_button.configure(state="normal", text="Impor Excel")
+        if job["status"] == "done":
+            result = job["result"]
+            messagebox.showinfo("Impor Selesai", result.get("message", "Impor berhasil.") + "\n" + result.get("details", ""))
+            self.display_ceramics_stock() # Refresh data after successful import
+        elif job["status"] == "cancelled":
+            messagebox.showwarning("Impor Dibatalkan", "Impor Excel dibatalkan, data stok tidak berubah.")
+        else:
+            messagebox.showerror("Error Impor", job.get("error") or "Terjadi kesalahan yang tidak diketahui saat mengimpor.")
 
 def main():
     # init_db() # REMOVED: Desktop app no longer initializes DB
@@ -0,0 +1,166 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+import database
+
+# Upper bounds (seconds) of the request latency and SQL time histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the queries-per-request histogram
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+# Requests slower than this many seconds are logged with their queries;
+# unset (the default) disables the slow-request log
+SLOW_REQUEST_SECONDS = float(os.environ["SLOW_REQUEST_SECONDS"]) if os.environ.get("SLOW_REQUEST_SECONDS") else None
+
+# Queries listed per slow request; the rest are only counted
+SLOW_REQUEST_MAX_QUERIES = 50
+
+slow_log = logging.getLogger("stok.slow_requests")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class RequestStats:
+    """SQL statements run on behalf of one HTTP request."""
+
+    def __init__(self, keep_queries):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = [] if keep_queries else None
+
+    def record(self, sql, seconds):
+        self.queries += 1
+        self.sql_seconds += seconds
+        if self.statements is not None and len(self.statements) < SLOW_REQUEST_MAX_QUERIES:
+            self.statements.append((" ".join(sql.split()), seconds))
+
+
+# Stats of the request being handled; endpoints run in the threadpool with a
+# copy of the request's context, so their queries land in the same object
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+_lock = threading.Lock()
+_request_latency = {} # (method, route) -> Histogram
+_request_queries = {} # (method, route) -> Histogram
+_request_sql_time = {} # (method, route) -> Histogram
+_responses = {} # (method, route, status) -> count
+_queries_total = 0
+_sql_seconds_total = 0.0
+
+
+def _observe_query(sql, seconds):
+    global _queries_total, _sql_seconds_total
+    stats = _current_request.get()
+    if stats is not None:
+        stats.record(sql, seconds)
+    with _lock:
+        _queries_total += 1
+        _sql_seconds_total += seconds
+
+
+database.observe_queries(_observe_query)
+
+
+def _route_label(request):
+    # The path template keeps the label set small: /api/v1/import-jobs/{job_id}
+    route = request.scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+async def record_request(request, call_next):
+    """HTTP middleware: times every request and counts the SQL it runs."""
+    stats = RequestStats(keep_queries=SLOW_REQUEST_SECONDS is not None)
+    token = _current_request.set(stats)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_request.reset(token)
+        key = (request.method, _route_label(request))
+        with _lock:
+            _request_latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            _request_queries.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+            _request_sql_time.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(stats.sql_seconds)
+            _responses[key + (status_code,)] = _responses.get(key + (status_code,), 0) + 1
+        if SLOW_REQUEST_SECONDS is not None and elapsed >= SLOW_REQUEST_SECONDS:
+            _log_slow_request(request, status_code, elapsed, stats)
+
+
+def _log_slow_request(request, status_code, elapsed, stats):
+    target = f"{request.url.path}?{request.url.query}" if request.url.query else request.url.path
+    lines = [
+        f"{request.method} {target} -> {status_code} in {elapsed * 1000:.1f} ms, "
+        f"{stats.queries} queries taking {stats.sql_seconds * 1000:.1f} ms"
+    ]
+    lines += [f"  {seconds * 1000:8.2f} ms  {sql[:200]}" for sql, seconds in stats.statements]
+    if stats.queries > len(stats.statements):
+        lines.append(f"  ... {stats.queries - len(stats.statements)} more queries")
+    slow_log.warning("\n".join(lines))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _histogram_lines(name, help_text, histograms):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for (method, route), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(method=method, route=route, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(method=method, route=route)} {histogram.total}")
+        lines.append(f"{name}_count{_labels(method=method, route=route)} {histogram.count}")
+    return lines
+
+
+def render_metrics():
+    """Returns every metric in the Prometheus text exposition format."""
+    with _lock:
+        lines = _histogram_lines(
+            "http_request_duration_seconds", "Time to handle a request, by route.", _request_latency
+        )
+        lines += _histogram_lines(
+            "http_request_db_queries", "SQL statements run per request, by route.", _request_queries
+        )
+        lines += _histogram_lines(
+            "http_request_db_seconds", "Time spent in SQL statements per request, by route.", _request_sql_time
+        )
+        lines += ["# HELP http_responses_total Responses sent, by route and status.", "# TYPE http_responses_total counter"]
+        lines += [
+            f"http_responses_total{_labels(method=method, route=route, status=status_code)} {count}"
+            for (method, route, status_code), count in sorted(_responses.items())
+        ]
+        lines += [
+            "# HELP db_queries_total SQL statements run, including background imports.",
+            "# TYPE db_queries_total counter",
+            f"db_queries_total {_queries_total}",
+            "# HELP db_query_seconds_total Time spent in SQL statements.",
+            "# TYPE db_query_seconds_total counter",
+            f"db_query_seconds_total {_sql_seconds_total}",
+        ]
+    return "\n".join(lines) + "\n"
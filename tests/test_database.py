@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "stok.db"))
+    database.init_db()
+    database.import_stock(["G1"], [("ITEM A", [5]), ("ITEM B", [5]), ("X\U0010ffff", [1]), ("X\U0010ffffY", [2])])
+    yield
+    database.close_connection()
+
+
+def names(prefix):
+    _, rows = database.query_stock(prefix=prefix)
+    return [nama for _, nama, *_ in rows]
+
+
+def test_prefix_matches_case_insensitively(db):
+    assert names("item") == ["ITEM A", "ITEM B"]
+    assert names("ITEM B") == ["ITEM B"]
+
+
+def test_prefix_ending_in_the_last_code_point(db):
+    assert names("x\U0010ffff") == ["X\U0010ffff", "X\U0010ffffY"]
+    assert names("\U0010ffff") == []
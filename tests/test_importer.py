@@ -0,0 +1,90 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from importer import ImportFormatError, read_workbooks, to_quantities, write_workbook
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "stok.db"))
+    database.init_db()
+    database.import_stock(["G1"], [("ITEM A", [5])])
+    yield
+    database.close_connection()
+
+
+def stock():
+    return dict(database.get_connection().execute(
+        "SELECT k.nama, s.quantity FROM stok s JOIN keramik k ON k.id = s.ceramic_id WHERE s.quantity <> 0"
+    ))
+
+
+def test_failed_parse_leaves_stock_untouched(db):
+    def chunks():
+        yield [("ITEM B", [3])]
+        raise ValueError("broken sheet")
+
+    with pytest.raises(ValueError):
+        write_workbook(["G1"], chunks())
+
+    assert stock() == {"ITEM A": 5}
+
+
+def test_cancelled_write_rolls_back_the_import(db):
+    def on_progress(rows_parsed, rows_written):
+        if rows_written:
+            raise RuntimeError("cancelled")
+
+    with pytest.raises(RuntimeError):
+        write_workbook(["G1"], iter([[("ITEM B", [3])], [("ITEM C", [4])]]), on_progress=on_progress)
+
+    assert stock() == {"ITEM A": 5}
+
+
+def test_workbook_replaces_the_stock_of_its_gudangs(db):
+    stats = write_workbook(["G1"], iter([[("ITEM B", [3])], [("ITEM C", [4])]]))
+
+    assert stats["rows"] == 2
+    assert stock() == {"ITEM B": 3, "ITEM C": 4}
+
+
+def test_workbooks_are_parsed_in_the_pool(tmp_path):
+    paths = [str(tmp_path / "cv.xlsx"), str(tmp_path / "home.xlsx")]
+    pd.DataFrame({"Item": ["item a kw1", "ITEM B"], "G1": [5, None]}).to_excel(paths[0], index=False)
+    pd.DataFrame({"Item": ["ITEM C"], "G2": [2.0], "G3": ["7"]}).to_excel(paths[1], index=False)
+
+    assert read_workbooks(paths) == [
+        (["G1"], [("ITEM A", [5]), ("ITEM B", [0])]),
+        (["G2", "G3"], [("ITEM C", [2, 7])]),
+    ]
+
+
+def test_bad_workbook_in_a_batch_names_its_file(tmp_path):
+    paths = [str(tmp_path / "cv.xlsx"), str(tmp_path / "bad.xlsx")]
+    pd.DataFrame({"Item": ["ITEM A"], "G1": [5]}).to_excel(paths[0], index=False)
+    pd.DataFrame({"Nama": ["ITEM A"], "G1": [5]}).to_excel(paths[1], index=False)
+
+    with pytest.raises(ImportFormatError, match="^bad.xlsx: "):
+        read_workbooks(paths)
+
+
+def test_quantities_follow_int_of_float():
+    cells = pd.DataFrame([
+        [3.9, -2.5, "7", None],
+        ["\uff11\uff12", "1_000", "abc", "nan"],
+    ], dtype=object)
+
+    assert to_quantities(cells).tolist() == [[3, -2, 7, 0], [12, 1000, 0, 0]]
+
+
+@pytest.mark.parametrize("value", [1e20, -1e19, 10 ** 20, "inf", np.inf])
+def test_quantity_outside_int64_is_rejected(value):
+    with pytest.raises(ImportFormatError, match="out of range"):
+        to_quantities(pd.DataFrame([[1, value]], dtype=object))
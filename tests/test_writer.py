@@ -0,0 +1,115 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import writer
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_NAME", str(tmp_path / "stok.db"))
+    database.init_db()
+    database.import_stock(["G1"], [("ITEM A", [5]), ("ITEM B", [5])])
+    commits = []
+    database.observe_commits(lambda: commits.append(database.get_data_version()))
+    yield commits
+    database.observe_commits(None)
+    database.close_connection()
+
+
+def commit_batch(*adjustments):
+    requests = [writer._WriteRequest(database.adjust_stock, (batch,), {}) for batch in adjustments]
+    writer._commit(requests)
+    return [request.future for request in requests]
+
+
+def stock(nama):
+    return database.get_connection().execute(
+        "SELECT s.quantity FROM stok s JOIN keramik k ON k.id = s.ceramic_id WHERE k.nama = ?", (nama,)
+    ).fetchone()[0]
+
+
+def test_failing_write_keeps_version_of_earlier_write(db):
+    before = database.get_data_version()
+    ok, failed = commit_batch(
+        [("set", "ITEM A", "G1", 7, None)],
+        [("delta", "ITEM B", "G1", -100, None)],
+    )
+
+    assert ok.result()[1][0][3:] == [5, 7]
+    with pytest.raises(database.AdjustmentConflict):
+        failed.result()
+    assert database.get_data_version() == before + 1
+    assert db == [before + 1]
+    assert stock("ITEM A") == 7 and stock("ITEM B") == 5
+
+
+def test_writes_around_a_failing_one_share_one_version(db):
+    before = database.get_data_version()
+    first, failed, last = commit_batch(
+        [("set", "ITEM A", "G1", 7, None)],
+        [("delta", "ITEM B", "G1", -100, None)],
+        [("set", "ITEM B", "G1", 9, None)],
+    )
+
+    assert first.result()[0] == last.result()[0] == before + 1
+    with pytest.raises(database.AdjustmentConflict):
+        failed.result()
+    assert database.get_data_version() == before + 1
+    assert db == [before + 1]
+    assert stock("ITEM A") == 7 and stock("ITEM B") == 9
+
+
+def test_failing_first_write_does_not_version_the_batch(db):
+    before = database.get_data_version()
+    failed, ok = commit_batch(
+        [("delta", "ITEM B", "G1", -100, None)],
+        [("set", "ITEM A", "G1", 7, None)],
+    )
+
+    with pytest.raises(database.AdjustmentConflict):
+        failed.result()
+    assert ok.result()[0] == before + 1
+    assert db == [before + 1]
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(writer, "WRITE_QUEUE", True)
+
+
+def test_bulk_write_commits_alone(db, queue):
+    before = database.get_data_version()
+    result = writer.run_bulk_write(database.adjust_stock, [("set", "ITEM A", "G1", 7, None)])
+
+    assert result[0] == before + 1
+    assert db == [before + 1]
+    assert stock("ITEM A") == 7
+
+
+def test_failing_bulk_write_rolls_back_and_is_not_retried(db, queue):
+    calls = []
+
+    def failing_import(conn=None):
+        calls.append(1)
+        database.adjust_stock([("set", "ITEM A", "G1", 7, None)], conn=conn)
+        raise database.sqlite3.OperationalError("disk I/O error")
+
+    with pytest.raises(database.sqlite3.OperationalError):
+        writer.run_bulk_write(failing_import)
+
+    assert calls == [1]
+    assert db == []
+    assert stock("ITEM A") == 5
+
+
+def test_to_gudang_only_applies_to_transfer(db):
+    with pytest.raises(database.AdjustmentError, match="to_gudang only applies to transfer"):
+        database.adjust_stock([("set", "ITEM A", "G1", 7, "G2")])
+
+    assert db == []
+    assert stock("ITEM A") == 5
@@ -0,0 +1,159 @@
+"""
+Optional single writer thread that serializes the database writes of one
+process and group-commits them.
+
+It is off by default: benchmarks/load_test.py measured lower read and
+write throughput with the queue than with every request thread writing
+on its own connection, at every worker count, and the direct mode saw no
+"database is locked" errors. Set STOK_WRITE_QUEUE=1 to turn it on.
+
+The queue exists once per process. Under `uvicorn --workers N` every
+worker has its own writer thread, and the N writers still take turns on
+SQLite's file lock: BEGIN IMMEDIATE waits up to database.BUSY_TIMEOUT, and
+a batch that could not start is retried LOCK_ATTEMPTS times. Adding
+workers does not add write throughput: SQLite allows one writer at a time.
+With the queue on, a workbook import holds the writer thread while the
+workbook is parsed.
+"""
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import database
+
+# With STOK_WRITE_QUEUE=1 writes go through one writer thread per process
+# (see run_write()); by default every caller writes on its own connection.
+WRITE_QUEUE = os.environ.get("STOK_WRITE_QUEUE", "0") == "1"
+
+# Queued writes committed together in one transaction at most
+GROUP_COMMIT_MAX = 64
+
+# Attempts at starting a batch while another process holds the write lock,
+# each after BUSY_TIMEOUT seconds of waiting inside SQLite
+LOCK_ATTEMPTS = 3
+
+_queue = queue.Queue()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+class _WriteRequest:
+    def __init__(self, func, args, kwargs, alone=False):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.alone = alone
+        self.future = Future()
+        # Runs in the caller's context, so its SQL is attributed to the caller's request
+        self.context = contextvars.copy_context()
+
+    def run(self, conn):
+        return self.context.run(self.func, *self.args, conn=conn, **self.kwargs)
+
+
+def submit_write(func, *args, **kwargs):
+    """
+    Queues func(*args, conn=<writer connection>, **kwargs) for the writer
+    thread and returns a Future of its result.
+    """
+    _start()
+    request = _WriteRequest(func, args, kwargs)
+    _queue.put(request)
+    return request.future
+
+
+def run_bulk_write(func, *args, **kwargs):
+    """
+    Like run_write(), but func runs alone in its own transaction, without a
+    savepoint. For imports writing hundreds of thousands of rows: SQLite
+    slows such writes down up to ten times inside a savepoint.
+    """
+    if not WRITE_QUEUE or threading.current_thread() is _thread:
+        return func(*args, **kwargs)
+    _start()
+    request = _WriteRequest(func, args, kwargs, alone=True)
+    _queue.put(request)
+    return request.future.result()
+
+
+def run_write(func, *args, **kwargs):
+    """
+    Runs a database write function on the writer thread and returns its
+    result or raises its exception.
+
+    func must take a conn keyword like the helpers in database.py. Writes
+    queued at the same time are group-committed: they share one
+    transaction, each inside its own savepoint, so a failing write is
+    rolled back alone and the others still commit. Called from the writer
+    thread itself, or with WRITE_QUEUE off, func simply runs in place.
+    """
+    if not WRITE_QUEUE or threading.current_thread() is _thread:
+        return func(*args, **kwargs)
+    return submit_write(func, *args, **kwargs).result()
+
+
+def _start():
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="db-writer", daemon=True)
+            _thread.start()
+
+
+def _run():
+    waiting = None
+    while True:
+        batch = [waiting or _queue.get()]
+        waiting = None
+        while not batch[0].alone and len(batch) < GROUP_COMMIT_MAX:
+            try:
+                request = _queue.get_nowait()
+            except queue.Empty:
+                break
+            if request.alone:
+                # Gets the next transaction to itself
+                waiting = request
+                break
+            batch.append(request)
+        _commit(batch)
+
+
+def _commit(batch):
+    outcomes = []
+    started = False
+    for attempt in range(LOCK_ATTEMPTS):
+        try:
+            with database.transaction() as conn:
+                started = True
+                if batch[0].alone:
+                    outcomes.append((batch[0], True, batch[0].run(conn)))
+                else:
+                    for request in batch:
+                        try:
+                            with database.savepoint(conn):
+                                outcomes.append((request, True, request.run(conn)))
+                        except Exception as e:
+                            outcomes.append((request, False, e))
+            break
+        except sqlite3.OperationalError as e:
+            # Only a batch that never started can be retried: its arguments
+            # may be generators that are already consumed otherwise
+            if started or attempt == LOCK_ATTEMPTS - 1:
+                for request in batch:
+                    request.future.set_exception(e)
+                return
+            time.sleep(0.05 * (attempt + 1))
+        except BaseException as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+    for request, ok, value in outcomes:
+        if ok:
+            request.future.set_result(value)
+        else:
+            request.future.set_exception(value)